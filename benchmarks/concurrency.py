@@ -0,0 +1,93 @@
+'''
+Contention benchmark: point lookup throughput as the number of reader threads grows,
+optionally while another thread holds a long read transaction (like a range scan) or
+keeps writing.
+
+    python benchmarks/concurrency.py --keys 20000 --threads 1 2 4 8
+'''
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xiaolongbaodb.btree import BTree
+
+
+def populate(file_name: str, keys: int, page_size: int):
+    tree = BTree(file_name, page_size=page_size)
+    with tree.handler.write_transaction:
+        for key in range(keys):
+            tree.insert(key, key)
+    tree.close()
+
+
+def run_readers(tree: BTree, keys: int, threads: int, duration: float, hold: bool, writer: bool) -> float:
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def reader(slot: int):
+        rand = random.Random(slot)
+        count = 0
+        while not stop.is_set():
+            tree.get(rand.randrange(keys))
+            count += 1
+        counts[slot] = count
+
+    def long_reader():
+        # a read transaction held for the whole run, readers must not queue behind it
+        with tree.handler.read_transaction:
+            stop.wait()
+
+    def background_writer():
+        rand = random.Random(-1)
+        while not stop.is_set():
+            tree[rand.randrange(keys)] = rand.randrange(keys)
+            time.sleep(0.001)
+
+    workers = [threading.Thread(target=reader, args=(slot,)) for slot in range(threads)]
+    if hold:
+        workers.append(threading.Thread(target=long_reader))
+    if writer:
+        workers.append(threading.Thread(target=background_writer))
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per thread count')
+    parser.add_argument('--page-size', type=int, default=4096)
+    parser.add_argument('--cache-size', type=int, default=64, help='small cache keeps lookups on the I/O path')
+    parser.add_argument('--hold', action='store_true', help='one thread holds a read transaction during the run')
+    parser.add_argument('--writer', action='store_true', help='one thread keeps writing during the run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'bench')
+        populate(file_name, args.keys, args.page_size)
+        tree = BTree(file_name, page_size=args.page_size, cache_size=args.cache_size)
+        try:
+            baseline = None
+            print('{:>8} {:>14} {:>8}'.format('readers', 'lookups/sec', 'scaling'))
+            for threads in args.threads:
+                throughput = run_readers(tree, args.keys, threads, args.duration, args.hold, args.writer)
+                baseline = baseline or throughput
+                print('{:>8} {:>14.0f} {:>7.2f}x'.format(threads, throughput, throughput / baseline))
+        finally:
+            tree.close()
+
+
+if __name__ == '__main__':
+    main()
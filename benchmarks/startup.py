@@ -0,0 +1,68 @@
+'''
+Startup benchmark: time to open a database after a clean close, and after a crash
+that left a large WAL behind, with and without the persisted WAL index.
+
+    python benchmarks/startup.py --keys 50000
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xiaolongbaodb import constants, util
+from xiaolongbaodb.btree import BTree
+
+
+def build(file_name: str, keys: int, page_size: int, close: bool):
+    tree = BTree(file_name, page_size=page_size, durability='off')
+    for key in range(keys):
+        tree.insert(key, key)
+    if close:
+        tree.close()
+    else:
+        # simulate a crash: drop the file descriptors, keep the WAL
+        tree.handler._wal._fd.close()
+        tree.handler._fd.close()
+
+
+def drop_wal_index(file_name: str):
+    wal_fd = util.open_database_file(file_name, suffix='.xdb.wal')
+    util.write_to_file(wal_fd, bytes(constants.WAL_OFFSET_LIMIT), constants.PAGE_LENGTH_LIMIT)
+    wal_fd.close()
+
+
+def time_open(file_name: str, page_size: int) -> float:
+    start = time.perf_counter()
+    tree = BTree(file_name, page_size=page_size)
+    elapsed = time.perf_counter() - start
+    # leave the files untouched for the next measurement
+    tree.handler._wal._fd.close()
+    tree.handler._fd.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--page-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'clean')
+        build(file_name, args.keys, args.page_size, close=True)
+        size = os.path.getsize(file_name + '.xdb')
+        print('clean open        {:>10.4f}s  db {:>12} bytes'.format(time_open(file_name, args.page_size), size))
+
+        file_name = os.path.join(directory, 'crash')
+        build(file_name, args.keys, args.page_size, close=False)
+        size = os.path.getsize(file_name + '.xdb.wal')
+        print('recovery, index   {:>10.4f}s  wal {:>11} bytes'.format(time_open(file_name, args.page_size), size))
+        drop_wal_index(file_name)
+        print('recovery, no index{:>10.4f}s  wal {:>11} bytes'.format(time_open(file_name, args.page_size), size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+'''
+Storage engine benchmark suite: sequential and random inserts, point lookups with a hot and
+a cold cache, range scans, mixed reads and writes from several threads, recovery of a large WAL
+and checkpoints. Each workload reports ops/sec, p50/p99 latency, bytes written per op and fsyncs.
+Runs offline on a temporary directory, random keys are seeded so runs are comparable.
+
+    python benchmarks/suite.py --keys 20000 --json after.json
+    python benchmarks/suite.py --keys 20000 --only lookup_hot range_scan --compare after.json
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xiaolongbaodb
+from xiaolongbaodb.btree import BTree
+
+
+class IOCounter():
+    '''
+    bytes written and fsyncs issued by the process, counted by wrapping the os calls the engine uses
+    '''
+    def __init__(self):
+        self.bytes_written = 0
+        self.fsyncs = 0
+        self._lock = threading.Lock()
+
+    def install(self):
+        pwrite, pwritev, fsync = os.pwrite, os.pwritev, os.fsync
+
+        def counted_pwrite(fd, data, offset):
+            written = pwrite(fd, data, offset)
+            with self._lock:
+                self.bytes_written += written
+            return written
+
+        def counted_pwritev(fd, buffers, offset, *flags):
+            written = pwritev(fd, buffers, offset, *flags)
+            with self._lock:
+                self.bytes_written += written
+            return written
+
+        def counted_fsync(fd):
+            with self._lock:
+                self.fsyncs += 1
+            return fsync(fd)
+
+        os.pwrite, os.pwritev, os.fsync = counted_pwrite, counted_pwritev, counted_fsync
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self.bytes_written, self.fsyncs
+
+
+IO = IOCounter()
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Measurement():
+    '''
+    times a workload, the latency of each op is recorded by the workload itself
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.ops = 0
+        self.extra = dict()
+
+    def __enter__(self):
+        self._io = IO.snapshot()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.seconds = time.perf_counter() - self._start
+        bytes_written, fsyncs = IO.snapshot()
+        self.bytes_written = bytes_written - self._io[0]
+        self.fsyncs = fsyncs - self._io[1]
+
+    def timed(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.latencies.append(time.perf_counter() - start)
+        self.ops += 1
+        return result
+
+    def result(self) -> dict:
+        ops = max(self.ops, 1)
+        return {
+            'name': self.name,
+            'ops': self.ops,
+            'seconds': self.seconds,
+            'ops_per_sec': self.ops / self.seconds if self.seconds else 0.0,
+            'p50_us': percentile(self.latencies, 0.5) * 1e6,
+            'p99_us': percentile(self.latencies, 0.99) * 1e6,
+            'bytes_written': self.bytes_written,
+            'bytes_per_op': self.bytes_written / ops,
+            'fsyncs': self.fsyncs,
+            'fsyncs_per_op': self.fsyncs / ops,
+            **self.extra,
+        }
+
+
+def open_tree(file_name: str, args, **options) -> BTree:
+    options = {'page_size': args.page_size, 'cache_size': args.cache_size, 'durability': args.durability, **options}
+    return BTree(file_name, **options)
+
+
+def crash(tree: BTree):
+    '''
+    drop the file descriptors without a checkpoint, the WAL is left behind as after a crash
+    '''
+    tree.handler._wal._fd.close()
+    tree.handler._fd.close()
+
+
+def drop_page_cache(file_name: str):
+    '''
+    evict the db file from the kernel page cache where possible, for cold reads
+    '''
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(file_name + '.xdb', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def populate(file_name: str, args):
+    tree = open_tree(file_name, args, durability='off')
+    tree.bulk_load((key, 'value-{}'.format(key)) for key in range(args.keys))
+    tree.close()
+
+
+def bench_insert_sequential(directory: str, args) -> dict:
+    tree = open_tree(os.path.join(directory, 'insert_sequential'), args)
+    with Measurement('insert_sequential') as measurement:
+        for key in range(args.keys):
+            measurement.timed(tree.insert, key, 'value-{}'.format(key))
+    tree.close()
+    return measurement.result()
+
+
+def bench_insert_random(directory: str, args) -> dict:
+    keys = list(range(args.keys))
+    random.Random(args.seed).shuffle(keys)
+    tree = open_tree(os.path.join(directory, 'insert_random'), args)
+    with Measurement('insert_random') as measurement:
+        for key in keys:
+            measurement.timed(tree.insert, key, 'value-{}'.format(key))
+    tree.close()
+    return measurement.result()
+
+
+def bench_lookup(directory: str, args, cold: bool) -> dict:
+    name = 'lookup_cold' if cold else 'lookup_hot'
+    file_name = os.path.join(directory, 'lookup')
+    if not os.path.exists(file_name + '.xdb'):
+        populate(file_name, args)
+    rand = random.Random(args.seed)
+    keys = [rand.randrange(args.keys) for _ in range(args.lookups)]
+    if cold:
+        # a cache far smaller than the tree, and nothing left in the kernel page cache
+        drop_page_cache(file_name)
+        tree = open_tree(file_name, args, cache_size=16)
+    else:
+        tree = open_tree(file_name, args, cache_size=max(args.cache_size, args.keys))
+        for key in keys:
+            tree.get(key)
+    with Measurement(name) as measurement:
+        for key in keys:
+            measurement.timed(tree.get, key)
+    tree.close()
+    return measurement.result()
+
+
+def bench_range_scan(directory: str, args) -> dict:
+    file_name = os.path.join(directory, 'lookup')
+    if not os.path.exists(file_name + '.xdb'):
+        populate(file_name, args)
+    rand = random.Random(args.seed)
+    starts = [rand.randrange(max(args.keys - args.scan_length, 1)) for _ in range(args.scans)]
+    tree = open_tree(file_name, args)
+
+    def scan(start: int) -> int:
+        return sum(1 for _ in tree.items(start, start + args.scan_length))
+
+    with Measurement('range_scan') as measurement:
+        pairs = sum(measurement.timed(scan, start) for start in starts)
+    measurement.extra['pairs_per_sec'] = pairs / measurement.seconds
+    tree.close()
+    return measurement.result()
+
+
+def bench_mixed(directory: str, args) -> dict:
+    file_name = os.path.join(directory, 'mixed')
+    populate(file_name, args)
+    tree = open_tree(file_name, args)
+    stop = threading.Event()
+    measurements = [Measurement('mixed') for _ in range(args.threads)]
+
+    def worker(slot: int):
+        rand = random.Random(args.seed + slot)
+        measurement = measurements[slot]
+        while not stop.is_set():
+            key = rand.randrange(args.keys)
+            if rand.random() < args.write_ratio:
+                measurement.timed(tree.insert, key, 'value-{}'.format(rand.random()), True)
+            else:
+                measurement.timed(tree.get, key)
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(args.threads)]
+    with Measurement('mixed') as measurement:
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    for per_thread in measurements:
+        measurement.latencies += per_thread.latencies
+        measurement.ops += per_thread.ops
+    measurement.extra.update(threads=args.threads, write_ratio=args.write_ratio)
+    tree.close()
+    return measurement.result()
+
+
+def bench_recovery(directory: str, args) -> dict:
+    file_name = os.path.join(directory, 'recovery')
+    tree = open_tree(file_name, args, durability='off', checkpoint_frames=None)
+    for key in range(args.keys):
+        tree.insert(key, 'value-{}'.format(key))
+    crash(tree)
+    wal_bytes = os.path.getsize(file_name + '.xdb.wal')
+    with Measurement('recovery') as measurement:
+        tree = measurement.timed(open_tree, file_name, args)
+    measurement.extra['wal_bytes'] = wal_bytes
+    measurement.extra['wal_mb_per_sec'] = wal_bytes / measurement.seconds / 2**20
+    tree.close()
+    return measurement.result()
+
+
+def bench_checkpoint(directory: str, args) -> dict:
+    file_name = os.path.join(directory, 'checkpoint')
+    tree = open_tree(file_name, args, checkpoint_frames=None)
+    rand = random.Random(args.seed)
+    with tree.handler.write_transaction:
+        for key in range(args.keys):
+            tree.insert(key, 'value-{}'.format(key))
+    with tree.handler.write_transaction:
+        for _ in range(args.keys // 10):
+            tree.insert(rand.randrange(args.keys), 'updated', True)
+    frames = tree.handler._wal.frame_count
+    with Measurement('checkpoint') as measurement:
+        measurement.timed(tree.checkpoint, False)
+    measurement.extra['wal_frames'] = frames
+    measurement.extra['frames_per_sec'] = frames / measurement.seconds
+    tree.close()
+    return measurement.result()
+
+
+WORKLOADS = {
+    'insert_sequential': bench_insert_sequential,
+    'insert_random': bench_insert_random,
+    'lookup_hot': lambda directory, args: bench_lookup(directory, args, cold=False),
+    'lookup_cold': lambda directory, args: bench_lookup(directory, args, cold=True),
+    'range_scan': bench_range_scan,
+    'mixed': bench_mixed,
+    'recovery': bench_recovery,
+    'checkpoint': bench_checkpoint,
+}
+
+
+def print_results(results: list, baseline: dict):
+    header = '{:<18} {:>12} {:>10} {:>10} {:>12} {:>10}'.format('workload', 'ops/sec', 'p50 us', 'p99 us', 'bytes/op', 'fsyncs/op')
+    if baseline:
+        header += ' {:>9}'.format('vs base')
+    print(header)
+    for result in results:
+        line = '{name:<18} {ops_per_sec:>12.0f} {p50_us:>10.1f} {p99_us:>10.1f} {bytes_per_op:>12.0f} {fsyncs_per_op:>10.3f}'.format(**result)
+        previous = baseline.get(result['name'])
+        if previous and previous['ops_per_sec']:
+            line += ' {:>8.2f}x'.format(result['ops_per_sec'] / previous['ops_per_sec'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--scans', type=int, default=200)
+    parser.add_argument('--scan-length', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=4, help='threads of the mixed workload')
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='share of writes in the mixed workload')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds of the mixed workload')
+    parser.add_argument('--page-size', type=int, default=4096)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--durability', choices=('full', 'normal', 'off'), default='full')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', nargs='+', choices=sorted(WORKLOADS), help='workloads to run, all by default')
+    parser.add_argument('--json', help='write the results to this file, - for stdout')
+    parser.add_argument('--compare', help='results of a former run (--json) to compare ops/sec with')
+    args = parser.parse_args()
+
+    baseline = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {result['name']: result for result in json.load(f)['results']}
+
+    IO.install()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.only or WORKLOADS:
+            results.append(WORKLOADS[name](directory, args))
+
+    report = {
+        'version': xiaolongbaodb.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import pytest
+from xiaolongbaodb.btree import BTree
+
+
+@pytest.fixture
+def open_tree(tmp_path):
+    '''
+    open_tree(name, **options) opens a BTree in the temporary directory of the test, closed at teardown
+    '''
+    trees = []
+
+    def open_tree(name: str = 'db', **options) -> BTree:
+        tree = BTree(str(tmp_path / name), **options)
+        trees.append(tree)
+        return tree
+
+    yield open_tree
+    for tree in reversed(trees):
+        tree.close()
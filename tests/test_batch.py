@@ -0,0 +1,75 @@
+import random
+import pytest
+
+
+def test_empty_batches(open_tree):
+    tree = open_tree()
+    assert tree.insert_many([]) == 0
+    assert tree.delete_many([]) == 0
+    assert tree.get_many([]) == []
+    assert list(tree.items()) == []
+
+
+def test_get_many(open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, str(key)) for key in range(0, 1000, 3))
+    keys = [999, 3, 4, 3, -1, 600]
+    assert tree.get_many(keys, 'missing') == ['999', '3', 'missing', '3', 'missing', '600']
+
+
+def test_insert_many_refuses_existing_keys(open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(100))
+    with pytest.raises(ValueError):
+        tree.insert_many([(1000, 1), (50, 2)])
+    with pytest.raises(ValueError):
+        tree.insert_many([(2000, 1), (2000, 2)])
+    assert 1000 not in tree and 2000 not in tree and tree.get(50) == 50
+
+
+def test_insert_many_replace(open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, 'a') for key in range(100))
+    assert tree.insert_many([(key, 'b') for key in range(50, 150)], replace=True) == 100
+    assert list(tree.items()) == [(key, 'a' if key < 50 else 'b') for key in range(150)]
+    # the last pair of a key wins
+    tree.insert_many([(7, 'x'), (7, 'y')], replace=True)
+    assert tree.get(7) == 'y'
+
+
+def test_replaced_values_grow_the_leaves(open_tree):
+    tree = open_tree(page_size=4096, order=200, value_size=64)
+    tree.insert_many((key, 'a') for key in range(150))
+    tree.insert_many([(key, 'b' * 63) for key in range(150)], replace=True)
+    tree.close()
+    tree = open_tree(page_size=4096, order=200, value_size=64)
+    assert list(tree.items()) == [(key, 'b' * 63) for key in range(150)]
+    assert tree.verify() == []
+
+
+def test_delete_many(open_tree):
+    tree = open_tree(order=4)
+    tree.insert_many((key, key) for key in range(500))
+    assert tree.delete_many([3, 3, 1000, -1, 4]) == 2
+    assert tree.delete_many(range(0, 500, 2)) == 249
+    assert list(tree.keys()) == [key for key in range(1, 500, 2) if key != 3]
+    assert tree.delete_many(range(500)) == 249
+    assert list(tree.items()) == []
+    tree.insert(1, 1)
+    assert list(tree.items()) == [(1, 1)]
+
+
+def test_random_batches_match_a_dict(open_tree):
+    rand = random.Random(0)
+    tree = open_tree(order=6)
+    expected = dict()
+    for _ in range(30):
+        pairs = [(rand.randrange(2000), rand.randrange(100)) for _ in range(rand.randrange(1, 200))]
+        tree.insert_many(pairs, replace=True)
+        expected.update(pairs)
+        keys = [rand.randrange(2000) for _ in range(rand.randrange(100))]
+        assert tree.delete_many(keys) == len(set(keys) & expected.keys())
+        for key in keys:
+            expected.pop(key, None)
+    assert list(tree.items()) == sorted(expected.items())
+    assert tree.depth > 1
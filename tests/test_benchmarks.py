@@ -0,0 +1,15 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_suite_reports_every_workload(tmp_path):
+    args = ['--keys', '300', '--lookups', '300', '--scans', '5', '--scan-length', '50', '--duration', '0.1',
+            '--threads', '2', '--durability', 'off', '--json', '-']
+    output = subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'suite.py')] + args, cwd=str(tmp_path),
+                            env=dict(os.environ, PYTHONPATH=ROOT), check=True, stdout=subprocess.PIPE).stdout
+    results = json.loads(output.decode())['results']
+    assert results and all(result['ops'] > 0 and result['ops_per_sec'] > 0 for result in results)
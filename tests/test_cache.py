@@ -0,0 +1,82 @@
+import pytest
+from xiaolongbaodb import util
+
+
+@pytest.mark.parametrize('policy', ['lru', 'clock', '2q'])
+def test_capacity_is_kept(policy):
+    cache = util.create_cache(policy, capacity=8)
+    for key in range(100):
+        cache[key] = str(key)
+        assert len(cache) <= 8
+    assert cache.stats.evictions == 92
+    assert 99 in cache and cache[99] == '99'
+
+
+@pytest.mark.parametrize('policy', ['lru', 'clock', '2q'])
+def test_byte_budget(policy):
+    cache = util.create_cache(policy, capacity=None, max_bytes=100, weigher=len)
+    for key in range(20):
+        cache[key] = 'x' * 30
+    assert cache.weight <= 100
+    assert cache.pop(19) == 'x' * 30
+    assert cache.pop(19, None) is None
+    cache.clear()
+    assert len(cache) == 0 and cache.weight == 0
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = util.LRUCache(capacity=3)
+    for key in 'abc':
+        cache[key] = key
+    cache.get('a')
+    cache['d'] = 'd'
+    assert 'b' not in cache and all(key in cache for key in 'acd')
+    assert cache.stats.hits == 1
+
+
+def test_2q_resists_scans():
+    cache = util.TwoQCache(capacity=8)
+    # seen twice, promoted to the main queue
+    for key in range(4):
+        cache[key] = key
+    for key in range(100, 108):
+        cache[key] = key
+    for key in range(4):
+        cache[key] = key
+    for key in range(1000, 1100):
+        cache[key] = key
+    assert all(key in cache for key in range(4))
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        util.create_cache('fifo')
+
+
+def test_values_are_weighed_when_set():
+    cache = util.LRUCache(capacity=None, max_bytes=100, weigher=len)
+    value = [0] * 10
+    cache['a'] = value
+    # grown in place, the cache keeps the weight it was set with
+    value.extend([0] * 50)
+    cache['b'] = [0] * 20
+    assert cache.weight == 30
+    del cache['a']
+    assert cache.weight == 20
+    cache['b'] = [0] * 5
+    assert cache.weight == 5
+
+
+def test_cache_bytes_weighs_the_nodes(open_tree):
+    tree = open_tree(order=50)
+    tree.insert_many((key, 'value{}'.format(key)) for key in range(5000))
+    tree.close()
+    page_size = tree.handler._tree_conf.page_size
+    tree = open_tree(order=50, cache_size=None, cache_bytes=20 * page_size)
+    for key in range(0, 5000, 7):
+        assert tree.get(key) == 'value{}'.format(key)
+    cache = tree.handler._cache
+    assert cache.weight <= 20 * page_size and len(cache) == 20
+    # a materialized node holds its decoded entries, several times its page
+    tree.insert(5000, 'value')
+    assert cache.weight <= 20 * page_size and len(cache) < 20
@@ -0,0 +1,78 @@
+import asyncio
+import contextvars
+import pytest
+import xiaolongbaodb
+
+
+def run(tmp_path, test, **options):
+    '''
+    run test(db) in an event loop, with the database of the test open
+    '''
+    async def main():
+        async with xiaolongbaodb.connect(str(tmp_path / 'db'), **options) as db:
+            await test(db)
+    asyncio.run(main())
+
+
+def test_concurrent_writes_are_coalesced(tmp_path):
+    async def test(db):
+        fsyncs = db.tree.handler.stats.fsyncs
+        await asyncio.gather(*(db.put(key, str(key)) for key in range(500)))
+        assert db.tree.handler.stats.fsyncs - fsyncs < 100
+        assert await db.get_many([0, 499, 500]) == ['0', '499', None]
+        assert [key async for key in db.keys(10, 15)] == [10, 11, 12, 13, 14]
+        assert [key async for key in db.keys(reverse=True, batch_size=3)] == list(range(499, -1, -1))
+    run(tmp_path, test)
+
+
+def test_failed_write_does_not_fail_its_group(tmp_path):
+    async def test(db):
+        await db.put(1, 'a')
+        results = await asyncio.gather(db.insert(1, 'b'), db.put(2, 'c'), db.delete(3), db.put(object(), 'd'),
+                                       return_exceptions=True)
+        assert [type(result) for result in results] == [ValueError, type(None), KeyError, TypeError]
+        assert await db.get_many([1, 2]) == ['a', 'c']
+    run(tmp_path, test)
+
+
+def test_transaction_commit_and_rollback(tmp_path):
+    async def test(db):
+        async with db.transaction():
+            await db.put(1, 'a')
+            await asyncio.gather(db.put(2, 'b'), db.put(3, 'c'))
+            assert [key async for key in db.keys()] == [1, 2, 3]
+        with pytest.raises(RuntimeError):
+            async with db.transaction():
+                await db.delete(1)
+                await db.put(4, 'd')
+                raise RuntimeError('abort')
+        assert [pair async for pair in db.items()] == [(1, 'a'), (2, 'b'), (3, 'c')]
+        assert await db.insert_many([(5, 'e'), (6, 'f')]) == 2
+        with pytest.raises(Exception):
+            await db.insert_many([(7, 'g'), (8, object())])
+        assert not await db.contains(7)
+        assert await db.verify() == []
+    run(tmp_path, test)
+
+
+def test_writes_of_other_tasks_wait_for_the_transaction(tmp_path):
+    async def test(db):
+        async with db.transaction():
+            await db.put(1, 'a')
+            # a task created here would join the transaction
+            other = asyncio.get_running_loop().create_task(db.put(2, 'b'), context=contextvars.Context())
+            await asyncio.sleep(0.05)
+            assert not other.done()
+        await other
+        assert await db.get(2) == 'b'
+    run(tmp_path, test)
+
+
+def test_reopen(tmp_path):
+    async def write(db):
+        await asyncio.gather(*(db.put(key, key) for key in range(100)))
+
+    async def read(db):
+        assert [key async for key in db] == list(range(100))
+    run(tmp_path, write)
+    run(tmp_path, read)
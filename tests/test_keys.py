@@ -0,0 +1,79 @@
+import random
+import pytest
+from xiaolongbaodb import serializer
+
+SAMPLES = [0, -1, 2 ** 63 - 1, -2 ** 63, 1.5, -0.0, float('inf'), '', 'xiaolongbao', '\x00￿', b'', b'\x00\xff',
+           (1, 'a', b'b', 2.5), ((1, 2), ('x',)), {'a': [1, 2]}, [1, 'b']]
+
+
+@pytest.mark.parametrize('value', SAMPLES, ids=repr)
+def test_serializers_round_trip(value):
+    value_ser = serializer.serializer_switcher(type(value))
+    data = value_ser.serialize(value)
+    assert serializer.serializer_loader(value_ser.SERIALIZER_TYPE).deserialize(data) == value
+
+
+@pytest.mark.parametrize('keys', [
+    [-2 ** 63, -5, -1, 0, 1, 255, 256, 2 ** 40, 2 ** 63 - 1],
+    [float('-inf'), -1e300, -2.5, -0.5, 0.0, 1e-300, 0.5, 3.25, 1e300, float('inf')],
+    ['', '\x00', '\x00\x00', 'a', 'a\x00', 'ab', 'b', 'é', '￿'],
+    [b'', b'\x00', b'\x00\x00', b'\x00\x01', b'\x01', b'\xff', b'\xff\x00'],
+    [('a',), ('a', b''), ('a', b'\x00'), ('a', b'\x00', 'x'), ('a', b'\x01'), ('a\x00',), ('b', b'')],
+], ids=['int', 'float', 'str', 'bytes', 'tuple'])
+def test_ordered_encodings(keys):
+    assert keys == sorted(keys)
+    encoded = [serializer.ordered_key(key) for key in keys]
+    assert None not in encoded and encoded == sorted(encoded)
+
+
+def test_tuples_holding_numbers_are_not_compared_as_bytes():
+    assert serializer.ordered_key((1, 'a')) is None
+    assert serializer.ordered_key(('a', (2.5,))) is None
+    assert serializer.ordered_key(('a', b'b')) is not None
+
+
+def reopen_sorted(open_tree, keys, **options):
+    tree = open_tree(**options)
+    shuffled = list(keys)
+    random.Random(0).shuffle(shuffled)
+    for key in shuffled:
+        tree.insert(key, repr(key))
+    tree.close()
+    tree = open_tree(**options)
+    keys = sorted(keys)
+    assert list(tree.keys()) == keys
+    assert all(tree.get(key) == repr(key) for key in keys)
+    assert tree.get_many(keys) == [repr(key) for key in keys]
+    return tree
+
+
+def test_ints_and_floats(open_tree):
+    keys = [-3, -2.5, -1, 0, 0.5, 1, 1.5, 2, 2.5, 3, 10 ** 12, 10 ** 12 + 0.5]
+    tree = reopen_sorted(open_tree, keys, order=4)
+    assert list(tree.keys(0.25, 2)) == [0.5, 1, 1.5]
+    assert tree.get(2.0) == '2'
+    assert tree.get(0.75) is None
+
+
+def test_tuples_mixing_ints_and_floats(open_tree):
+    keys = [(1,), (1.5,), (2,), (2.5,), (3,), (2, 1), (2, 0.5), (2.5, (1, 2)), (2.5, (1.5,))]
+    tree = reopen_sorted(open_tree, keys, order=4, key_size=48)
+    assert tree.get((2,)) == '(2,)'
+    assert (2.25,) not in tree
+
+
+def test_tuples(open_tree):
+    rand = random.Random(1)
+    keys = {(rand.choice('abc'), rand.randrange(100), rand.choice((b'', b'x', b'\x00'))) for _ in range(500)}
+    tree = reopen_sorted(open_tree, keys, order=16, key_size=32)
+    assert list(tree.keys(('b',), ('c',))) == sorted(key for key in keys if key[0] == 'b')
+
+
+def test_long_and_binary_keys(open_tree):
+    keys = [b'\x00' * length for length in range(1, 16)] + [b'\x00\xff' * 7, b'\xff' * 16, b'\xff' * 15]
+    tree = open_tree(key_size=16)
+    for key in keys:
+        tree.insert(key, 1)
+    assert list(tree.keys(end=b'\xff')) == sorted(key for key in keys if key < b'\xff')
+    with pytest.raises(ValueError):
+        tree.insert(b'x' * 17, 1)
@@ -0,0 +1,45 @@
+import random
+from xiaolongbaodb.node import BNode, OverflowNode, FreelistNode
+
+
+def test_lookups_keep_nodes_lazy(open_tree):
+    tree = open_tree(order=16)
+    tree.insert_many((key, str(key)) for key in range(1000))
+    tree.checkpoint()
+    tree.close()
+    tree = open_tree(order=16)
+    assert tree.get(500) == '500' and 501 in tree and tree.get(1500) is None
+    assert list(tree.keys(100, 104)) == [100, 101, 102, 103]
+    path = [node for node, _ in tree._path_to(500)]
+    assert len(path) > 1
+    # read from the raw page, not decoded into lists
+    assert all(node._view is not None for node in path)
+    tree.insert(500, 'five hundred', replace=True)
+    leaf = tree._path_to(500)[-1][0]
+    assert leaf._view is None and leaf.keys[leaf.bisect_left(500)] == 500
+    assert tree.get(500) == 'five hundred'
+
+
+def test_nodes_have_no_instance_dict(open_tree):
+    tree = open_tree()
+    for cls in (BNode, OverflowNode, FreelistNode):
+        assert '__dict__' not in dir(cls)
+    assert not hasattr(tree._root, '__dict__')
+
+
+def test_random_changes_match_a_dict(open_tree):
+    rand = random.Random(0)
+    tree = open_tree(order=4, key_size=32)
+    expected = {}
+    for _ in range(3000):
+        key = 'key/{}'.format(rand.randrange(500))
+        if rand.random() < 0.6:
+            expected[key] = rand.randrange(1000)
+            tree.insert(key, expected[key], replace=True)
+        elif key in expected:
+            del expected[key]
+            tree.delete(key)
+    assert list(tree.items()) == sorted(expected.items())
+    tree.close()
+    tree = open_tree(order=4, key_size=32)
+    assert list(tree.items(reverse=True)) == sorted(expected.items(), reverse=True)
@@ -0,0 +1,111 @@
+import random
+import pytest
+from xiaolongbaodb.shard import ShardedBTree
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def open_store(name: str = 'db', **options) -> ShardedBTree:
+        store = ShardedBTree(str(tmp_path / name), **options)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in reversed(stores):
+        store.close()
+
+
+def test_hash_routing(open_store):
+    store = open_store(shards=5, order=16)
+    keys = list(range(2000))
+    random.Random(0).shuffle(keys)
+    for key in keys[:500]:
+        store[key] = str(key)
+    assert store.insert_many((key, str(key)) for key in keys[500:]) == 1500
+    for index in range(5):
+        shard_keys = list(store.shard(index).keys())
+        assert shard_keys and all(store.shard_of(key) == index for key in shard_keys)
+    assert store.get_many([3, -1, 1999], 'missing') == ['3', 'missing', '1999']
+    assert 7 in store and store[7] == '7'
+    del store[7]
+    assert 7 not in store
+    with pytest.raises(KeyError):
+        store[7]
+
+
+def test_equal_numeric_keys_share_a_shard(open_store):
+    for name, keys, equal_keys in (('numbers', [1, 2.0, -3, 0.0, 2 ** 40], [1.0, 2, -3.0, -0.0, float(2 ** 40)]),
+                                   ('tuples', [(1, 'a'), (2.0, (3.0,))], [(1.0, 'a'), (2, (3,))])):
+        store = open_store(name, shards=7, key_size=32)
+        for key, same in zip(keys, equal_keys):
+            store[key] = repr(key)
+            assert store.shard_of(key) == store.shard_of(same)
+            assert store[same] == repr(key)
+    store.insert((1.0, 'a'), 'one', replace=True)
+    assert store.get((1, 'a')) == 'one'
+    assert len(list(store.keys())) == 2
+
+
+def test_merged_scans(open_store):
+    store = open_store(shards=3, order=8)
+    store.insert_many((key, key) for key in range(0, 1000, 2))
+    assert list(store.keys()) == list(range(0, 1000, 2))
+    assert list(store.items(101, 111)) == [(key, key) for key in range(102, 111, 2)]
+    assert list(store.keys(11, reverse=True))[-3:] == [16, 14, 12]
+    assert store.delete_many(range(0, 1000, 4)) == 250
+    assert list(store) == list(range(2, 1000, 4))
+
+
+def test_range_partitioning(open_store):
+    words = ['apple', 'b', 'g', 'grape', 'kiwi', 'p', 'pear', 'zed']
+    store = open_store('words', boundaries=['g', 'p'])
+    store.insert_many((word, len(word)) for word in words)
+    assert [store.shard_of(word) for word in ('a', 'g', 'o', 'p', 'z')] == [0, 1, 1, 2, 2]
+    assert list(store.keys()) == words
+    assert list(store.keys('c', 'q')) == ['g', 'grape', 'kiwi', 'p', 'pear']
+    assert list(store.keys('c', 'p', reverse=True)) == ['kiwi', 'grape', 'g']
+    with pytest.raises(ValueError):
+        open_store('bad', boundaries=['p', 'g'])
+
+
+def test_layout_is_kept(open_store):
+    store = open_store(shards=3)
+    store.insert_many((key, key) for key in range(100))
+    store.close()
+    with pytest.raises(ValueError):
+        open_store(shards=4)
+    store = open_store()
+    assert store.shard_count == 3
+    assert list(store.items()) == [(key, key) for key in range(100)]
+
+
+def test_batches_are_atomic_per_shard(open_store):
+    store = open_store(shards=4)
+    store.insert(0, 'a')
+    other = next(key for key in range(1, 100) if store.shard_of(key) != store.shard_of(0))
+    with pytest.raises(ValueError):
+        store.insert_many([(0, 'b'), (other, 'c')])
+    assert store.get(0) == 'a' and store.get(other) == 'c'
+
+
+def test_partially_open_store(open_store):
+    open_store(shards=2).close()
+    store = open_store(open_shards=[0])
+    key = next(key for key in range(100) if store.shard_of(key) == 1)
+    with pytest.raises(ValueError):
+        store[key] = 1
+    with pytest.raises(ValueError):
+        open_store(open_shards=[2])
+
+
+def test_maintenance(open_store):
+    store = open_store(shards=2, order=8)
+    store.insert_many((key, 'v' * 20) for key in range(3000))
+    store.delete_many(range(2900))
+    store.checkpoint()
+    assert store.vacuum() > 0
+    assert store.verify() == {}
+    assert set(store.stats()) == {0, 1}
+    assert list(store.keys()) == list(range(2900, 3000))
@@ -0,0 +1,86 @@
+import gc
+import operator
+import threading
+import pytest
+
+
+def keys_of(pairs) -> list:
+    return [key for key, _ in pairs]
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_snapshot_isolation(open_tree, use_mmap):
+    tree = open_tree(order=16, checkpoint_frames=20, use_mmap=use_mmap)
+    tree.insert_many((key, 'v') for key in range(1000))
+    tree.checkpoint()
+    tree.insert(1000, 'w')
+    expected = dict.fromkeys(range(1000), 'v')
+    expected[1000] = 'w'
+    with tree.snapshot() as snapshot:
+        def write():
+            for key in range(0, 2000, 3):
+                tree.insert(key, 'x' * 100, replace=True)
+            tree.delete_many(range(1, 1000, 3))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while writer.is_alive():
+            assert snapshot.get(500) == 'v'
+        writer.join()
+        assert dict(snapshot.items()) == expected
+        assert list(snapshot.keys(10, 13)) == [10, 11, 12]
+        assert list(snapshot.keys(reverse=True))[:2] == [1000, 999]
+        # checkpoints wait for the snapshot, the WAL keeps growing meanwhile
+        assert tree.stats()['wal_pending_frames'] > 20
+    assert tree.get(1) is None and tree.get(3) == 'x' * 100
+    tree.insert(5000, 'z')
+    assert tree.stats()['wal_pending_frames'] < 20
+
+
+def test_snapshot_is_read_only(open_tree):
+    tree = open_tree()
+    tree.insert(1, 'a')
+    snapshot = tree.snapshot()
+    for write in (lambda: snapshot.insert(2, 'b'), lambda: snapshot.delete(1), lambda: snapshot.insert_many([])):
+        with pytest.raises(TypeError):
+            write()
+    with pytest.raises(RuntimeError):
+        tree.vacuum()
+    snapshot.close()
+    tree.vacuum()
+
+
+def test_snapshot_inside_a_write_transaction(open_tree):
+    tree = open_tree()
+    with pytest.raises(RuntimeError):
+        with tree.handler.write_transaction:
+            tree.snapshot()
+
+
+def test_forgotten_snapshot_is_released(open_tree):
+    tree = open_tree()
+    tree.insert(1, 'a')
+    tree.snapshot()
+    gc.collect()
+    assert not tree.handler._snapshots
+    tree.vacuum()
+
+
+def test_split_range(open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(2000))
+    ranges = tree.split_range(100, 1900, parts=6)
+    assert 1 < len(ranges) <= 6
+    assert ranges[0][0] == 100 and ranges[-1][1] == 1900
+    assert all(left[1] == right[0] for left, right in zip(ranges, ranges[1:]))
+    assert tree.split_range(5, 5) == [(5, 5)]
+
+
+def test_parallel_aggregates(open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(5000))
+    assert tree.count(workers=2) == 5000
+    assert tree.count(1000, 2000, workers=2) == 1000
+    assert tree.sum(workers=2) == sum(range(5000))
+    assert tree.map_reduce(keys_of, operator.add, 10, 4000, workers=3) == list(range(10, 4000))
+    assert tree.count(7000, workers=2) == 0
@@ -0,0 +1,191 @@
+import random
+import threading
+import pytest
+from xiaolongbaodb import util
+
+
+def text(rand: random.Random, length: int) -> str:
+    return ''.join(rand.choice('abcdefgh') for _ in range(length))
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib', 'lzma'])
+def test_overflow_and_compression_round_trip(open_tree, compression):
+    rand = random.Random(0)
+    values = {key: text(rand, rand.choice((10, 200, 20000))) for key in range(60)}
+    values[60] = b'\x00' * 50000
+    tree = open_tree(value_size=64, compression=compression)
+    tree.insert_many(values.items())
+    values[7] = text(rand, 30000)
+    tree.insert(7, values[7], replace=True)
+    tree.delete(8)
+    del values[8]
+    tree.close()
+    tree = open_tree(value_size=64)
+    assert dict(tree.items()) == values
+    assert tree.verify() == []
+
+
+def test_compression_applies_to_new_values(open_tree):
+    tree = open_tree(value_size=64)
+    tree.insert(1, 'a' * 10000)
+    tree.close()
+    tree = open_tree(value_size=64, compression='zlib')
+    tree.insert(2, 'b' * 10000)
+    assert tree.get(1) == 'a' * 10000 and tree.get(2) == 'b' * 10000
+
+
+def test_values_larger_than_a_page_fraction(open_tree):
+    # a value size larger than the page, the large values still go to overflow pages
+    tree = open_tree(page_size=512, value_size=2000)
+    tree.insert(1, 'x' * 1500)
+    tree.insert_many((key, 'y' * 90) for key in range(2, 100))
+    tree.close()
+    tree = open_tree(page_size=512, value_size=2000)
+    assert tree.get(1) == 'x' * 1500
+    assert list(tree.values())[1:] == ['y' * 90] * 98
+    assert tree.verify() == []
+
+
+def test_key_size_must_fit_the_page(open_tree):
+    with pytest.raises(ValueError):
+        open_tree(page_size=512, key_size=200)
+
+
+def test_vacuum_then_verify(open_tree):
+    tree = open_tree(order=8, value_size=32)
+    tree.insert_many((key, 'v' * (5000 if key % 10 == 0 else 10)) for key in range(2000))
+    tree.delete_many(range(0, 1900))
+    before = tree.handler.last_page
+    assert tree.vacuum() > 0
+    assert tree.handler.last_page < before
+    assert tree.verify() == []
+    expected = [(key, 'v' * (5000 if key % 10 == 0 else 10)) for key in range(1900, 2000)]
+    assert list(tree.items()) == expected
+    tree.checkpoint()
+    tree.close()
+    tree = open_tree(order=8, value_size=32)
+    assert list(tree.items()) == expected
+    assert tree.verify() == []
+
+
+def test_verify_finds_corrupted_pages(open_tree, tmp_path):
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(500))
+    tree.checkpoint()
+    page_size = tree.handler._tree_conf.page_size
+    tree.close()
+    with open(str(tmp_path / 'db.xdb'), 'r+b') as f:
+        f.seek(3 * page_size + 100)
+        byte = f.read(1)
+        f.seek(3 * page_size + 100)
+        f.write(bytes((byte[0] ^ 0xff,)))
+    tree = open_tree(order=8)
+    assert tree.verify() == [3]
+    with pytest.raises(util.ChecksumError):
+        list(tree.items())
+
+
+def test_freed_pages_are_reused(open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(3000))
+    last_page = tree.handler.last_page
+    tree.delete_many(range(3000))
+    tree.insert_many((key, key) for key in range(3000))
+    assert tree.handler.last_page <= last_page + 1
+
+
+@pytest.mark.parametrize('presorted', [True, False])
+def test_bulk_load(open_tree, presorted):
+    pairs = [(key, str(key)) for key in range(10000)]
+    if not presorted:
+        random.Random(0).shuffle(pairs)
+    tree = open_tree(order=20)
+    assert tree.bulk_load(pairs, presorted=presorted, sort_buffer=1000) == 10000
+    assert list(tree.keys()) == list(range(10000))
+    tree.insert(-1, 'first')
+    assert tree.get(-1) == 'first' and tree.get(5000) == '5000'
+    with pytest.raises(ValueError):
+        tree.bulk_load([(20000, 'x')])
+    assert tree.verify() == []
+
+
+def test_memory_mapped_reads(open_tree):
+    tree = open_tree(order=16, use_mmap=True)
+    tree.insert_many((key, str(key)) for key in range(2000))
+    tree.checkpoint()
+    # pages changed after the checkpoint are read from the WAL, the others from the mapping
+    tree.insert_many(((key, 'new') for key in range(0, 2000, 100)), replace=True)
+    tree.insert_many((key, str(key)) for key in range(2000, 3000))
+    assert tree.get(100) == 'new' and tree.get(101) == '101' and tree.get(2999) == '2999'
+    tree.close()
+    tree = open_tree(order=16, use_mmap=True)
+    assert len(list(tree.keys())) == 3000 and tree.get(1900) == 'new'
+
+
+def test_concurrent_reads(open_tree):
+    tree = open_tree(order=16, cache_size=8)
+    tree.insert_many((key, str(key)) for key in range(5000))
+    tree.checkpoint()
+    errors = []
+
+    def read(seed: int):
+        rand = random.Random(seed)
+        try:
+            for _ in range(500):
+                key = rand.randrange(5000)
+                assert tree.get(key) == str(key)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read, args=(seed,)) for seed in range(8)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    assert not errors
+
+
+def test_range_scans(open_tree):
+    tree = open_tree(order=16)
+    tree.insert_many((key, key * 2) for key in range(0, 4000, 2))
+    assert list(tree.keys(101, 111)) == [102, 104, 106, 108, 110]
+    assert list(tree.keys(3990)) == [3990, 3992, 3994, 3996, 3998]
+    assert list(tree.keys(end=5, reverse=True)) == [4, 2, 0]
+    assert list(tree.items()) == [(key, key * 2) for key in range(0, 4000, 2)]
+    assert list(tree.values(reverse=True))[:2] == [7996, 7992]
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+@pytest.mark.parametrize('readahead', [0, 32])
+def test_read_ahead_scans(open_tree, use_mmap, readahead):
+    tree = open_tree(order=16, cache_size=8)
+    tree.insert_many((key, key * 2) for key in range(0, 4000, 2))
+    tree.checkpoint()
+    tree.close()
+    tree = open_tree(order=16, cache_size=8, use_mmap=use_mmap, readahead=readahead)
+    assert list(tree.keys(101, 111)) == [102, 104, 106, 108, 110]
+    assert list(tree.items()) == [(key, key * 2) for key in range(0, 4000, 2)]
+    assert list(tree.values(reverse=True))[:2] == [7996, 7992]
+
+
+def test_shared_key_prefixes(open_tree):
+    keys = ['user/{:08d}/name'.format(key) for key in range(2000)]
+    tree = open_tree(order=50, key_size=32)
+    tree.insert_many((key, index) for index, key in enumerate(keys))
+    tree.close()
+    tree = open_tree(order=50, key_size=32)
+    assert list(tree.keys()) == keys
+    assert tree.get('user/00001234/name') == 1234
+    assert tree.get('user/00001234/nam') is None
+
+
+def test_trace(open_tree):
+    tree = open_tree()
+    calls = []
+    tree.trace(lambda operation, args, seconds: calls.append((operation, args)))
+    tree.insert(1, 'a')
+    assert tree.get(1) == 'a'
+    assert list(tree.keys()) == [1]
+    tree.trace(None)
+    tree.get(1)
+    assert calls == [('insert', (1, 'a')), ('get', (1,)), ('items', (None, None, False))]
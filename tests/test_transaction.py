@@ -0,0 +1,197 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import pytest
+from xiaolongbaodb.btree import BTree
+from xiaolongbaodb.handler import WAL
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def crash(tmp_path, script: str):
+    '''
+    run script in a process which exits without closing anything, the tree file is db
+    '''
+    script = 'import os\nfrom xiaolongbaodb.btree import BTree\n' + textwrap.dedent(script) + '\nos._exit(0)\n'
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, '-c', script], cwd=str(tmp_path), env=env, check=True)
+
+
+def test_failed_batch_is_rolled_back(open_tree):
+    tree = open_tree(order=4)
+    tree.insert(0, 'a')
+    with pytest.raises(Exception):
+        tree.insert_many([(key, 'v') for key in range(1, 50)] + [(50, object())])
+    assert list(tree.keys()) == [0]
+    # the root split by the failed batch is not used afterwards
+    tree.insert(9, 'b')
+    assert list(tree.items()) == [(0, 'a'), (9, 'b')]
+
+
+def test_rollback_survives_reopen(open_tree, tmp_path):
+    tree = open_tree(order=4)
+    tree.insert_many([(key, key) for key in range(30)])
+    with pytest.raises(ValueError):
+        with tree.handler.write_transaction:
+            tree.delete_many(range(0, 30, 2))
+            tree.insert(100, 100)
+            raise ValueError('abort')
+    tree.close()
+    tree = open_tree(order=4)
+    assert list(tree.items()) == [(key, key) for key in range(30)]
+    assert tree.verify() == []
+
+
+def test_rollback_gives_back_pages(open_tree):
+    tree = open_tree(value_size=32)
+    tree.insert_many((key, 'x' * 5000) for key in range(0, 500, 50))
+    tree.delete(50)
+    free, last_page = len(tree.handler._free_pages), tree.handler.last_page
+    with pytest.raises(Exception):
+        tree.insert_many([(100, 'y' * 30000), (700, 'z' * 9000), (300, object())], replace=True)
+    assert (len(tree.handler._free_pages), tree.handler.last_page) == (free, last_page)
+    assert tree.get(100) == 'x' * 5000 and 700 not in tree
+
+
+def test_pages_freed_by_a_rolled_back_transaction_stay_in_use(open_tree):
+    tree = open_tree(value_size=32)
+    tree.insert(100, 'x' * 10000)
+    with pytest.raises(Exception):
+        tree.insert_many([(100, 'replacement'), (300, object())], replace=True)
+    # would reuse the overflow pages of the value still in place
+    tree.insert(200, 'z' * 10000)
+    tree.close()
+    tree = open_tree(value_size=32)
+    assert tree.get(100) == 'x' * 10000 and tree.get(200) == 'z' * 10000
+
+
+@pytest.mark.parametrize('durability', ['full', 'normal'])
+def test_crash_recovers_from_the_wal(tmp_path, open_tree, durability):
+    crash(tmp_path, '''
+        tree = BTree('db', order=4, checkpoint_frames=None, durability={durability!r})
+        tree.insert_many([(key, key) for key in range(100)])
+        for key in range(100, 150):
+            tree.insert(key, key)
+        tree.delete_many(range(40))
+    '''.format(durability=durability))
+    assert os.path.exists(str(tmp_path / 'db.xdb.wal'))
+    tree = open_tree(order=4)
+    assert list(tree.items()) == [(key, key) for key in range(40, 150)]
+    assert tree.verify() == []
+
+
+def test_torn_wal_tail_is_ignored(tmp_path, open_tree):
+    crash(tmp_path, '''
+        tree = BTree('db', order=4, checkpoint_frames=None)
+        tree.insert_many([(key, key) for key in range(20)])
+    ''')
+    with open(str(tmp_path / 'db.xdb.wal'), 'ab') as f:
+        f.write(os.urandom(100))
+    tree = open_tree(order=4)
+    assert list(tree.keys()) == list(range(20))
+
+
+def test_crash_after_reusing_free_pages(tmp_path, open_tree):
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(3000))
+    tree.delete_many(range(3000))
+    tree.close()
+    # the free pages persisted by the clean close are reused, and only logged into the WAL
+    crash(tmp_path, '''
+        tree = BTree('db', order=8, checkpoint_frames=None)
+        tree.insert_many([(key, key) for key in range(2000)])
+    ''')
+    tree = open_tree(order=8)
+    tree.insert_many((key, key) for key in range(5000, 7000))
+    assert list(tree.keys()) == list(range(2000)) + list(range(5000, 7000))
+    assert tree.verify() == []
+
+
+def test_meta_page_follows_the_wal(tmp_path):
+    tree = BTree(str(tmp_path / 'db'), order=4, durability='normal')
+    tree.insert(1, 'a')
+    tree.insert(2, 'b')
+    tree.checkpoint()
+    for key in range(3, 20):
+        tree.insert(key, 'v')
+    # lose the WAL frames which were never synced: the db file alone must be consistent
+    with open(str(tmp_path / 'db.xdb'), 'rb') as f:
+        data = f.read()
+    with open(str(tmp_path / 'db.xdb.wal'), 'rb') as f:
+        header = f.read(WAL.HEADER_LENGTH)
+    with open(str(tmp_path / 'copy.xdb'), 'wb') as f:
+        f.write(data)
+    with open(str(tmp_path / 'copy.xdb.wal'), 'wb') as f:
+        f.write(header)
+    copy = BTree(str(tmp_path / 'copy'), order=4)
+    try:
+        assert list(copy.keys()) == [1, 2]
+    finally:
+        copy.close()
+        tree.close()
+
+
+def test_concurrent_writers(open_tree):
+    tree = open_tree(group_commit_window=0.001)
+
+    def write(base: int):
+        for key in range(base, base + 200):
+            tree.insert(key, key)
+
+    threads = [threading.Thread(target=write, args=(base,)) for base in range(0, 800, 200)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert list(tree.keys()) == list(range(800))
+
+
+def test_readers_run_alongside_a_writer(open_tree):
+    tree = open_tree(order=8, cache_size=16)
+    tree.insert_many((key, 0) for key in range(1000))
+    errors = []
+
+    def read():
+        try:
+            for _ in range(20):
+                with tree.handler.read_transaction:
+                    # a transaction commits all of its keys at once
+                    assert len(set(tree.values())) == 1
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for value in range(1, 20):
+        tree.insert_many([(key, value) for key in range(1000)], replace=True)
+    for reader in readers:
+        reader.join()
+    assert not errors
+
+
+def test_automatic_checkpoint(open_tree):
+    tree = open_tree(order=8, checkpoint_frames=50)
+    for key in range(500):
+        tree.insert(key, key)
+    assert tree.stats()['wal_pending_frames'] < 50
+    assert tree.handler.stats.checkpoints > 0
+    tree.close()
+    tree = open_tree(order=8)
+    assert list(tree.keys()) == list(range(500))
+
+
+@pytest.mark.parametrize('dirty_pages', [0, 4, 10000])
+def test_dirty_pages_of_a_large_transaction(open_tree, dirty_pages):
+    tree = open_tree(order=6, dirty_pages=dirty_pages)
+    with pytest.raises(ValueError):
+        with tree.handler.write_transaction:
+            tree.insert_many([(key, key) for key in range(500)])
+            raise ValueError('abort')
+    assert list(tree.items()) == []
+    tree.insert_many([(key, key) for key in range(500)])
+    tree.close()
+    tree = open_tree(order=6)
+    assert list(tree.keys()) == list(range(500))
@@ -1,4 +1,16 @@
 __version__ = '0.0.1'
 
-def connect(file_name: str = 'xiaolongbao.db'):
-    pass
\ No newline at end of file
+from xiaolongbaodb.database import AsyncBTree, AsyncTransaction
+
+
+def connect(file_name: str = 'xiaolongbao.db', **options) -> AsyncBTree:
+    '''
+    open a database for asyncio, either awaited or as an async context manager:
+
+        db = await xiaolongbaodb.connect('db')
+        async with xiaolongbaodb.connect('db') as db:
+            ...
+
+    :param options: passed to AsyncBTree and BTree
+    '''
+    return AsyncBTree(file_name, **options)
@@ -1,19 +1,94 @@
 import logging
 import bisect
+import collections
+import concurrent.futures
+import functools
+import inspect
+import itertools
+import operator
+import os
+import time
+from xiaolongbaodb import util
+from xiaolongbaodb.serializer import Compression
 from xiaolongbaodb.constants import *
-from xiaolongbaodb.handler import FileHandler
-from xiaolongbaodb.node import BNode
+from xiaolongbaodb.handler import FileHandler, SnapshotHandler
+from xiaolongbaodb.node import BNode, check_tree_conf, encode_value, page_capacity, resident_value, serialize_key
 
 logger = logging.getLogger(DEFAULT_LOGGER_NAME)
 
+_MISSING = object()
+
+# public operations reported to the tracer of a tree, see BTree.trace
+TRACED_OPERATIONS = ('get', '__getitem__', '__contains__', 'items', 'insert', 'delete', 'get_many', 'insert_many',
+                     'delete_many', 'bulk_load', 'checkpoint', 'vacuum', 'verify', 'map_reduce')
+
+
+def _traced(method):
+    name = method.__name__
+
+    if inspect.isgeneratorfunction(method):
+        def traced(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from method(self, *args, **kwargs)
+            finally:
+                self._tracer(name, args, time.perf_counter() - start)
+    else:
+        def traced(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._tracer(name, args, time.perf_counter() - start)
+    return functools.wraps(method)(traced)
+
+
+@functools.lru_cache(maxsize=None)
+def _traced_class(cls: type) -> type:
+    '''
+    subclass of a tree class wrapping its public operations, the layout is the same so that
+    a tree can switch to it and back
+    '''
+    namespace = {name: _traced(getattr(cls, name)) for name in TRACED_OPERATIONS}
+    return type('Traced' + cls.__name__, (cls,), dict(namespace, __slots__=(), _untraced=cls))
+
 
 class BTree():
     LEAF = BNode
-    __slots__ = ('_file_name', '_order', '_root')
-    def __init__(self, file_name: str = 'xiaolongbao.db', order: int = 100, page_size: int = 8192, key_size: int = 16, value_size: int = 64, cache_szie=1024):
+    BRANCH = BNode
+    __slots__ = ('_file_name', '_order', '_root', '_tree_conf', 'handler', '_closed', '_compression', '_tracer')
+    def __init__(self, file_name: str = 'xiaolongbao.db', order: int = 100, page_size: int = 8192, key_size: int = 16, value_size: int = 64, cache_size=1024, cache_policy='lru', cache_bytes: int = None, use_mmap: bool = False,
+                 durability='full', group_commit_window: float = 0.0, group_commit_size: int = 16,
+                 checkpoint_frames: int = 1000, checkpoint_bytes: int = None, checkpoint_batch: int = 64, compression: str = None,
+                 readahead: int = READAHEAD_PAGES, dirty_pages: int = DIRTY_PAGES):
+        '''
+        :param cache_size: how many nodes to keep in the page cache
+        :param cache_policy: page cache replacement policy, 'lru', 'clock' or '2q' (scan-resistant),
+                             or a util.PageCache subclass
+        :param cache_bytes: optional byte budget of the page cache, in addition to cache_size
+        :param use_mmap: parse pages of the db file straight from a memory mapping, for read-heavy workloads
+        :param durability: 'full' fsyncs the WAL at every commit, 'normal' only at checkpoint, 'off' never
+        :param group_commit_window: seconds a commit may wait so concurrent commits share one fsync
+        :param group_commit_size: number of pending commits that closes the group commit window early
+        :param checkpoint_frames: checkpoint automatically once the WAL holds this many page frames, None to disable
+        :param checkpoint_bytes: checkpoint automatically once the WAL file is this large, None to disable
+        :param checkpoint_batch: pages copied per batch by a passive checkpoint
+        :param compression: compress the values written from now on with 'zlib' or 'lzma', None to store them as is.
+                            Values larger than value_size, or than about a quarter of a page, once compressed, are
+                            stored in chains of overflow pages.
+        :param readahead: most pages read ahead on a background thread by range scans and sequential reads,
+                          0 to only advise the kernel of the next leaf
+        :param dirty_pages: nodes a write transaction keeps modified in memory, each one is logged into the WAL
+                            once at commit; beyond that they are spilled early. 0 to log every modification
+        '''
         self._file_name = file_name
-        self._tree_conf = TreeConf(order=order, page_size=page_size, key_size=page_size, value_size=value_size)
-        self.handler = FileHandler()
+        self._compression = Compression(compression or 'none')
+        self._tree_conf = TreeConf(order=order, page_size=page_size, key_size=key_size, value_size=value_size)
+        check_tree_conf(self._tree_conf)
+        self.handler = FileHandler(file_name, self._tree_conf, cache_size, cache_policy=cache_policy, cache_bytes=cache_bytes, use_mmap=use_mmap,
+                                   durability=durability, group_commit_window=group_commit_window, group_commit_size=group_commit_size,
+                                   checkpoint_frames=checkpoint_frames, checkpoint_bytes=checkpoint_bytes, checkpoint_batch=checkpoint_batch,
+                                   readahead=readahead, dirty_pages=dirty_pages)
         self._order = order
         try:
             with self.handler.read_transaction:
@@ -21,12 +96,19 @@ class BTree():
         except ValueError:
             # init a empty tree
             with self.handler.write_transaction:
-                self._root = self._bottom = self.LEAF(self, self._tree_conf)
+                self._root = self.LEAF(self, self._tree_conf)
+                self.handler.ensure_root_block(self._root)
         else:
             with self.handler.read_transaction:
                 self._root, self._tree_conf = self.handler.get_node(meta_root_page, tree=self), meta_tree_conf
 
+        self.handler.on_rollback = self._reload_root
         self._closed = False
+        self._tracer = None
+
+    @property
+    def compression(self) -> Compression:
+        return self._compression
 
     @property
     def next_available_page(self) -> int:
@@ -35,6 +117,46 @@ class BTree():
         '''
         return self.handler.next_available_page
 
+    def next_page_near(self, page: int) -> int:
+        '''
+        used for upper layer, a free page as close as possible to page
+        '''
+        return self.handler.next_page_near(page)
+
+    @property
+    def depth(self) -> int:
+        '''
+        levels of the tree, 1 for a single leaf
+        '''
+        with self.handler.read_transaction:
+            return len(self._edge_path(last=False))
+
+    def stats(self) -> dict:
+        '''
+        sample the counters of the tree, see util.IOStats for the I/O ones
+        '''
+        return {'depth': self.depth, **self.handler.sample_stats()}
+
+    def trace(self, tracer=None):
+        '''
+        call tracer(operation, args, seconds) once each public operation returns, None to stop tracing.
+        Scans are traced once exhausted or closed. The operations are wrapped by a subclass the tree
+        is switched to, so an untraced tree runs the plain methods at no cost.
+        '''
+        untraced = getattr(type(self), '_untraced', type(self))
+        self._tracer = tracer
+        self.__class__ = untraced if tracer is None else _traced_class(untraced)
+
+    def _reload_root(self):
+        '''
+        go back to the committed root, the root node kept by the tree may hold changes rolled back
+        '''
+        root_page, self._tree_conf = self.handler.get_meta_tree_conf()
+        self._root = self._get_node(root_page)
+
+    def _get_node(self, page: int) -> BNode:
+        return self.handler.get_node(page, tree=self)
+
     def _path_to(self, key) -> list:
         '''
         get the path from the root to the target node
@@ -45,7 +167,697 @@ class BTree():
             ancestry = []
 
             while getattr(current_node, 'children', None):
-                index = bisect.bisect_left(current_node.contents, key)
+                index = current_node.bisect_left(key)
                 ancestry.append((current_node, index))
                 # cannot be last elem
-                if index < len(current_node.contents) and current_node.contents[index].
\ No newline at end of file
+                if index < current_node.count and current_node.key_at(index) == key:
+                    # separator equals to the smallest key of the right child
+                    index += 1
+                    ancestry[-1] = (current_node, index)
+                current_node = self._get_node(current_node.children[index])
+
+            index = current_node.bisect_left(key)
+            ancestry.append((current_node, index))
+
+        return ancestry
+
+    def get(self, key, default=None):
+        leaf, index = self._path_to(key)[-1]
+        if index < leaf.count and leaf.key_at(index) == key:
+            return leaf.value_at(index)
+        return default
+
+    def __getitem__(self, key):
+        leaf, index = self._path_to(key)[-1]
+        if index < leaf.count and leaf.key_at(index) == key:
+            return leaf.value_at(index)
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        leaf, index = self._path_to(key)[-1]
+        return index < leaf.count and leaf.key_at(index) == key
+
+    def __setitem__(self, key, value):
+        self.insert(key, value, replace=True)
+
+    def _edge_path(self, last: bool) -> list:
+        '''
+        :return: the path from the root to the first or the last leaf, like _path_to
+        '''
+        node = self._root
+        ancestry = []
+        while not node.is_leaf:
+            index = len(node.children) - 1 if last else 0
+            ancestry.append((node, index))
+            node = self._get_node(node.children[index])
+        ancestry.append((node, node.count if last else 0))
+        return ancestry
+
+    def _scan_position(self, key, reverse: bool, inclusive: bool) -> list:
+        '''
+        locate where a scan continues from key
+        :return: the path to the leaf, ending with the index of the next pair forward, or one past it backward
+        '''
+        if key is None:
+            return self._edge_path(last=reverse)
+        ancestry = self._path_to(key)
+        leaf, index = ancestry[-1]
+        if not reverse and not inclusive and index < leaf.count and leaf.key_at(index) == key:
+            ancestry[-1] = (leaf, index + 1)
+        return ancestry
+
+    def _leaf_pages_after(self, ancestry: list, reverse: bool):
+        '''
+        the pages of the leaves following the end of the path in scan order, taken from the
+        internal nodes so that they are known before the leaves are read.
+        Must be advanced inside a read transaction, and dropped once the tree is written.
+        '''
+        depth = len(ancestry) - 1
+        stack = ancestry[:-1]
+        while stack:
+            node, index = stack.pop()
+            index += -1 if reverse else 1
+            if not 0 <= index < len(node.children):
+                continue
+            stack.append((node, index))
+            page = node.children[index]
+            while len(stack) < depth:
+                node = self._get_node(page)
+                index = len(node.children) - 1 if reverse else 0
+                stack.append((node, index))
+                page = node.children[index]
+            yield page
+
+    def items(self, start=None, end=None, reverse: bool = False):
+        '''
+        stream the (key, value) pairs with start <= key < end in key order, leaf by leaf along the
+        sibling links. Only the pairs of the current leaf are held, the next leaves, known from their
+        parents, are read ahead while they are consumed. Locks are not held between leaves: when a write happened in the
+        meantime the scan locates its position again from the last key returned, so it sees
+        every change made after that key.
+        :param start: smallest key included, None for the first key
+        :param end: key excluded, None for past the last key
+        :param reverse: from the largest key down
+        '''
+        position, inclusive = (end, False) if reverse else (start, True)
+        next_page, generation = None, None
+        window = self.handler.readahead_pages
+        # leaf pages to come, and those already handed to the read-ahead
+        upcoming, hinted = None, collections.deque()
+        while True:
+            with self.handler.read_transaction:
+                if next_page is None or self.handler.generation != generation:
+                    # first leaf, or the links may be stale after a write, descend again
+                    ancestry = self._scan_position(position, reverse, inclusive)
+                    leaf, index = ancestry[-1]
+                    if window:
+                        upcoming = self._leaf_pages_after(ancestry, reverse)
+                        hinted.clear()
+                else:
+                    leaf = self._get_node(next_page)
+                    index = leaf.count if reverse else 0
+                    if hinted and hinted[0] == next_page:
+                        hinted.popleft()
+                if reverse:
+                    pairs = list(map(leaf.item_at, range(index - 1, -1, -1)))
+                    next_page = leaf.prev_page
+                else:
+                    pairs = list(map(leaf.item_at, range(index, leaf.count)))
+                    next_page = leaf.next_page
+                generation = self.handler.generation
+                if upcoming is not None and len(hinted) <= window // 2:
+                    # refilled by half a window so the pages are read in long runs
+                    pages = list(itertools.islice(upcoming, window - len(hinted)))
+                    hinted.extend(pages)
+                    self.handler.prefetch(*pages)
+                elif upcoming is None and next_page:
+                    self.handler.prefetch(next_page)
+
+            for key, value in pairs:
+                if (reverse and start is not None and key < start) or (not reverse and end is not None and not key < end):
+                    return
+                yield key, value
+                position, inclusive = key, False
+                if self.handler.generation != generation:
+                    # written to while the pair was consumed, continue from the current tree
+                    break
+            else:
+                if not next_page:
+                    return
+
+    def keys(self, start=None, end=None, reverse: bool = False):
+        for key, _ in self.items(start, end, reverse):
+            yield key
+
+    def values(self, start=None, end=None, reverse: bool = False):
+        for _, value in self.items(start, end, reverse):
+            yield value
+
+    def __iter__(self):
+        return self.keys()
+
+    def insert(self, key, value, replace: bool = False):
+        '''
+        insert a key-value pair into the tree
+        :param replace: overwrite the value if the key already exists, else raise ValueError
+        '''
+        with self.handler.write_transaction:
+            ancestry = self._path_to(key)
+            leaf, index = ancestry.pop()
+            if index < leaf.count and leaf.key_at(index) == key:
+                if not replace:
+                    raise ValueError('key {key!r} already exists'.format(key=key))
+                leaf.set_value(index, value)
+            else:
+                leaf.insert(index, key, value)
+            self._shrink(leaf, ancestry)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def delete(self, key):
+        '''
+        remove a key from the tree, raise KeyError if not present
+        '''
+        with self.handler.write_transaction:
+            ancestry = self._path_to(key)
+            leaf, index = ancestry.pop()
+            if not (index < leaf.count and leaf.key_at(index) == key):
+                raise KeyError(key)
+            leaf.remove(index)
+            self._rebalance(leaf, ancestry)
+
+    @staticmethod
+    def _upper_bound(ancestry: list):
+        '''
+        the exclusive upper bound of the keys reachable under the end of the ancestry,
+        None for the rightmost path
+        '''
+        for node, index in reversed(ancestry):
+            if index < node.count:
+                return node.key_at(index)
+        return None
+
+    def _iter_leaves(self, node: BNode, keys: list):
+        '''
+        descend once for sorted keys, keys falling into the same subtree share the upper levels
+        :return: generator of (leaf, keys of the leaf)
+        '''
+        if node.is_leaf:
+            yield node, keys
+            return
+        start = 0
+        while start < len(keys):
+            index = node.bisect_right(keys[start])
+            if index < node.count:
+                end = bisect.bisect_left(keys, node.key_at(index), start)
+            else:
+                end = len(keys)
+            yield from self._iter_leaves(self._get_node(node.children[index]), keys[start:end])
+            start = end
+
+    def get_many(self, keys, default=None) -> list:
+        '''
+        look up several keys with a single descent of the tree
+        :return: values in the order of the keys, default for missing keys
+        '''
+        keys = list(keys)
+        found = dict()
+        with self.handler.read_transaction:
+            for leaf, leaf_keys in self._iter_leaves(self._root, sorted(set(keys))):
+                for key in leaf_keys:
+                    index = leaf.bisect_left(key)
+                    if index < leaf.count and leaf.key_at(index) == key:
+                        found[key] = leaf.value_at(index)
+        return [found.get(key, default) for key in keys]
+
+    def insert_many(self, pairs, replace: bool = False) -> int:
+        '''
+        insert (key, value) pairs in a single write transaction, so a single WAL commit.
+        Pairs are sorted and each leaf is located once and written once for all of its keys.
+        :param replace: overwrite existing values, else raise ValueError before anything is written
+        :return: number of pairs inserted or replaced
+        '''
+        pairs = sorted(pairs, key=operator.itemgetter(0))
+        with self.handler.write_transaction:
+            if not replace:
+                keys = [key for key, _ in pairs]
+                duplicated = [key for key, prev in zip(keys[1:], keys) if key == prev]
+                duplicated += [key for key, value in zip(keys, self.get_many(keys, _MISSING)) if value is not _MISSING]
+                if duplicated:
+                    raise ValueError('keys already exist: {keys!r}'.format(keys=duplicated[:10]))
+
+            position = 0
+            while position < len(pairs):
+                ancestry = self._path_to(pairs[position][0])
+                leaf, _ = ancestry.pop()
+                upper_bound = self._upper_bound(ancestry)
+                while position < len(pairs) and (upper_bound is None or pairs[position][0] < upper_bound):
+                    key, value = pairs[position]
+                    position += 1
+                    index = leaf.bisect_left(key)
+                    if index < leaf.count and leaf.key_at(index) == key:
+                        leaf.set_value(index, value)
+                    else:
+                        leaf.insert(index, key, value)
+                    if leaf.needs_split():
+                        # the path changes, locate the next leaf again
+                        break
+                self._shrink(leaf, ancestry)
+        return len(pairs)
+
+    def delete_many(self, keys) -> int:
+        '''
+        remove several keys in a single write transaction, missing keys are ignored
+        :return: number of keys removed
+        '''
+        keys = sorted(set(keys))
+        removed = 0
+        with self.handler.write_transaction:
+            position = 0
+            while position < len(keys):
+                ancestry = self._path_to(keys[position])
+                leaf, _ = ancestry.pop()
+                upper_bound = self._upper_bound(ancestry)
+                modified = False
+                while position < len(keys) and (upper_bound is None or keys[position] < upper_bound):
+                    key = keys[position]
+                    position += 1
+                    index = leaf.bisect_left(key)
+                    if index < leaf.count and leaf.key_at(index) == key:
+                        leaf.remove(index)
+                        removed += 1
+                        modified = True
+                if modified:
+                    self._rebalance(leaf, ancestry)
+        return removed
+
+    def _shrink(self, node: BNode, ancestry: list):
+        '''
+        write the modified node back, split it and propagate to its ancestors when it is too big
+        '''
+        while node.needs_split():
+            parts = self._split(node)
+            if not ancestry:
+                self._root = self.BRANCH(self, self._tree_conf, keys=[push_key for push_key, _ in parts],
+                                         children=[node.page, *(part.page for _, part in parts)])
+                self.handler.ensure_root_block(self._root)
+                node = self._root
+                continue
+
+            parent, index = ancestry.pop()
+            for offset, (push_key, part) in enumerate(parts):
+                parent.insert(index + offset, push_key)
+                parent.children.insert(index + offset + 1, part.page)
+            node = parent
+
+        self.handler.set_node(node)
+
+    def _split(self, node: BNode) -> list:
+        '''
+        split a node until every part fits its page, a node may have grown past several pages,
+        e.g. when many of its values were replaced by larger ones
+        :return: (key pushed into the parent, new node) of every part after node, in key order
+        '''
+        parts = [(None, node)]
+        index = 0
+        while index < len(parts):
+            part = parts[index][1]
+            if not part.needs_split():
+                index += 1
+                continue
+            if part.count == 1:
+                raise ValueError('entry is larger than the page size: {length}'.format(length=part.size()))
+            sibling, push_key = part.split()
+            self.handler.stats.splits += 1
+            if sibling.is_leaf:
+                if index + 1 < len(parts):
+                    parts[index + 1][1].prev_page = sibling.page
+                else:
+                    self._relink_prev(sibling.next_page, sibling.page)
+            parts.insert(index + 1, (push_key, sibling))
+        for _, part in parts:
+            self.handler.set_node(part)
+        return parts[1:]
+
+    def _rebalance(self, node: BNode, ancestry: list):
+        '''
+        write the node back after removals, merge it into a sibling when it is less than half full,
+        and propagate to its ancestors. The root is replaced by its only child when it has no key left.
+        '''
+        while ancestry and node.is_underfull():
+            parent, index = ancestry.pop()
+            # merge with the left sibling, or with the right one for the first child
+            left_index = index - 1 if index else index
+            if left_index + 1 >= len(parent.children):
+                ancestry.append((parent, index))
+                break
+            left = node if left_index == index else self._get_node(parent.children[left_index])
+            right = node if left_index != index else self._get_node(parent.children[left_index + 1])
+            separator_key = parent.key_at(left_index)
+            if not left.can_merge(right, separator_key):
+                ancestry.append((parent, index))
+                break
+            left.merge(right, separator_key)
+            self.handler.stats.merges += 1
+            if left.is_leaf:
+                self._relink_prev(left.next_page, left.page)
+            parent.remove(left_index)
+            del parent.children[left_index + 1]
+            self.handler.set_node(left)
+            self.handler.set_deprecated_data(right.page)
+            node = parent
+        self.handler.set_node(node)
+
+        while not self._root.is_leaf and not self._root.count:
+            old_root, self._root = self._root, self._get_node(self._root.children[0])
+            self.handler.ensure_root_block(self._root)
+            self.handler.set_deprecated_data(old_root.page)
+
+    def _relink_prev(self, page: int, prev_page: int):
+        '''
+        point the leaf at page back to prev_page, after its previous leaf was split or merged
+        '''
+        if page:
+            node = self._get_node(page)
+            node.prev_page = prev_page
+            self.handler.set_node(node)
+
+    def bulk_load(self, iterable, presorted: bool = True, fill_factor: float = 0.9, sort_buffer: int = 100000) -> int:
+        '''
+        build an empty tree bottom-up from (key, value) pairs. Leaves are packed up to fill_factor,
+        then each upper level is built from the one below. Pages are allocated contiguously and
+        written straight into the db file, skipping the WAL; the root is published once at the end.
+        :param presorted: pairs come in strictly ascending key order, else they are sorted externally
+        :param sort_buffer: pairs sorted in memory per run of the external sort
+        :return: number of pairs loaded
+        '''
+        if not 0 < fill_factor <= 1:
+            raise ValueError('fill factor must be in (0, 1]')
+        if not presorted:
+            iterable = util.external_sort(iterable, key=operator.itemgetter(0), buffer_size=sort_buffer)
+
+        with self.handler.write_transaction:
+            if self._root.count or not self._root.is_leaf:
+                raise ValueError('bulk load needs an empty tree')
+            max_contents = self._root.max_contents
+            leaf_size = max(1, int(max_contents * fill_factor))
+            branch_size = max(2, int((max_contents + 1) * fill_factor))
+            fill_bytes = int(page_capacity(self._tree_conf) * fill_factor)
+
+            # (smallest key, page) of every node of the level being built
+            level = []
+            pending = []
+            # parallel arrays of the leaf being filled
+            keys, values, key_data, value_data = [], [], [], []
+            used = 0
+            count = 0
+            last_key = None
+            for key, value in iterable:
+                if count and not last_key < key:
+                    raise ValueError('keys must be unique and in ascending order: {key!r}'.format(key=key))
+                entry_key, entry_value = serialize_key(self._tree_conf, key), encode_value(self, self._tree_conf, value)
+                length = self.LEAF.entry_length(entry_key, entry_value, key_data[0] if keys else None)
+                if keys and (len(keys) == leaf_size or used + length > fill_bytes):
+                    root = self._bulk_node(level, pending, keys[0], keys=keys, values=values, key_data=key_data, value_data=value_data)
+                    keys, values, key_data, value_data = [], [], [], []
+                if not keys:
+                    used, length = self.LEAF.HEADER_LENGTH, self.LEAF.entry_length(entry_key, entry_value)
+                keys.append(key)
+                values.append(resident_value(value, entry_value))
+                key_data.append(entry_key)
+                value_data.append(entry_value)
+                used += length
+                last_key = key
+                count += 1
+            if keys:
+                root = self._bulk_node(level, pending, keys[0], keys=keys, values=values, key_data=key_data, value_data=value_data)
+            if not count:
+                return 0
+
+            while len(level) > 1:
+                groups = self._bulk_groups(level, branch_size, fill_bytes)
+                if len(groups[-1]) == 1:
+                    # an internal node needs two children at least
+                    groups[-1].insert(0, groups[-2].pop())
+                level = []
+                for group in groups:
+                    root = self._bulk_node(level, pending, group[0][0], keys=[key for key, _ in group[1:]], children=[page for _, page in group])
+
+            self.handler.write_nodes(pending)
+            # every page must be durable before the meta page refers to them
+            self.handler.sync_db_file()
+            old_root, self._root = self._root, root
+            self.handler.ensure_root_block(self._root)
+            self.handler.set_deprecated_data(old_root.page)
+        return count
+
+    def _bulk_groups(self, level: list, branch_size: int, fill_bytes: int) -> list:
+        '''
+        split a level into the children of the nodes above it, separators are measured
+        without prefix compression so that a group never overflows its page
+        '''
+        groups, group, used = [], [], 0
+        for smallest_key, page in level:
+            length = PAGE_ADDRESS_LIMIT
+            if group:
+                length += self.BRANCH.entry_length(serialize_key(self._tree_conf, smallest_key))
+                if len(group) == branch_size or used + length > fill_bytes:
+                    groups.append(group)
+                    group = []
+            if not group:
+                used, length = self.BRANCH.HEADER_LENGTH, PAGE_ADDRESS_LIMIT
+            group.append((smallest_key, page))
+            used += length
+        groups.append(group)
+        return groups
+
+    def _bulk_node(self, level: list, pending: list, smallest_key, children: list = None, **entries) -> BNode:
+        node_class = self.BRANCH if children else self.LEAF
+        node = node_class(self, self._tree_conf, page=self.handler.allocate_page(), children=children, **entries)
+        if node.is_leaf and pending:
+            # leaves come first and in order, the last pending node is the previous leaf
+            node.prev_page, pending[-1].next_page = pending[-1].page, node.page
+        level.append((smallest_key, node.page))
+        pending.append(node)
+        if len(pending) > util.IOV_MAX:
+            # keep the last node, the next leaf still has to link to it
+            self.handler.write_nodes(pending[:-1])
+            del pending[:-1]
+        return node
+
+    def snapshot(self, cache_size: int = 256) -> 'Snapshot':
+        '''
+        a read-only view of the tree as of the last commit, for long-running readers: it takes no lock,
+        so writers keep committing meanwhile and it never sees their changes.
+        Checkpoints are deferred while it is open, close it as soon as possible.
+        :param cache_size: how many nodes the snapshot caches
+        '''
+        with self.handler.read_transaction:
+            handler = self.handler.open_snapshot(cache_size)
+            root_page = self._root.page
+        return Snapshot(handler, self._file_name, self._tree_conf, self._order, self._compression, root_page)
+
+    def split_range(self, start=None, end=None, parts: int = 2) -> list:
+        '''
+        split [start, end) into at most parts disjoint subranges holding about as many leaves, bounded by
+        the separator keys of the internal nodes. The tree is descended only until a level holds enough of them.
+        :return: (start, end) of each subrange in key order, None for an open bound like in items
+        '''
+        if start is not None and end is not None and not start < end:
+            return [(start, end)]
+        separators = []
+        with self.handler.read_transaction:
+            level = [self._root]
+            while not level[0].is_leaf:
+                children = []
+                for node in level:
+                    for index, page in enumerate(node.children):
+                        low = node.key_at(index - 1) if index else None
+                        high = node.key_at(index) if index < node.count else None
+                        if (start is not None and high is not None and not start < high) or \
+                                (end is not None and low is not None and not low < end):
+                            continue
+                        children.append(page)
+                        if high is not None and (start is None or start < high) and (end is None or high < end):
+                            separators.append(high)
+                if len(separators) + 1 >= parts:
+                    break
+                first = self._get_node(children[0])
+                if first.is_leaf:
+                    break
+                level = [first, *map(self._get_node, children[1:])]
+        # the separators of a level refine those of the level above
+        separators.sort()
+        separators = [key for index, key in enumerate(separators) if not index or separators[index - 1] != key]
+        if len(separators) + 1 > parts:
+            separators = [separators[index * (len(separators) + 1) // parts - 1] for index in range(1, parts)]
+        bounds = [start, *separators, end]
+        return list(zip(bounds, bounds[1:]))
+
+    def map_reduce(self, mapper, reducer, start=None, end=None, workers: int = None):
+        '''
+        scan the pairs with start <= key < end in parallel: the range is split along the internal nodes
+        and the subranges are scanned by a pool of processes, each opening a snapshot of the tree read-only.
+        Writers are not blocked meanwhile, and the scan does not see their changes.
+        :param mapper: mapper(pairs) -> result of a subrange, pairs iterating over its (key, value) in key order.
+                       Called in the worker processes, so it must be picklable, defined at module level
+        :param reducer: reducer(left, right) -> result, merges the results of two adjacent subranges
+        :param workers: processes of the pool, the number of CPUs by default
+        :return: the merged result
+        '''
+        with self.snapshot() as snapshot:
+            return snapshot.map_reduce(mapper, reducer, start, end, workers)
+
+    def count(self, start=None, end=None, workers: int = None) -> int:
+        '''
+        number of keys with start <= key < end, counted in parallel, see map_reduce
+        '''
+        return self.map_reduce(_count_pairs, operator.add, start, end, workers)
+
+    def sum(self, start=None, end=None, workers: int = None):
+        '''
+        sum of the values with start <= key < end, added up in parallel, see map_reduce
+        '''
+        return self.map_reduce(_sum_values, operator.add, start, end, workers)
+
+    def checkpoint(self, passive: bool = True):
+        '''
+        copy the WAL back into the db file and restart it
+        :param passive: copy in batches without blocking readers, else hold the write lock throughout
+        '''
+        self.handler.checkpoint(passive=passive)
+
+    def _live_pages(self) -> tuple:
+        '''
+        :return: every node of the tree, and the pages of every overflow chain
+        '''
+        nodes, chains = [], []
+        level = [self._root]
+        while level:
+            nodes.extend(level)
+            children = []
+            for node in level:
+                if node.is_leaf:
+                    chains.extend(self.handler.overflow_chain(page) for page in node.overflow_pages())
+                else:
+                    children.extend(self._get_node(page) for page in node.children)
+            level = children
+        return nodes, chains
+
+    def vacuum(self) -> int:
+        '''
+        compact the db file online: every live page past the number of live pages is moved into
+        a free page before it, the pointers to it are rewritten, then the file is truncated.
+        Free pages leaked by an interrupted transaction are reclaimed as well.
+        :return: number of pages cut off the db file
+        '''
+        with self.handler.exclusive_transaction:
+            nodes, chains = self._live_pages()
+            live = set(node.page for node in nodes)
+            live.update(page for chain in chains for page in chain)
+            # page 0 is the meta page
+            last_page = len(live)
+            moved = sorted(page for page in live if page > last_page)
+            free = (page for page in range(1, last_page + 1) if page not in live)
+            moves = dict(zip(moved, free))
+            for page in moves.values():
+                self.handler.take_page(page)
+
+            for chain in chains:
+                if any(page in moves for page in chain):
+                    self.handler.move_overflow(chain, moves)
+            for node in nodes:
+                if node.relocate(moves):
+                    self.handler.set_node(node)
+            if self._root.page in moves.values():
+                self.handler.ensure_root_block(self._root)
+            released = self.handler.last_page - last_page
+            self.handler.truncate(last_page)
+        return released
+
+    def verify(self, workers: int = None) -> list:
+        '''
+        check every page of the database against its checksum, with a pool of processes
+        :param workers: processes of the pool, the number of CPUs by default
+        :return: the corrupted pages, empty when the database is intact
+        '''
+        return self.handler.verify(workers=workers)
+
+    def close(self):
+        if self._closed:
+            return
+        self.handler.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _read_only(*args, **kwargs):
+    raise TypeError('a snapshot is read-only')
+
+
+class Snapshot(BTree):
+    '''
+    read-only view of a BTree pinned at the commit it was taken at, see BTree.snapshot.
+    Released by close, or once garbage collected.
+    '''
+    __slots__ = ()
+
+    def __init__(self, handler: SnapshotHandler, file_name: str, tree_conf: TreeConf, order: int, compression: Compression,
+                 root_page: int):
+        self.handler = handler
+        self._file_name = file_name
+        self._tree_conf = tree_conf
+        self._order = order
+        self._compression = compression
+        self._closed = False
+        self._tracer = None
+        self._root = self._get_node(root_page)
+
+    insert = delete = insert_many = delete_many = bulk_load = checkpoint = vacuum = verify = snapshot = _read_only
+
+    def pinned(self) -> tuple:
+        '''
+        :return: what opens the snapshot again in another process, see _open_scan_worker
+        '''
+        return self.handler.pinned(), self._file_name, self._tree_conf, self._order, self._compression, self._root.page
+
+    def map_reduce(self, mapper, reducer, start=None, end=None, workers: int = None):
+        workers = workers or os.cpu_count()
+        ranges = self.split_range(start, end, workers * PARALLEL_SCAN_SPLIT)
+        if len(ranges) == 1:
+            return mapper(self.items(start, end))
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(ranges)), initializer=_open_scan_worker,
+                                                    initargs=(self.pinned(),)) as pool:
+            return functools.reduce(reducer, pool.map(_map_range, itertools.repeat(mapper), ranges))
+
+    def close(self):
+        self._closed = True
+        self.handler.release()
+
+
+# snapshot scanned by a worker process of Snapshot.map_reduce
+_scan_snapshot = None
+
+
+def _open_scan_worker(pinned: tuple):
+    global _scan_snapshot
+    handler_args, *tree_args = pinned
+    _scan_snapshot = Snapshot(SnapshotHandler(*handler_args, cache_size=1024), *tree_args)
+
+
+def _map_range(mapper, bounds: tuple):
+    return mapper(_scan_snapshot.items(*bounds))
+
+
+def _count_pairs(pairs) -> int:
+    return sum(1 for _ in pairs)
+
+
+def _sum_values(pairs):
+    return sum(value for _, value in pairs)
@@ -30,5 +30,53 @@ FRAME_TYPE_LENGTH_LIMIT = 1
 # bytes for storing serializer type
 SERIALIZER_TYPE_LENGTH_LIMIT = 1
 
-INT_FORMAT = '!l'
-FLOAT_FORMAT = '!f'
\ No newline at end of file
+# serializer type byte of a value: overflow flag | compression code | serializer type
+SERIALIZER_TYPE_MASK = 0x1f
+COMPRESSION_SHIFT = 5
+COMPRESSION_MASK = 0x60
+OVERFLOW_FLAG = 0x80
+
+# values shorter than this are never compressed
+COMPRESSION_MIN_LENGTH = 64
+
+# bytes of the CRC32 ending every page, and closing every WAL frame header
+CHECKSUM_LENGTH = 4
+
+# pages read at once by each worker of a verification
+VERIFY_CHUNK_PAGES = 256
+
+# most pages read ahead at once by a sequential scan, the window starts at READAHEAD_MIN_PAGES
+# and doubles on every step
+READAHEAD_PAGES = 64
+READAHEAD_MIN_PAGES = 4
+
+# consecutive pages read one after another before a scan is considered sequential
+READAHEAD_TRIGGER = 2
+
+# nodes a write transaction keeps modified in memory before logging them to the WAL
+DIRTY_PAGES = 1024
+
+# threads of the executor running the blocking calls of an AsyncBTree
+ASYNC_WORKERS = 4
+
+# pairs fetched per executor call by an async range iteration
+ASYNC_SCAN_BATCH = 256
+
+# most writes of concurrent tasks coalesced into one write transaction
+ASYNC_WRITE_BATCH = 1024
+
+# subranges per worker process of a parallel scan, the workers which finish early take the remaining ones
+PARALLEL_SCAN_SPLIT = 4
+
+# shards of a new hash partitioned ShardedBTree
+SHARDS = 4
+
+# bytes for storing an offset inside the WAL file
+WAL_OFFSET_LIMIT = 8
+
+# frames appended to the WAL between two persisted indexes of its committed pages
+WAL_INDEX_INTERVAL = 1024
+
+# order-preserving formats of int and float keys, see serializer.py
+ORDERED_INT_FORMAT = '!Q'
+DOUBLE_FORMAT = '!d'
@@ -0,0 +1,287 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import itertools
+import queue
+from xiaolongbaodb.btree import BTree
+from xiaolongbaodb.constants import ASYNC_SCAN_BATCH, ASYNC_WORKERS, ASYNC_WRITE_BATCH
+from xiaolongbaodb.serializer import NoSerializerError
+
+# AsyncBTree -> its transaction running in the current task
+_transactions = contextvars.ContextVar('xiaolongbaodb_transactions', default=None)
+
+# failures of a single key write, raised before the tree is touched, they do not abort the other writes of its group
+_WRITE_ERRORS = (KeyError, ValueError, TypeError, NoSerializerError)
+
+
+class _Abort(Exception):
+    pass
+
+
+class AsyncTransaction():
+    '''
+    a read or write transaction spanning several awaits. The lock of a transaction belongs to
+    a thread, so every call made inside it is served by the single executor thread which entered it.
+    Calls of the AsyncBTree made in the same task (or the tasks it creates) join the transaction.
+    Nested transactions are part of the outermost one.
+    '''
+    __slots__ = ('_db', '_write', '_requests', '_served', '_token')
+
+    def __init__(self, db, write: bool = True):
+        self._db = db
+        self._write = write
+        self._requests = None
+        self._served = None
+        self._token = None
+
+    async def __aenter__(self):
+        running = _transactions.get() or dict()
+        if self._db in running:
+            return self._db
+        entered = concurrent.futures.Future()
+        self._requests = queue.SimpleQueue()
+        self._served = asyncio.get_running_loop().run_in_executor(self._db._executor, self._serve, entered)
+        try:
+            await asyncio.wrap_future(entered)
+        except asyncio.CancelledError:
+            # the thread still enters the transaction, let it leave at once
+            self._requests.put((None, True, None))
+            raise
+        self._token = _transactions.set({**running, self._db: self})
+        return self._db
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._token is None:
+            return False
+        _transactions.reset(self._token)
+        self._token = None
+        # rolled back when the block raised
+        self._requests.put((None, exc_type is not None, None))
+        await self._served
+        return False
+
+    def _serve(self, entered: concurrent.futures.Future):
+        handler = self._db.tree.handler
+        try:
+            with (handler.write_transaction if self._write else handler.read_transaction):
+                entered.set_result(None)
+                while True:
+                    func, args, future = self._requests.get()
+                    if func is None:
+                        if args:
+                            raise _Abort()
+                        return
+                    if future.set_running_or_notify_cancel():
+                        try:
+                            future.set_result(func(*args))
+                        except BaseException as e:
+                            future.set_exception(e)
+        except _Abort:
+            pass
+        except BaseException as e:
+            if entered.done():
+                raise
+            entered.set_exception(e)
+
+    async def run(self, func, *args):
+        '''
+        call func in the thread of the transaction
+        '''
+        future = concurrent.futures.Future()
+        self._requests.put((func, args, future))
+        return await asyncio.wrap_future(future)
+
+
+class AsyncBTree():
+    '''
+    asyncio front-end of a BTree, every blocking call runs on a dedicated executor of bounded size.
+
+    Writes of concurrent tasks are coalesced: while a group is being written, the next writes queue up
+    and are applied together in a single write transaction, so they share one commit and one WAL fsync.
+    A write returns once its group is committed (and synced, depending on the durability).
+
+        async with xiaolongbaodb.connect('db') as db:
+            await db.put('key', 'value')
+            async with db.transaction():
+                await db.delete('key')
+            async for key, value in db.items():
+                ...
+    '''
+    __slots__ = ('_file_name', '_options', '_workers', '_executor', '_tree', '_pending', '_flushing')
+
+    def __init__(self, file_name: str = 'xiaolongbao.db', workers: int = ASYNC_WORKERS, **options):
+        '''
+        :param workers: threads of the executor, also bounds the concurrent reads
+        :param options: passed to BTree
+        '''
+        self._file_name = file_name
+        self._options = options
+        self._workers = workers
+        self._executor = None
+        self._tree = None
+        # (func, args, future) waiting for the next write group
+        self._pending = []
+        self._flushing = None
+
+    @property
+    def tree(self) -> BTree:
+        return self._tree
+
+    async def open(self):
+        if self._tree is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self._workers, thread_name_prefix='xiaolongbaodb')
+            self._tree = await self._run(functools.partial(BTree, self._file_name, **self._options))
+        return self
+
+    def __await__(self):
+        return self.open().__await__()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _run(self, func, *args):
+        '''
+        call func in the transaction of the current task, else on any thread of the executor
+        '''
+        transaction = (_transactions.get() or dict()).get(self)
+        if transaction is not None:
+            return await transaction.run(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _write(self, func, *args):
+        '''
+        call func in the next write group, or in the transaction of the current task
+        '''
+        transaction = (_transactions.get() or dict()).get(self)
+        if transaction is not None:
+            return await transaction.run(func, *args)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, args, future))
+        if self._flushing is None:
+            self._flushing = loop.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                group, self._pending = self._pending[:ASYNC_WRITE_BATCH], self._pending[ASYNC_WRITE_BATCH:]
+                try:
+                    results = await asyncio.get_running_loop().run_in_executor(self._executor, self._apply, group)
+                except asyncio.CancelledError:
+                    for _, _, future in group:
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    # rolled back, no write of the group took effect
+                    results = [(e, None)] * len(group)
+                for (_, _, future), (error, result) in zip(group, results):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+        finally:
+            self._flushing = None
+
+    def _apply(self, group: list) -> list:
+        '''
+        apply a group of writes in one write transaction
+        :return: (exception, result) of each write
+        '''
+        results = []
+        with self._tree.handler.write_transaction:
+            for func, args, _ in group:
+                try:
+                    results.append((None, func(*args)))
+                except _WRITE_ERRORS as e:
+                    results.append((e, None))
+        return results
+
+    def transaction(self, write: bool = True) -> AsyncTransaction:
+        '''
+        :param write: a write transaction, committed when the block exits and rolled back when it raises,
+                      else a read transaction, a consistent view across several reads
+        '''
+        return AsyncTransaction(self, write)
+
+    async def get(self, key, default=None):
+        return await self._run(self._tree.get, key, default)
+
+    async def contains(self, key) -> bool:
+        return await self._run(self._tree.__contains__, key)
+
+    async def get_many(self, keys, default=None) -> list:
+        return await self._run(self._tree.get_many, list(keys), default)
+
+    async def put(self, key, value):
+        '''
+        insert or overwrite a key-value pair
+        '''
+        await self._write(self._tree.insert, key, value, True)
+
+    async def insert(self, key, value, replace: bool = False):
+        await self._write(self._tree.insert, key, value, replace)
+
+    async def delete(self, key):
+        await self._write(self._tree.delete, key)
+
+    async def insert_many(self, pairs, replace: bool = False) -> int:
+        '''
+        in a transaction of its own, it is all or nothing
+        '''
+        return await self._run(self._tree.insert_many, list(pairs), replace)
+
+    async def delete_many(self, keys) -> int:
+        return await self._run(self._tree.delete_many, list(keys))
+
+    async def items(self, start=None, end=None, reverse: bool = False, batch_size: int = ASYNC_SCAN_BATCH):
+        '''
+        async iteration over the pairs with start <= key < end, see BTree.items.
+        Pairs are fetched batch_size at a time.
+        '''
+        iterator = self._tree.items(start, end, reverse)
+        while True:
+            pairs = await self._run(list, itertools.islice(iterator, batch_size))
+            for pair in pairs:
+                yield pair
+            if len(pairs) < batch_size:
+                return
+
+    async def keys(self, start=None, end=None, reverse: bool = False, batch_size: int = ASYNC_SCAN_BATCH):
+        async for key, _ in self.items(start, end, reverse, batch_size):
+            yield key
+
+    async def values(self, start=None, end=None, reverse: bool = False, batch_size: int = ASYNC_SCAN_BATCH):
+        async for _, value in self.items(start, end, reverse, batch_size):
+            yield value
+
+    def __aiter__(self):
+        return self.keys()
+
+    async def checkpoint(self, passive: bool = True):
+        await self._run(self._tree.checkpoint, passive)
+
+    async def vacuum(self) -> int:
+        return await self._run(self._tree.vacuum)
+
+    async def verify(self, workers: int = None) -> list:
+        return await self._run(self._tree.verify, workers)
+
+    async def close(self):
+        '''
+        wait for the pending writes, close the tree and the executor
+        '''
+        if self._tree is None:
+            return
+        while self._flushing is not None:
+            await asyncio.shield(self._flushing)
+        await self._run(self._tree.close)
+        self._tree = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
@@ -1,84 +1,405 @@
-import io
+from __future__ import annotations
+import concurrent.futures
+import contextlib
 import logging
 import enum
+import itertools
+import zlib
+import mmap
 import os
 import threading
-from xiaolongbaodb.node import BNode, BaseBNode
-from xiaolongbaodb import constants, util, btree
+import time
+import weakref
+from typing import TYPE_CHECKING
+from xiaolongbaodb.node import BNode, BaseBNode, FreelistNode, OverflowNode
+from xiaolongbaodb import constants, util
+
+if TYPE_CHECKING:
+    from xiaolongbaodb import btree
 
 logger = logging.getLogger(constants.DEFAULT_LOGGER_NAME)
 
 
 class FileHandler():
-    __slots__ = ('_filename', '_tree_conf', '_fd', '_lock')
-    def __init__(self, filename: str, tree_conf: constants.TreeConf, cache_size: int):
+    # meta page: root page | order | page size | key size | value size | first freelist trunk page | padding | checksum
+    META_FREELIST_START = constants.PAGE_ADDRESS_LIMIT + 1 + constants.PAGE_LENGTH_LIMIT + constants.KEY_LENGTH_LIMIT + constants.VALUE_LENGTH_LIMIT
+    META_FREELIST_END = META_FREELIST_START + constants.PAGE_ADDRESS_LIMIT
+
+    __slots__ = ('_filename', '_tree_conf', '_fd', '_lock', '_cache', '_wal', 'last_page', '_auto_commit', '_free_pages',
+                 '_use_mmap', '_mmap', '_mmap_view', '_cache_lock', '_map_lock', '_durability',
+                 '_checkpoint_lock', '_checkpoint_frames', '_checkpoint_bytes', '_checkpoint_batch', '_pending_root', 'generation',
+                 '_pending_truncate', '_readahead', 'stats', '_dirty', '_dirty_limit', '_freed', '_taken', '_begin_last_page', '_snapshots', '_snapshot_lock',
+                 'on_rollback')
+    def __init__(self, filename: str, tree_conf: constants.TreeConf, cache_size: int, cache_policy='lru', cache_bytes: int = None, use_mmap: bool = False,
+                 durability='full', group_commit_window: float = 0.0, group_commit_size: int = 16,
+                 checkpoint_frames: int = 1000, checkpoint_bytes: int = None, checkpoint_batch: int = 64,
+                 readahead: int = constants.READAHEAD_PAGES, dirty_pages: int = constants.DIRTY_PAGES):
+        '''
+        :param cache_size: how many nodes to keep in the cache, None to only bound it by cache_bytes
+        :param cache_policy: 'lru', 'clock', '2q' or a util.PageCache subclass
+        :param cache_bytes: how many bytes of nodes to keep in the cache, each weighed by what it holds in memory
+        :param use_mmap: read pages of the db file through a read-only memory mapping
+        :param durability: 'full', 'normal' or 'off', see Durability
+        :param group_commit_window: seconds a committing writer waits for others to share its fsync
+        :param group_commit_size: commits that end the group commit window early
+        :param checkpoint_frames: checkpoint automatically once the WAL holds this many page frames, None to disable
+        :param checkpoint_bytes: checkpoint automatically once the WAL is this large, None to disable
+        :param checkpoint_batch: pages copied per batch by a passive checkpoint
+        :param readahead: most pages read ahead of a sequential scan, 0 to disable
+        :param dirty_pages: nodes a write transaction keeps modified in memory before spilling them to the WAL,
+                            0 to log every modification at once
+        '''
         self._filename = filename
         self._tree_conf = tree_conf
 
-        if cache_size <= 0:
+        if cache_size is not None and cache_size <= 0:
             cache_size = 1024
 
-        self._cache = util.LRUCache(capacity = cache_size)
+        self._cache = util.create_cache(cache_policy, capacity=cache_size, max_bytes=cache_bytes, weigher=self._node_weight)
         self._fd = util.open_database_file(self._filename)
-        self._lock = threading.Lock()
-        self._wal = WAL(filename, tree_conf.page_size)
+        # readers share the lock, writers are exclusive
+        self._lock = util.ReadWriteLock()
+        # concurrent readers still mutate the cache and the mapping
+        self._cache_lock = threading.Lock()
+        self._map_lock = threading.Lock()
+        self._durability = Durability(durability)
+        # shared with the WAL
+        self.stats = util.IOStats()
+        self._wal = WAL(filename, tree_conf.page_size, durability=self._durability,
+                        group_commit_window=group_commit_window, group_commit_size=group_commit_size, stats=self.stats)
+        self._use_mmap = use_mmap
+        self._mmap = None
+        self._mmap_view = None
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_frames = checkpoint_frames
+        self._checkpoint_bytes = checkpoint_bytes
+        self._checkpoint_batch = max(checkpoint_batch, 1)
+        self._readahead = util.ReadAhead(self._fd, tree_conf.page_size, readahead) if readahead else None
 
         # get the last available page
-        self._fd.seek(0, io.SEEK_END)
-        last_byte = self._fd.tell()
-        self.last_page = int(last_byte / self._tree_conf.page_size)
+        last_byte = util.file_size(self._fd)
+        self.last_page = max(last_byte // self._tree_conf.page_size - 1, 0)
+        # pages only written into the WAL are not part of the db file yet
+        self.last_page = max([self.last_page, *self._wal._commited_pages])
         self._auto_commit = True
-        self._page_GC = list(self._load_page_gc())
+        # root moved by the running write transaction, published in the meta page at commit
+        self._pending_root = None
+        # page -> node modified by the running write transaction, logged once at commit
+        self._dirty = dict()
+        self._dirty_limit = dirty_pages
+        # pages freed by the running write transaction, reusable once it commits
+        self._freed = []
+        # pages it took from the GC and the end of the file when it began, given back by a rollback
+        self._taken = []
+        self._begin_last_page = None
+        # called once a write transaction is rolled back, to drop the nodes held outside the cache
+        self.on_rollback = None
+        # open snapshots, no page they may read is overwritten meanwhile. A snapshot left open
+        # is released once garbage collected
+        self._snapshots = weakref.WeakSet()
+        self._snapshot_lock = threading.Lock()
+        # last page kept by a vacuum, the db file is truncated after it at commit
+        self._pending_truncate = None
+        # bumped by every page write, tells iterators whether the pages they hold may have changed
+        self.generation = 0
+        self._free_pages = util.FreePageMap(self._load_page_gc())
+
+    @staticmethod
+    def _node_weight(node: BNode) -> int:
+        '''
+        bytes held by a cached node, used when the cache is bounded by cache_bytes. A node decoded
+        lazily holds its page, a materialized one several times more
+        '''
+        return node.memory_size()
+
+    @property
+    def readahead_pages(self) -> int:
+        '''
+        most pages read ahead at once, 0 when disabled
+        '''
+        return self._readahead.max_pages if self._readahead is not None else 0
+
+    @property
+    def cache_stats(self) -> util.CacheStats:
+        return self._cache.stats
+
+    def sample_stats(self) -> dict:
+        '''
+        current counters of the page cache, the I/O and the files
+        '''
+        cache = self._cache.stats
+        return {
+            'cache': {'hits': cache.hits, 'misses': cache.misses, 'evictions': cache.evictions,
+                      'hit_ratio': cache.hit_ratio, 'size': len(self._cache)},
+            'last_page': self.last_page,
+            'free_pages': len(self._free_pages),
+            'wal_size': self._wal.size,
+            'wal_pending_frames': self._wal.frame_count,
+            **self.stats.as_dict(),
+        }
 
     def _load_page_gc(self):
         '''
-        load all deprecated page used before into the memory
+        load all deprecated page used before into the memory.
+        The free-page list persisted at the last clean close is used when present,
+        else every page of the db file is scanned for its type.
         '''
-        for offset in range(1, self.last_page):
-            page_start = offset * self._tree_conf.page_size
-            page_type = util.read_from_file(self._fd, page_start, constants.NODE_TYPE_LENGTH_LIMIT)
-            if page_type == 2: # _PageType.DEPRECATED_PAGE._value==2
+        try:
+            data = util.read_from_file(self._fd, self.META_FREELIST_START, self.META_FREELIST_END)
+        except util.EndOfFileError:
+            return
+        trunk_page = int.from_bytes(data, constants.ENDIAN)
+        if trunk_page:
+            yield from sorted(self._load_freelist(trunk_page))
+            # the list is only kept in memory until the next clean close, after a crash the
+            # pointer must not refer to pages which may have been reused meanwhile
+            self._set_meta_freelist(0)
+            return
+
+        for offset in range(1, self.last_page + 1):
+            # the version committed into the WAL replaces the one of the db file, the page may be
+            # in use again since the last checkpoint
+            if self._wal.has_page(offset):
+                page_type = self._wal.get_page(offset)[:constants.NODE_TYPE_LENGTH_LIMIT]
+            else:
+                page_start = offset * self._tree_conf.page_size
+                try:
+                    page_type = util.read_from_file(self._fd, page_start, page_start + constants.NODE_TYPE_LENGTH_LIMIT)
+                except util.EndOfFileError:
+                    # past the end of the db file and never logged, nothing refers to it
+                    yield offset
+                    continue
+            # _PageType.DEPRECATED_PAGE._value==2, trunks of a freelist left by a crash are free as well
+            if int.from_bytes(page_type, constants.ENDIAN) in (2, FreelistNode.PAGE_TYPE):
                 yield offset
 
+    def _load_freelist(self, trunk_page: int):
+        while trunk_page:
+            data = self._read_page_data(trunk_page)
+            self._check_page(trunk_page, data)
+            trunk = FreelistNode(self._tree_conf, trunk_page, data=data)
+            yield trunk_page
+            yield from trunk.pages
+            trunk_page = trunk.next_page
+
+    def _save_page_gc(self) -> int:
+        '''
+        persist the free pages as a chain of freelist trunks, the trunks themselves are free pages
+        :return: the first trunk page, 0 when no page is free
+        '''
+        free_pages = list(self._free_pages)
+        capacity = FreelistNode.capacity(self._tree_conf)
+        trunk_page = 0
+        while free_pages:
+            page = free_pages.pop()
+            trunk = FreelistNode(self._tree_conf, page, next_page=trunk_page, pages=free_pages[-capacity:])
+            del free_pages[-capacity:]
+            self._write_page_data(trunk.page, trunk.dump())
+            trunk_page = trunk.page
+        return trunk_page
+
+    def _set_meta_freelist(self, trunk_page: int):
+        data = bytearray(self._read_page_data(0))
+        data[self.META_FREELIST_START:self.META_FREELIST_END] = trunk_page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN)
+        self._write_page_data(0, util.seal_page(data), f_sync=self._durability is not Durability.OFF)
+
     @property
     def write_transaction(self):
         class WriteTransaction:
             def __enter__(_self):
-                self._lock.acquire()
+                self._lock.acquire_write()
+                if self._lock.write_depth == 1:
+                    self._begin_last_page = self.last_page
 
             def __exit__(_self, exc_type, exc_val, exc_tb):
-                if exc_type:
-                    self._wal.rollback()
-                    self._cache.clear()
-                else:
-                    if self._auto_commit:
-                        self._wal.commit()
-                self._lock.release()
+                commit_seq = None
+                # nested transactions are part of the outermost one, which commits them all at once
+                outermost = self._lock.write_depth == 1
+                try:
+                    if not outermost:
+                        pass
+                    elif exc_type:
+                        self._dirty.clear()
+                        # still referenced by the committed tree
+                        self._freed.clear()
+                        # nothing committed refers to the pages allocated meanwhile
+                        for page in self._taken:
+                            self._free_pages.add(page)
+                        self._taken.clear()
+                        self.last_page = self._begin_last_page
+                        self._wal.rollback()
+                        self._cache.clear()
+                        self.generation += 1
+                        self._pending_root = None
+                        self._pending_truncate = None
+                        if self.on_rollback is not None:
+                            self.on_rollback()
+                    else:
+                        pages = self._dump_dirty()
+                        if self._pending_root:
+                            # committed along with the nodes it points to
+                            pages.append((0, self._meta_page_data(*self._pending_root)))
+                            self._pending_root = None
+                        if self._auto_commit:
+                            commit_seq = self._wal.commit(pages)
+                        else:
+                            self._wal.set_pages(pages)
+                        for page in self._freed:
+                            self._free_pages.add(page)
+                        self._freed.clear()
+                        self._taken.clear()
+                        if self._pending_truncate is not None:
+                            self._truncate_locked(self._pending_truncate)
+                            self._pending_truncate = None
+                finally:
+                    self._lock.release_write()
+                # fsync after releasing the lock so the next writers can join the same group commit
+                if commit_seq and self._durability is Durability.FULL:
+                    self._wal.sync(commit_seq)
+                if commit_seq:
+                    self._maybe_checkpoint()
 
         return WriteTransaction()
 
+    @property
+    def exclusive_transaction(self):
+        '''
+        write transaction during which no checkpoint runs, so that the db file may be truncated at commit
+        '''
+        class ExclusiveTransaction:
+            def __enter__(_self):
+                if self._lock.write_depth:
+                    # a checkpointer holding the checkpoint lock may be waiting for this write lock
+                    raise RuntimeError('an exclusive transaction cannot be nested in a write transaction')
+                self._checkpoint_lock.acquire()
+                try:
+                    self._lock.acquire_write()
+                except BaseException:
+                    self._checkpoint_lock.release()
+                    raise
+                if self._snapshots:
+                    self._lock.release_write()
+                    self._checkpoint_lock.release()
+                    raise RuntimeError('an exclusive transaction cannot run while snapshots are open')
+
+            def __exit__(_self, exc_type, exc_val, exc_tb):
+                try:
+                    self.write_transaction.__exit__(exc_type, exc_val, exc_tb)
+                finally:
+                    self._checkpoint_lock.release()
+
+        return ExclusiveTransaction()
+
     @property
     def read_transaction(self):
         class ReadTransaction:
             def __enter__(_self):
-                self._lock.acquire()
+                self._lock.acquire_read()
 
-            def __exit__(_self):
-                self._lock.release()
+            def __exit__(_self, exc_type, exc_val, exc_tb):
+                self._lock.release_read()
 
         return ReadTransaction()
 
-    def _fd_seek_end(self):
-        self._fd.seek()
+    def _map_file(self):
+        '''
+        (re)map the whole db file, called lazily once a page beyond the current mapping is read
+        '''
+        self._unmap_file()
+        size = os.fstat(self._fd.fileno()).st_size
+        if size:
+            self._mmap = mmap.mmap(self._fd.fileno(), size, access=mmap.ACCESS_READ)
+            self._mmap_view = memoryview(self._mmap)
+
+    def _unmap_file(self):
+        if self._mmap is None:
+            return
+        self._mmap_view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a slice is still exported, the mapping goes away with its last reference
+            pass
+        self._mmap = self._mmap_view = None
 
     def _read_page_data(self, page: int) -> bytes:
         '''
-        read no.x page raw binary data from the db file 
+        read no.x page raw binary data from the db file,
+        a memoryview of the mapping is returned instead of a copy when mmap is enabled
         '''
         page_start = page * self._tree_conf.page_size
-        data = util.read_from_file(self._fd, page_start, page_start + self._tree_conf.page_size)
+        page_end = page_start + self._tree_conf.page_size
+        if self._use_mmap:
+            with self._map_lock:
+                if self._mmap is None or page_end > len(self._mmap):
+                    self._map_file()
+                if self._mmap is not None and page_end <= len(self._mmap):
+                    return self._mmap_view[page_start:page_end]
+
+        data = util.read_from_file(self._fd, page_start, page_end)
         return data
 
+    def _read_page(self, page: int) -> bytes:
+        '''
+        latest version of a page: from the WAL, else read ahead, else from the db file
+        '''
+        data = self._wal.get_page(page)
+        if data:
+            self.stats.wal_reads += 1
+            return data
+        data = self._readahead.take(page) if self._readahead is not None else None
+        if data is None:
+            start = time.perf_counter()
+            data = self._read_page_data(page)
+            self.stats.read_latency.record(time.perf_counter() - start)
+            self.stats.file_reads += 1
+        else:
+            self.stats.readahead_hits += 1
+        if self._readahead is not None:
+            self._read_ahead(self._readahead.note_access(page))
+        return data
+
+    def _read_ahead(self, pages):
+        '''
+        read the pages which are neither cached nor already on their way, in runs of
+        consecutive pages. With mmap the kernel is only advised to load them.
+        '''
+        if not pages:
+            return
+        with self._cache_lock:
+            pages = [page for page in pages if page > 0 and page not in self._cache]
+        pages = [page for page in pages if not self._wal.has_page(page) and not self._readahead.holds(page)]
+        if not pages:
+            return
+        page_size = self._tree_conf.page_size
+        file_pages = util.file_size(self._fd) // page_size
+        pages = [page for page in pages if page < file_pages]
+        for _, run in itertools.groupby(enumerate(sorted(pages)), key=lambda item: item[1] - item[0]):
+            run = [page for _, page in run]
+            if self._use_mmap:
+                util.advise_willneed(self._fd, run[0] * page_size, len(run) * page_size)
+            else:
+                self._readahead.schedule(run[0], len(run))
+
+    def _check_page(self, page: int, data: bytes):
+        '''
+        :raise util.ChecksumError: the page does not match its checksum
+        '''
+        if not util.page_is_intact(data):
+            raise util.ChecksumError('page {page} does not match its checksum'.format(page=page))
+
+    def _write_pages_data(self, first_page: int, pages_data: list, f_sync: bool = False):
+        '''
+        write a run of contiguous pages into the db file with a single vectored write
+        '''
+        page_start = first_page * self._tree_conf.page_size
+        start = time.perf_counter()
+        util.writev_to_file(self._fd, pages_data, page_start, f_sync=f_sync, stats=self.stats)
+        self.stats.write_latency.record(time.perf_counter() - start)
+        self.stats.file_writes += len(pages_data)
+        if self._readahead is not None:
+            self._readahead.invalidate(first_page, len(pages_data))
+
     def _write_page_data(self, page: int, page_data: bytes, f_sync: bool = False):
         '''
         write no.x page raw binary data into the db file
@@ -86,17 +407,23 @@ class FileHandler():
         assert len(page_data) == self._tree_conf.page_size, 'length of the page size does not match the page_data'
 
         page_start = page * self._tree_conf.page_size
-        self._fd.seek(page_start)
-        util.write_to_file(self._fd, page_data, f_sync=f_sync)
+        start = time.perf_counter()
+        util.write_to_file(self._fd, page_data, page_start, f_sync=f_sync, stats=self.stats)
+        self.stats.write_latency.record(time.perf_counter() - start)
+        self.stats.file_writes += 1
+        if self._readahead is not None:
+            self._readahead.invalidate(page, 1)
 
     def get_meta_tree_conf(self) -> tuple:
         '''
-        read former recorded tree conf from the db file, as first page data
+        read former recorded tree conf from the first page, its latest version is in the WAL
+        until the next checkpoint
         '''
         try:
-            data = self._read_page_data(0)
+            data = self._wal.get_page(0) or self._read_page_data(0)
         except util.EndOfFileError:
             raise ValueError('meta tree data not complete')
+        self._check_page(0, data)
         root_page = int.from_bytes(data[0:constants.PAGE_ADDRESS_LIMIT], constants.ENDIAN)
         order_end = constants.PAGE_ADDRESS_LIMIT + 1
         order = int.from_bytes(data[constants.PAGE_ADDRESS_LIMIT:order_end], constants.ENDIAN)
@@ -118,73 +445,431 @@ class FileHandler():
         try to get node from the cache to avoid extra i/o,
         if not exist, get and load from the db file
         '''
-        node = self._cache.get(page)
-        if node:
+        with self._cache_lock:
+            node = self._cache.get(page)
+        if node is not None:
+            return node
+        node = self._dirty.get(page)
+        if node is not None:
+            # evicted from the cache before the commit
+            with self._cache_lock:
+                self._cache[page] = node
             return node
 
-        data = self._wal.get_page(page)
-        if not data:
-            data = self._read_page_data(page)
-        
-        node = BaseBNode.from_raw_data(tree, self._tree_conf, page, data)
-        self._cache[page] = node
+        data = self._read_page(page)
+        try:
+            self._check_page(page, data)
+            node = BaseBNode.from_raw_data(tree, self._tree_conf, page, data)
+        finally:
+            if isinstance(data, memoryview):
+                # nodes never keep the raw page, let the mapping be resized
+                data.release()
+        with self._cache_lock:
+            self._cache[page] = node
         return node
 
+    def _get_overflow_node(self, page: int) -> OverflowNode:
+        data = self._read_page(page)
+        try:
+            self._check_page(page, data)
+            return OverflowNode(self._tree_conf, page, data)
+        finally:
+            if isinstance(data, memoryview):
+                data.release()
+
+    def write_overflow(self, data: bytes) -> int:
+        '''
+        store data in a chain of overflow pages, they bypass the page cache
+        :return: the first page of the chain
+        '''
+        capacity = OverflowNode.capacity(self._tree_conf)
+        pages = [self.next_available_page]
+        while len(pages) * capacity < len(data):
+            # a chain is read in order, keep its pages together
+            pages.append(self.next_page_near(pages[-1] + 1))
+        for index, page in enumerate(pages):
+            next_page = pages[index + 1] if index + 1 < len(pages) else 0
+            payload = data[index*capacity:(index+1)*capacity]
+            self._wal.set_page(page, OverflowNode(self._tree_conf, page, next_page=next_page, payload=payload).dump())
+        return pages[0]
+
+    def read_overflow(self, page: int, length: int) -> bytes:
+        '''
+        read back the length bytes stored in the chain of overflow pages starting at page
+        '''
+        data = bytearray()
+        while page and len(data) < length:
+            node = self._get_overflow_node(page)
+            data += node.payload
+            page = node.next_page
+        if len(data) != length:
+            raise ValueError('overflow chain is shorter than its value: {found} < {length}'.format(found=len(data), length=length))
+        return bytes(data)
+
+    def overflow_chain(self, page: int) -> list:
+        '''
+        :return: the pages of the overflow chain starting at page
+        '''
+        pages = []
+        while page:
+            pages.append(page)
+            page = self._get_overflow_node(page).next_page
+        return pages
+
+    def move_overflow(self, pages: list, moves: dict):
+        '''
+        rewrite an overflow chain whose pages are moved, see BTree.vacuum
+        :param moves: former page -> new page
+        '''
+        for page in pages:
+            node = self._get_overflow_node(page)
+            node.page, node.next_page = moves.get(page, page), moves.get(node.next_page, node.next_page)
+            self._wal.set_page(node.page, node.dump())
+
+    def free_overflow(self, page: int):
+        '''
+        hand every page of the chain starting at page to the GC, see set_deprecated_data
+        '''
+        while page:
+            next_page = self._get_overflow_node(page).next_page
+            self.set_deprecated_data(page)
+            page = next_page
+
+    def prefetch(self, *pages: int):
+        '''
+        start reading pages that are about to be needed, e.g. the next leaves of a scan,
+        skipped when they are cached or in the WAL
+        '''
+        if self._readahead is not None:
+            self._read_ahead(pages)
+            return
+        page_size = self._tree_conf.page_size
+        for page in pages:
+            with self._cache_lock:
+                cached = page in self._cache
+            if not (cached or self._wal.has_page(page)):
+                util.advise_willneed(self._fd, page * page_size, page_size)
+
     def set_node(self, node: BNode):
         '''
-        add & update node dumped data into the db file and also update the cache 
+        add & update node dumped data into the db file and also update the cache.
+        Inside a write transaction the node is only marked dirty, it is dumped once at commit
+        however many times it was modified
         '''
-        self._wal.set_page(node.page, node.dump())
+        if self._lock.write_depth and self._dirty_limit:
+            self._dirty[node.page] = node
+            if len(self._dirty) > self._dirty_limit:
+                # a large transaction, log its pages early as uncommitted frames
+                self._wal.set_pages(self._dump_dirty())
+        else:
+            self._wal.set_page(node.page, node.dump())
         self._cache[node.page] = node
+        self.generation += 1
+
+    def _dump_dirty(self) -> list:
+        '''
+        :return: (page, page data) of the dirty nodes, which are clean afterwards
+        '''
+        pages = [(page, node.dump()) for page, node in self._dirty.items()]
+        self._dirty.clear()
+        return pages
 
     def ensure_root_block(self, root: BNode):
         '''
-        sync current root node info with both memory and disk
+        sync current root node info with both memory and disk, the meta page is written
+        once the running write transaction commits
         '''
         self.set_node(root)
-        self.set_meta_tree_conf(root.page, root.tree_conf)
-        self.commit()
+        if self._lock.write_depth:
+            self._pending_root = (root.page, root.tree_conf)
+        else:
+            self.set_meta_tree_conf(root.page, root.tree_conf)
+            self.commit()
+
+    def commit(self):
+        self._wal.commit()
+
+    def _copy_pages(self, pages: list):
+        '''
+        copy WAL frames into the db file, pages must be in ascending order so that
+        contiguous pages are coalesced into a single sequential write
+        '''
+        run_start, run = None, []
+        for page, page_start in pages:
+            page_data = self._wal.read_page_at(page_start)
+            if run and page == run_start + len(run):
+                run.append(page_data)
+                continue
+            if run:
+                self._write_pages_data(run_start, run)
+            run_start, run = page, [page_data]
+        if run:
+            self._write_pages_data(run_start, run)
+
+    def _checkpoint_locked(self, copied: dict):
+        '''
+        copy what is left in the WAL and restart it, the write lock must be held
+        :param copied: page -> offset of the frame already copied by a passive pass
+        '''
+        if self._wal.has_uncommitted_pages:
+            # called inside a write transaction, its pages cannot be checkpointed yet
+            return
+        self._wal.flush()
+        self._copy_pages([(page, page_start) for page, page_start in self._wal.committed_pages() if copied.get(page) != page_start])
+        if self._durability is not Durability.OFF:
+            util.file_flush_and_sync(self._fd, self.stats)
+        self._wal.reset()
+
+    def checkpoint(self, passive: bool = True):
+        '''
+        transfer the committed pages from the WAL back to the db file and restart the WAL.
+        A passive checkpoint copies in batches under the read lock: readers are never blocked
+        and writers only wait for one batch. The write lock is then held just long enough to
+        copy the pages rewritten meanwhile and to restart the WAL.
+        '''
+        with self._checkpoint_lock:
+            self._checkpoint(passive)
+
+    def _checkpoint(self, passive: bool):
+        '''
+        deferred while snapshots are open, they read the pages the checkpoint would overwrite
+        '''
+        if self._snapshots:
+            return
+        start = time.perf_counter()
+        copied = dict()
+        if passive:
+            with self.read_transaction:
+                self._wal.flush()
+                pending = self._wal.committed_pages()
+            for first in range(0, len(pending), self._checkpoint_batch):
+                batch = pending[first:first+self._checkpoint_batch]
+                with self.read_transaction, self._snapshot_lock:
+                    if self._snapshots:
+                        # the pages copied so far are in the WAL, the snapshot reads them from their frames
+                        return
+                    # frames are never overwritten before the WAL restarts, an outdated offset
+                    # still reads a committed version which is copied again below
+                    self._copy_pages(batch)
+                copied.update(batch)
+
+        self._lock.acquire_write()
+        try:
+            if self._snapshots:
+                return
+            self._checkpoint_locked(copied)
+        finally:
+            self._lock.release_write()
+        self.stats.checkpoint_latency.record(time.perf_counter() - start)
+
+    def _maybe_checkpoint(self):
+        '''
+        run a passive checkpoint once the WAL is over one of its thresholds,
+        skipped when another thread is already checkpointing
+        '''
+        over_frames = self._checkpoint_frames is not None and self._wal.frame_count >= self._checkpoint_frames
+        over_bytes = self._checkpoint_bytes is not None and self._wal.size >= self._checkpoint_bytes
+        if not (over_frames or over_bytes):
+            return
+        if not self._checkpoint_lock.acquire(blocking=False):
+            return
+        try:
+            self._checkpoint(passive=True)
+        finally:
+            self._checkpoint_lock.release()
+
+    def verify(self, workers: int = None) -> list:
+        '''
+        check every page against its checksum. The db file is read sequentially in large chunks,
+        checked in parallel by a pool of processes, then the pages committed in the WAL are checked.
+        A page of the db file superseded by an intact WAL frame is repaired by the next checkpoint.
+        :param workers: processes of the pool, the number of CPUs by default
+        :return: the corrupted pages, empty when the database is intact
+        '''
+        page_size = self._tree_conf.page_size
+        chunk = constants.VERIFY_CHUNK_PAGES
+        # no checkpoint may rewrite the db file meanwhile
+        with self._checkpoint_lock, self.read_transaction:
+            firsts = range(0, util.file_size(self._fd) // page_size, chunk)
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                results = pool.map(util.verify_pages, itertools.repeat(self._filename + '.xdb'),
+                                   itertools.repeat(page_size), firsts, itertools.repeat(chunk))
+                corrupted = set(page for pages in results for page in pages)
+            for page, page_start in self._wal.committed_pages():
+                if util.page_is_intact(self._wal.read_page_at(page_start)):
+                    corrupted.discard(page)
+                else:
+                    corrupted.add(page)
+        return sorted(corrupted)
+
+    def close(self):
+        '''
+        transfer the committed pages from the WAL back to the db file and close it
+        '''
+        with self._checkpoint_lock, self.write_transaction:
+            with self._snapshot_lock:
+                for snapshot in self._snapshots:
+                    snapshot.close()
+                self._snapshots.clear()
+            self._checkpoint_locked(dict())
+            self._wal.close()
+            trunk_page = self._save_page_gc()
+            if self._durability is not Durability.OFF:
+                util.file_flush_and_sync(self._fd, self.stats)
+            if trunk_page:
+                self._set_meta_freelist(trunk_page)
+            self._cache.clear()
+            if self._readahead is not None:
+                self._readahead.close()
+            self._unmap_file()
+            self._fd.close()
+
+    def open_snapshot(self, cache_size: int) -> SnapshotHandler:
+        '''
+        pin the pages committed so far, until release_snapshot. Must be called in a read transaction
+        so that no commit happens meanwhile.
+        :param cache_size: nodes cached by the snapshot itself, the page cache holds the latest versions
+        '''
+        if self._lock.write_depth:
+            # the tree may already point to the uncommitted nodes of the transaction
+            raise RuntimeError('a snapshot cannot be taken in a write transaction')
+        with self._snapshot_lock:
+            snapshot = SnapshotHandler(self._filename, self._tree_conf, self._wal.committed_index(), cache_size, owner=self)
+            self._snapshots.add(snapshot)
+        return snapshot
+
+    def release_snapshot(self, snapshot: SnapshotHandler):
+        '''
+        the checkpoints deferred meanwhile run again from the next commit
+        '''
+        with self._snapshot_lock:
+            self._snapshots.discard(snapshot)
+        snapshot.close()
 
     def set_meta_tree_conf(self, page: int, tree_conf: constants.TreeConf):
         '''
-        set current tree conf into the db file, record in the first page,
-        file-sync is necessary.
+        log the first page recording the root and the tree conf into the WAL, uncommitted.
+        Like any page it is copied into the db file by a checkpoint, so it is never durable
+        before the nodes it points to.
         '''
+        self._wal.set_page(0, self._meta_page_data(page, tree_conf))
+
+    def _meta_page_data(self, page: int, tree_conf: constants.TreeConf) -> bytes:
         self._tree_conf = tree_conf
-        length = constants.PAGE_ADDRESS_LIMIT + 1 + constants.PAGE_LENGTH_LIMIT + constants.KEY_LENGTH_LIMIT + constants.VALUE_LENGTH_LIMIT
-        data = (
+        data = bytearray(self._tree_conf.page_size)
+        data[0:self.META_FREELIST_START] = (
             page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN) +
             self._tree_conf.order.to_bytes(1, constants.ENDIAN) + 
             self._tree_conf.page_size.to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN) + 
             self._tree_conf.key_size.to_bytes(constants.KEY_LENGTH_LIMIT, constants.ENDIAN) +
-            self._tree_conf.value_size.to_bytes(constants.VALUE_LENGTH_LIMIT, constants.ENDIAN) +
-            bytes(self._tree_conf.page_size - length) # padding
+            self._tree_conf.value_size.to_bytes(constants.VALUE_LENGTH_LIMIT, constants.ENDIAN)
         )
-        self._write_page_data(0, data, f_sync=True)
+        # the free-page list is only persisted by a clean close, after the WAL is gone
+        return util.seal_page(data)
 
-    def _takeout_deprecated_page(self) -> int:
+    def _takeout_deprecated_page(self, near: int = None) -> int:
         '''
-        if GC still has pages, take the smallest one
+        if GC still has pages, take the one nearest to near, else the smallest one
         '''
-        if self._page_GC:
-            return self._page_GC.pop(0)
-        return None
+        try:
+            page = self._free_pages.pop(near)
+        except KeyError:
+            return None
+        if self._lock.write_depth:
+            self._taken.append(page)
+        return page
 
-    def set_deprecated_data(self, dep_page: int, dep_page_data: bytes):
+    def set_deprecated_data(self, dep_page: int, dep_page_data: bytes = None):
         '''
-        set page as deprecated in the db file
+        set page as deprecated in the db file, and hand it to the GC for reuse. Inside a write
+        transaction the page is only reused once the transaction commits: until then the committed
+        tree, which a rollback goes back to, may still refer to it
         '''
+        if dep_page_data is None:
+            dep_page_data = bytearray(self._tree_conf.page_size)
+            dep_page_data[0:constants.NODE_TYPE_LENGTH_LIMIT] = (2).to_bytes(constants.NODE_TYPE_LENGTH_LIMIT, constants.ENDIAN)
+            dep_page_data = util.seal_page(dep_page_data)
         if dep_page in self._cache:
             del self._cache[dep_page]
+        # its last version must not be logged after the deprecated data
+        self._dirty.pop(dep_page, None)
+        if self._lock.write_depth:
+            self._freed.append(dep_page)
+        else:
+            self._free_pages.add(dep_page)
+        self.generation += 1
         # when auto_commit is closed, wal won't record uncommitted pages
         # so deprecated pages only maintain in the memory
         if self._auto_commit:
             self._wal.set_page_depcrecated(dep_page, dep_page_data)
 
+    def allocate_page(self) -> int:
+        '''
+        get a page at the end of the file, skipping the GC, so consecutive calls return a contiguous run
+        '''
+        self.last_page += 1
+        return self.last_page
+
+    def write_nodes(self, nodes: list):
+        '''
+        write nodes of freshly allocated pages straight into the db file, bypassing the WAL.
+        Only for pages no committed node refers to yet, e.g. while bulk loading.
+        '''
+        run_start, run = None, []
+        for node in sorted(nodes, key=lambda node: node.page):
+            if run and node.page == run_start + len(run):
+                run.append(node.dump())
+                continue
+            if run:
+                self._write_pages_data(run_start, run)
+            run_start, run = node.page, [node.dump()]
+        if run:
+            self._write_pages_data(run_start, run)
+
+    def sync_db_file(self):
+        if self._durability is not Durability.OFF:
+            util.file_flush_and_sync(self._fd, self.stats)
+
+    def take_page(self, page: int):
+        '''
+        take a given page out of the GC, e.g. the destination of a page moved by a vacuum
+        '''
+        if page in self._free_pages and self._lock.write_depth:
+            self._taken.append(page)
+        self._free_pages.discard(page)
+
+    def truncate(self, last_page: int):
+        '''
+        cut the db file after last_page once the running exclusive transaction commits,
+        every page after it must be unreferenced by then
+        '''
+        assert self._lock.write_depth
+        self._pending_truncate = last_page
+
+    def _truncate_locked(self, last_page: int):
+        self._checkpoint_locked(dict())
+        with self._map_lock:
+            self._unmap_file()
+        os.ftruncate(self._fd.fileno(), (last_page + 1) * self._tree_conf.page_size)
+        self.sync_db_file()
+        self.last_page = last_page
+        self._free_pages.truncate(last_page)
+        # moved nodes are still cached under the page they left
+        self._cache.clear()
+        if self._readahead is not None:
+            self._readahead.invalidate()
+        self.generation += 1
+
     @property
     def next_available_page(self) -> int:
-        # try to get one page from the GC first, else get one by increase last_page
-        dep_page = self._takeout_deprecated_page()
+        return self.next_page_near(None)
+
+    def next_page_near(self, page: int) -> int:
+        '''
+        get a free page from the GC, the one nearest to page so that neighbour nodes stay close
+        in the db file, else one at the end of the file
+        '''
+        dep_page = self._takeout_deprecated_page(page)
         if dep_page:
             return dep_page
         else:
@@ -192,10 +877,118 @@ class FileHandler():
             return self.last_page
 
 
+class SnapshotHandler():
+    '''
+    read-only page access of a snapshot. Pages committed in the WAL when it was taken are read from
+    their frames, the other ones from the db file. Neither changes while the snapshot is open: frames
+    are only appended, and the checkpoints which would copy newer pages into the db file and restart
+    the WAL are deferred. A freed page may be reused meanwhile, its new versions go to new frames.
+    Reads therefore take no lock, they never wait for writers nor block them, and other processes
+    can open the same snapshot again from its pinned state.
+    '''
+    __slots__ = ('_filename', '_tree_conf', '_pages', '_owner', '_fd', '_wal_fd', '_cache', '_cache_lock', '_closed',
+                 '__weakref__')
+    # the pages never change, a scan never needs to locate its position again
+    generation = 0
+    readahead_pages = 0
+
+    def __init__(self, filename: str, tree_conf: constants.TreeConf, pages: dict, cache_size: int,
+                 owner: FileHandler = None):
+        '''
+        :param pages: committed page -> offset of its frame in the WAL
+        :param owner: handler the snapshot is taken from and whose files it reads,
+                      None to open the files read-only, from another process
+        '''
+        self._filename = filename
+        self._tree_conf = tree_conf
+        self._pages = pages
+        self._owner = owner
+        if owner is None:
+            self._fd = open(filename + '.xdb', 'rb', buffering=0)
+            self._wal_fd = open(filename + '.xdb.wal', 'rb', buffering=0)
+        else:
+            self._fd = owner._fd
+            self._wal_fd = owner._wal._fd
+        self._cache = util.create_cache('lru', capacity=cache_size)
+        self._cache_lock = threading.Lock()
+        self._closed = False
+
+    def pinned(self) -> tuple:
+        '''
+        :return: the arguments opening the snapshot again in another process, but the cache size
+        '''
+        return self._filename, self._tree_conf, self._pages
+
+    @property
+    def read_transaction(self):
+        return contextlib.nullcontext()
+
+    def _read_page(self, page: int) -> bytes:
+        if self._closed:
+            raise ValueError('the snapshot is closed')
+        page_size = self._tree_conf.page_size
+        page_start = self._pages.get(page)
+        if page_start is not None:
+            return util.read_from_file(self._wal_fd, page_start, page_start + page_size)
+        return util.read_from_file(self._fd, page * page_size, (page + 1) * page_size)
+
+    def _parse(self, page: int, parse):
+        data = self._read_page(page)
+        if not util.page_is_intact(data):
+            raise util.ChecksumError('page {page} does not match its checksum'.format(page=page))
+        return parse(data)
+
+    def get_node(self, page: int, tree: btree.BTree) -> BNode:
+        with self._cache_lock:
+            node = self._cache.get(page)
+        if node is not None:
+            return node
+        node = self._parse(page, lambda data: BaseBNode.from_raw_data(tree, self._tree_conf, page, data))
+        with self._cache_lock:
+            self._cache[page] = node
+        return node
+
+    def _get_overflow_node(self, page: int) -> OverflowNode:
+        return self._parse(page, lambda data: OverflowNode(self._tree_conf, page, data))
+
+    read_overflow = FileHandler.read_overflow
+
+    def prefetch(self, *pages: int):
+        '''
+        pages of a snapshot are read on demand
+        '''
+        pass
+
+    def release(self):
+        if self._owner is None:
+            self.close()
+        else:
+            self._owner.release_snapshot(self)
+
+    def close(self):
+        self._closed = True
+        with self._cache_lock:
+            self._cache.clear()
+        if self._owner is None:
+            self._fd.close()
+            self._wal_fd.close()
+
+
+class Durability(enum.Enum):
+    # fsync the WAL on every commit, concurrent commits share one fsync
+    FULL = 'full'
+    # fsync the WAL only at checkpoint, the last commits may be lost on power failure
+    NORMAL = 'normal'
+    # never fsync, leave it to the OS
+    OFF = 'off'
+
+
 class FrameType(enum.Enum):
     PAGE = 1
     COMMIT = 2
     ROLLBACK = 3
+    # committed pages and their offsets, the page field holds the number of entries
+    INDEX = 4
 
 
 class WAL():
@@ -205,18 +998,38 @@ class WAL():
     next time user open the same database.
     '''
 
-    FRAME_HEADER_LENGTH = constants.FRAME_TYPE_LENGTH_LIMIT + constants.PAGE_ADDRESS_LIMIT
+    # frame header: frame type | page | CRC32 of the type, the page and the frame payload
+    FRAME_HEADER_LENGTH = constants.FRAME_TYPE_LENGTH_LIMIT + constants.PAGE_ADDRESS_LIMIT + constants.CHECKSUM_LENGTH
+    CHECKSUM_START = constants.FRAME_TYPE_LENGTH_LIMIT + constants.PAGE_ADDRESS_LIMIT
+    # header: page size | offset of the last INDEX frame
+    HEADER_LENGTH = constants.PAGE_LENGTH_LIMIT + constants.WAL_OFFSET_LIMIT
+    INDEX_ENTRY_LENGTH = constants.PAGE_ADDRESS_LIMIT + constants.WAL_OFFSET_LIMIT
 
-    def __init__(self, filename: str, page_size: int) -> None:
+    def __init__(self, filename: str, page_size: int, durability: Durability = Durability.FULL,
+                 group_commit_window: float = 0.0, group_commit_size: int = 16, stats: util.IOStats = None) -> None:
         self._filename = filename
+        self._stats = stats or util.IOStats()
         self._fd = util.open_database_file(filename=filename, suffix='.xdb.wal')
         self._page_size = page_size
+        self._durability = durability
+
+        # group commit: COMMIT frames are counted, the fsync leader makes all of them durable at once
+        self._group_commit_window = group_commit_window
+        self._group_commit_size = group_commit_size
+        self._sync_cond = threading.Condition()
+        self._syncing = False
+        self._commit_seq = 0
+        self._synced_seq = 0
 
         self._commited_pages = dict()
         self._uncommited_pages = dict()
+        # frames are appended at this offset, the file position is never used
+        self._end = self.HEADER_LENGTH
+        self._frames_since_index = 0
+        # page frames since the WAL (re)started, drives automatic checkpoints
+        self.frame_count = 0
 
-        self._fd.seek(0, io.SEEK_END)
-        if self._fd.tell() == 0:
+        if util.file_size(self._fd) == 0:
             # if the wal log is empty, we need to create a new one
             self._create_header()
             self.needs_recovery = False
@@ -226,43 +1039,129 @@ class WAL():
             self._load_wal()
 
     def _create_header(self):
-        data = self._page_size.to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN)
-        self._fd.seek(0)
-        util.write_to_file(self._fd, data, True)
+        data = self._page_size.to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN) + bytes(constants.WAL_OFFSET_LIMIT)
+        util.write_to_file(self._fd, data, 0, self._durability is not Durability.OFF, stats=self._stats)
 
     def _load_wal(self):
         '''
         load previous WAL generated when B Tree closed accidentally.
         '''
-        self._fd.seek(0)
-        header_data = util.read_from_file(self, 0, constants.PAGE_LENGTH_LIMIT)
-        assert int.from_bytes(header_data, constants.ENDIAN) == self._page_size
+        header_data = util.read_from_file(self._fd, 0, self.HEADER_LENGTH)
+        assert int.from_bytes(header_data[0:constants.PAGE_LENGTH_LIMIT], constants.ENDIAN) == self._page_size
+        index_start = int.from_bytes(header_data[constants.PAGE_LENGTH_LIMIT:], constants.ENDIAN)
 
+        file_size = util.file_size(self._fd)
+        if index_start:
+            # only the frames appended after the last index need to be replayed
+            try:
+                self._end = self._load_index(index_start)
+            except util.ChecksumError:
+                logger.warning('WAL index is corrupted, walking every frame')
+                self._commited_pages = dict()
+                self.frame_count = 0
         while True:
             try:
-                self._load_next_frame()
+                self._end = self._load_next_frame(self._end, file_size)
             except util.EndOfFileError:
                 break
+            except util.ChecksumError:
+                # frames past a torn one must not be replayed after the next crash
+                logger.warning('torn WAL frame at {offset}, discarding the frames after it'.format(offset=self._end))
+                os.ftruncate(self._fd.fileno(), self._end)
+                break
         if self._uncommited_pages:
             logger.warning('WAL has uncommited data, discarding it')
             self._uncommited_pages = dict()
 
-    def _load_next_frame(self):
-        start = self._fd.tell()
+    @classmethod
+    def _frame_checksum(cls, header: bytes, payload: bytes) -> bytes:
+        checksum = zlib.crc32(payload, zlib.crc32(header[0:cls.CHECKSUM_START]))
+        return checksum.to_bytes(constants.CHECKSUM_LENGTH, constants.ENDIAN)
+
+    def _read_frame(self, start: int, file_size: int) -> tuple:
+        '''
+        read and check the frame at `start`
+        :return: frame type, page field, offset of the payload and the payload
+        :raise util.ChecksumError: the frame was torn
+        '''
         end = start + self.FRAME_HEADER_LENGTH
         data = util.read_from_file(self._fd, start, end)
-
-        frame_type = int.from_bytes(data[0:constants.FRAME_TYPE_LENGTH_LIMIT], constants.ENDIAN)
-        frame_type = FrameType(frame_type)
+        try:
+            frame_type = FrameType(int.from_bytes(data[0:constants.FRAME_TYPE_LENGTH_LIMIT], constants.ENDIAN))
+        except ValueError:
+            raise util.ChecksumError('unknown frame type')
+        page = int.from_bytes(data[constants.FRAME_TYPE_LENGTH_LIMIT:self.CHECKSUM_START], constants.ENDIAN)
+        next_start = end
         if frame_type is FrameType.PAGE:
-            self._fd.seek(end + self._page_size)
+            next_start = end + self._page_size
+        elif frame_type is FrameType.INDEX:
+            next_start = end + page * self.INDEX_ENTRY_LENGTH
+        if next_start > file_size:
+            # torn frame at the tail
+            raise util.EndOfFileError('incomplete frame')
+        payload = util.read_from_file(self._fd, end, next_start)
+        if self._frame_checksum(data, payload) != data[self.CHECKSUM_START:]:
+            raise util.ChecksumError('frame does not match its checksum')
+        return frame_type, page, end, payload
 
-        page = int.from_bytes(data[constants.FRAME_TYPE_LENGTH_LIMIT:constants.FRAME_TYPE_LENGTH_LIMIT+constants.PAGE_ADDRESS_LIMIT])
-        self._index_frame(frame_type, page, end)
+    def _load_next_frame(self, start: int, file_size: int) -> int:
+        '''
+        index the frame at `start`, an INDEX frame the header does not point to yet is skipped,
+        the frames before it were already walked
+        :return: offset of the next frame
+        '''
+        frame_type, page, end, payload = self._read_frame(start, file_size)
+        next_start = end + len(payload)
+        if frame_type is not FrameType.INDEX:
+            self._index_frame(frame_type, page, end)
+        return next_start
+
+    def _load_index(self, index_start: int) -> int:
+        '''
+        load the committed pages recorded by an INDEX frame
+        :return: offset of the frame following the index
+        '''
+        try:
+            frame_type, count, start, entries = self._read_frame(index_start, util.file_size(self._fd))
+        except util.EndOfFileError:
+            raise util.ChecksumError('incomplete index')
+        if frame_type is not FrameType.INDEX:
+            raise util.ChecksumError('the header does not point to an index')
+        end = start + len(entries)
+        for entry_start in range(0, len(entries), self.INDEX_ENTRY_LENGTH):
+            page_end = entry_start + constants.PAGE_ADDRESS_LIMIT
+            page = int.from_bytes(entries[entry_start:page_end], constants.ENDIAN)
+            page_start = int.from_bytes(entries[page_end:entry_start+self.INDEX_ENTRY_LENGTH], constants.ENDIAN)
+            self._commited_pages[page] = page_start
+        self.frame_count = count
+        return end
+
+    def _write_index(self):
+        '''
+        append an INDEX frame holding the committed pages, then point the header to it,
+        so opening the WAL does not need to walk every frame
+        '''
+        assert not self._uncommited_pages
+        header = (
+            FrameType.INDEX.value.to_bytes(constants.FRAME_TYPE_LENGTH_LIMIT, constants.ENDIAN) +
+            len(self._commited_pages).to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN)
+        )
+        entries = b''.join(
+            page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN) + page_start.to_bytes(constants.WAL_OFFSET_LIMIT, constants.ENDIAN)
+            for page, page_start in self._commited_pages.items()
+        )
+        header += self._frame_checksum(header, entries)
+        frame_start = self._end
+        # the index must be on disk before the header refers to it
+        util.writev_to_file(self._fd, [header, entries], frame_start, f_sync=self._durability is not Durability.OFF, stats=self._stats)
+        self._end += len(header) + len(entries)
+        util.write_to_file(self._fd, frame_start.to_bytes(constants.WAL_OFFSET_LIMIT, constants.ENDIAN), constants.PAGE_LENGTH_LIMIT)
+        self._frames_since_index = 0
 
     def _index_frame(self, frame_type: FrameType, page: int, page_start: int):
         if frame_type is FrameType.PAGE:
             self._uncommited_pages[page] = page_start
+            self.frame_count += 1
         elif frame_type is FrameType.COMMIT:
             self._commited_pages.update(self._uncommited_pages)
             self._uncommited_pages = dict()
@@ -271,44 +1170,114 @@ class WAL():
         else:
             assert False
 
-    def _add_frame(self, frame_type: FrameType, page: int = None, page_data: bytes = None):
-        if frame_type is FrameType.PAGE and (not page or not page_data):
-            raise ValueError('page frame without page or page data')
-        if page_data and len(page_data) != self._page_size:
-            raise ValueError('page data is different from the page size')
-        if not page:
-            page = 0
-        if frame_type is not FrameType.PAGE:
-            page_data = b''
-        data = (
-            frame_type.value.to_bytes(constants.FRAME_TYPE_LENGTH_LIMIT, constants.ENDIAN) + 
-            page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN) +
-            page_data
-        )
+    def _add_frames(self, frames: list):
+        '''
+        append frames of (frame type, page, page data) with a single vectored write
+        '''
+        buffers = []
+        positions = []
+        end = self._end
+        for frame_type, page, page_data in frames:
+            # page 0 is the meta page
+            if frame_type is FrameType.PAGE and (page is None or not page_data):
+                raise ValueError('page frame without page or page data')
+            if page_data and len(page_data) != self._page_size:
+                raise ValueError('page data is different from the page size')
+            if not page:
+                page = 0
+            if frame_type is not FrameType.PAGE:
+                page_data = b''
+            header = (
+                frame_type.value.to_bytes(constants.FRAME_TYPE_LENGTH_LIMIT, constants.ENDIAN) +
+                page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN)
+            )
+            header += self._frame_checksum(header, page_data)
+            # headers and pages are written by one pwritev, no concatenated copy of the pages
+            buffers += [header, page_data]
+            positions.append((frame_type, page, end + self.FRAME_HEADER_LENGTH))
+            end += len(header) + len(page_data)
 
-        if page in self._commited_pages.keys() and frame_type == FrameType.PAGE:
-            # if this page has wrote into WAL before, overwrite it, or the size of .wal file will boom.
-            page_start = self._commited_pages[page]
-            seek_start = page_start - constants.FRAME_TYPE_LENGTH_LIMIT - constants.PAGE_ADDRESS_LIMIT
-            self._fd.seek(seek_start)
-        else:
-            self._fd.seek(0, io.SEEK_END)
-        util.write_to_file(self._fd, data, f_sync=frame_type != FrameType.PAGE)
-        self._index_frame(frame_type, page, self._fd.tell() - self._page_size)
+        # frames are only appended, a committed frame stays valid until the WAL restarts;
+        # checkpoints keep the size of the .wal file bounded
+        frame_start = self._end
+        self._end = end
+        # COMMIT frames are made durable by sync(), out of the write lock
+        start = time.perf_counter()
+        util.writev_to_file(self._fd, buffers, frame_start)
+        self._stats.append_latency.record(time.perf_counter() - start)
+        self._stats.wal_frames += len(frames)
+        self._stats.wal_bytes += end - frame_start
+        self._frames_since_index += len(frames)
+        for frame_type, page, page_start in positions:
+            self._index_frame(frame_type, page, page_start)
+
+    def _add_frame(self, frame_type: FrameType, page: int = None, page_data: bytes = None):
+        self._add_frames([(frame_type, page, page_data)])
 
     def set_page(self, page: int, page_data: bytes):
         self._add_frame(FrameType.PAGE, page, page_data)
 
-    def commit(self):
+    def set_pages(self, pages: list):
+        '''
+        log several (page, page data) at once, uncommitted
+        '''
+        if pages:
+            self._add_frames([(FrameType.PAGE, page, page_data) for page, page_data in pages])
+
+    def commit(self, pages: list = ()) -> int:
         '''
         commit is no-op when there is no uncommitted pages.
+        :param pages: (page, page data) logged in the same write as the COMMIT frame
+        :return: sequence of the last commit, to be passed to sync()
         '''
-        if self._uncommited_pages:
-            self._add_frame(FrameType.COMMIT)
+        if self._uncommited_pages or pages:
+            frames = [(FrameType.PAGE, page, page_data) for page, page_data in pages]
+            self._add_frames(frames + [(FrameType.COMMIT, None, None)])
+            self._stats.commits += 1
+            if self._frames_since_index >= constants.WAL_INDEX_INTERVAL:
+                self._write_index()
+            with self._sync_cond:
+                self._commit_seq += 1
+                self._sync_cond.notify_all()
+        return self._commit_seq
+
+    def sync(self, commit_seq: int):
+        '''
+        wait until the commit `commit_seq` is durable. The first waiter becomes the leader,
+        waits up to the group commit window for other commits, then one fsync covers them all.
+        '''
+        with self._sync_cond:
+            while self._syncing and self._synced_seq < commit_seq:
+                self._sync_cond.wait()
+            if self._synced_seq >= commit_seq:
+                return
+            self._syncing = True
+            deadline = time.monotonic() + self._group_commit_window
+            while self._commit_seq - self._synced_seq < self._group_commit_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._sync_cond.wait(remaining)
+            target_seq = self._commit_seq
+
+        synced = False
+        try:
+            util.file_flush_and_sync(self._fd, self._stats)
+            synced = True
+        finally:
+            with self._sync_cond:
+                self._syncing = False
+                if synced:
+                    self._synced_seq = max(self._synced_seq, target_seq)
+                self._sync_cond.notify_all()
 
     def rollback(self):
         if self._uncommited_pages:
             self._add_frame(FrameType.ROLLBACK)
+            self._stats.rollbacks += 1
+
+    def has_page(self, page: int) -> bool:
+        return page in self._uncommited_pages or page in self._commited_pages
 
     def get_page(self, page: int) -> bytes:
         page_start = None
@@ -323,26 +1292,65 @@ class WAL():
 
         return util.read_from_file(self._fd, page_start, page_start + self._page_size)
 
-    def checkpoint(self):
+    @property
+    def size(self) -> int:
+        return self._end
+
+    @property
+    def has_uncommitted_pages(self) -> bool:
+        return bool(self._uncommited_pages)
+
+    def committed_index(self) -> dict:
         '''
-        transfer the modified data back to the test_tree and close the WAL
+        copy of the committed pages and the offset of their latest frame
         '''
-        if self._uncommited_pages:
-            logger.warning('close WAL with uncommited data, discarding it')
+        return dict(self._commited_pages)
+
+    def committed_pages(self) -> list:
+        '''
+        committed pages with the offset of their latest frame, in ascending page order
+        '''
+        return sorted(self._commited_pages.items())
 
-        util.file_flush_and_sync(self._fd)
+    def read_page_at(self, page_start: int) -> bytes:
+        return util.read_from_file(self._fd, page_start, page_start + self._page_size)
 
-        for page, page_start in self._commited_pages.items():
-            page_data = util.read_from_file(self._fd, page_start, page_start + self._page_size)
-            yield page, page_data
+    def flush(self):
+        '''
+        make every frame durable before the db file is modified by a checkpoint
+        '''
+        if self._durability is not Durability.OFF:
+            util.file_flush_and_sync(self._fd, self._stats)
+
+    def reset(self):
+        '''
+        restart the log after a checkpoint, once every committed page is durable in the db file
+        '''
+        assert not self._uncommited_pages
+        os.ftruncate(self._fd.fileno(), self.HEADER_LENGTH)
+        util.write_to_file(self._fd, bytes(constants.WAL_OFFSET_LIMIT), constants.PAGE_LENGTH_LIMIT)
+        # stale frames must not come back after a crash and be replayed over newer pages
+        self.flush()
+        self._commited_pages = dict()
+        self._end = self.HEADER_LENGTH
+        self._frames_since_index = 0
+        self.frame_count = 0
+        with self._sync_cond:
+            # pending syncs are already satisfied by the db file
+            self._synced_seq = self._commit_seq
+            self._sync_cond.notify_all()
 
+    def close(self):
+        '''
+        close and remove the WAL, it must have been checkpointed before
+        '''
+        if self._uncommited_pages:
+            logger.warning('close WAL with uncommited data, discarding it')
         self._fd.close()
         os.unlink(self._filename + '.xdb.wal')
 
     def set_page_depcrecated(self, dep_page: int, dep_page_data: bytes):
-        assert dep_page in self._commited_pages.keys(), 'page to be set as depcrecated not found'
-        dep_page_start = self._commited_pages[dep_page]
-        dep_page_seek_start = dep_page_start - constants.FRAME_TYPE_LENGTH_LIMIT - constants.PAGE_ADDRESS_LIMIT
-        self._fd.seek(dep_page_seek_start)
-        util.write_to_file(self._fd, dep_page_data)
-        del self._commited_pages[dep_page]
\ No newline at end of file
+        '''
+        deprecated data is logged like any page, the checkpoint then marks the page in the db file
+        '''
+        self.set_page(dep_page, dep_page_data)
\ No newline at end of file
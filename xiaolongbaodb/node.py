@@ -1,26 +1,152 @@
+from __future__ import annotations
+import bisect
 import functools
+import struct
 from abc import ABCMeta, abstractmethod
-from xiaolongbaodb import constants
-from xiaolongbaodb.constants import KEY_LENGTH_LIMIT, SERIALIZER_TYPE_LENGTH_LIMIT, TreeConf, VALUE_LENGTH_LIMIT
-from xiaolongbaodb.btree import BTree
+from typing import TYPE_CHECKING
+from xiaolongbaodb import constants, serializer, util
+from xiaolongbaodb.constants import (COMPRESSION_MASK, COMPRESSION_MIN_LENGTH, COMPRESSION_SHIFT, KEY_LENGTH_LIMIT, OVERFLOW_FLAG,
+                                     SERIALIZER_TYPE_LENGTH_LIMIT, SERIALIZER_TYPE_MASK, TreeConf, VALUE_LENGTH_LIMIT)
 
-@functools.total_ordering
-class KeyValPair(metaclass=ABCMeta):
+if TYPE_CHECKING:
+    from xiaolongbaodb.btree import BTree
+
+# serialized form of None, values of internal nodes
+EMPTY_VALUE_DATA = (0, b'')
+
+# in-memory value of an entry whose value is compressed or in overflow pages, decoded on access
+PACKED_VALUE = object()
+
+# struct codes of the fixed-width big-endian integers of the page layouts
+_INTEGER_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+# serializer type | shared prefix length | key suffix length
+_KEY_HEADER = struct.Struct('>' + _INTEGER_CODES[SERIALIZER_TYPE_LENGTH_LIMIT] + 2 * _INTEGER_CODES[KEY_LENGTH_LIMIT])
+# serializer type | value length
+_VALUE_HEADER = struct.Struct('>' + _INTEGER_CODES[SERIALIZER_TYPE_LENGTH_LIMIT] + _INTEGER_CODES[VALUE_LENGTH_LIMIT])
+# stored in place of a value moved to overflow pages: first overflow page | value length
+_OVERFLOW_REFERENCE = struct.Struct('>' + _INTEGER_CODES[constants.PAGE_ADDRESS_LIMIT] + _INTEGER_CODES[VALUE_LENGTH_LIMIT])
+# bytes of the Python objects of a materialized entry besides its data: the decoded key and value,
+# the tuples of the serialized ones, the encoded entry and a slot in each array
+_ENTRY_OVERHEAD = 340
+
+
+def serialize_key(tree_conf: TreeConf, key) -> tuple:
     '''
-    unit to store a paire of key-value, switch its serializer automatically by its type
+    :return: serializer type and serialized key
     '''
-    def __init__(self, tree_conf: TreeConf, key=None, value=None, data: bytes=None):
-        self.tree_conf = tree_conf
-        self._key = key
-        self._val = value
-        self.length = (KEY_LENGTH_LIMIT + self.tree_conf.key_size + VALUE_LENGTH_LIMIT + self.tree_conf.value_size + 2 * SERIALIZER_TYPE_LENGTH_LIMIT)
+    key_ser = serializer.serializer_switcher(type(key))
+    data = key_ser.serialize(key)
+    if len(data) > tree_conf.key_size:
+        raise ValueError('key is larger than the key size: {length}'.format(length=len(data)))
+    return key_ser.SERIALIZER_TYPE, data
+
+
+def serialize_value(tree_conf: TreeConf, value) -> tuple:
+    '''
+    :return: serializer type and serialized value, type 0 for None
+    '''
+    if value is None:
+        return EMPTY_VALUE_DATA
+    val_ser = serializer.serializer_switcher(type(value))
+    data = val_ser.serialize(value)
+    if len(data) > tree_conf.value_size:
+        raise ValueError('value is larger than the value size: {length}'.format(length=len(data)))
+    return val_ser.SERIALIZER_TYPE, data
+
+
+def encode_value(tree: BTree, tree_conf: TreeConf, value) -> tuple:
+    '''
+    serialize a value of a leaf, compressed as configured for the tree, and moved to a chain of
+    overflow pages when it is still larger than inline_value_limit
+    :return: serializer type byte and its flags, serialized value or the overflow reference
+    '''
+    if value is None:
+        return EMPTY_VALUE_DATA
+    val_ser = serializer.serializer_switcher(type(value))
+    val_type, data = val_ser.SERIALIZER_TYPE, val_ser.serialize(value)
+    if len(data) >= COMPRESSION_MIN_LENGTH:
+        code, data = serializer.compress(tree.compression, data)
+        val_type |= code << COMPRESSION_SHIFT
+    if len(data) > inline_value_limit(tree_conf):
+        data = _OVERFLOW_REFERENCE.pack(tree.handler.write_overflow(data), len(data))
+        val_type |= OVERFLOW_FLAG
+    return val_type, data
+
+
+def resident_value(value, value_data: tuple):
+    '''
+    the value kept in memory by a node for its encoded form, large values are only kept encoded
+    '''
+    return PACKED_VALUE if value_data[0] > SERIALIZER_TYPE_MASK else value
+
+
+def overflow_page(value_data: tuple) -> int:
+    '''
+    :return: first overflow page of an encoded value, 0 when it is stored in its node
+    '''
+    if value_data[0] & OVERFLOW_FLAG:
+        return _OVERFLOW_REFERENCE.unpack(value_data[1])[0]
+    return 0
+
+
+def deserialize(data: tuple):
+    serializer_type, raw = data
+    return serializer.serializer_loader(serializer_type).deserialize(raw) if serializer_type else None
+
+
+def shared_prefix(low_key: tuple, key_data: tuple) -> int:
+    '''
+    length of the prefix a serialized key shares with the serialized low key of its page
+    '''
+    if low_key is None or low_key[0] != key_data[0]:
+        return 0
+    low, data = low_key[1], key_data[1]
+    length = min(len(low), len(data))
+    prefix = 0
+    while prefix < length and low[prefix] == data[prefix]:
+        prefix += 1
+    return prefix
+
+
+@functools.lru_cache(maxsize=None)
+def address_struct(count: int) -> struct.Struct:
+    '''
+    precompiled struct packing count page addresses in one call
+    '''
+    return struct.Struct('>{count}{code}'.format(count=count, code=_INTEGER_CODES[constants.PAGE_ADDRESS_LIMIT]))
+
+
+@functools.lru_cache(maxsize=None)
+def page_capacity(tree_conf: TreeConf) -> int:
+    '''
+    bytes of a page available to its node, the page checksum takes the last ones
+    '''
+    return tree_conf.page_size - constants.CHECKSUM_LENGTH
+
+
+@functools.lru_cache(maxsize=None)
+def inline_value_limit(tree_conf: TreeConf) -> int:
+    '''
+    largest value stored in its leaf: the value size, as long as a quarter of a page holds the entry
+    with the largest key. Whatever the value size, a leaf splits into parts fitting their pages
+    '''
+    entry_length = (page_capacity(tree_conf) - BNode.HEADER_LENGTH) // 4
+    return min(tree_conf.value_size, entry_length - BNode.entry_length((0, bytes(tree_conf.key_size))))
+
 
-        if self._key is not None and self._val is not None:
-            self.key_ser = 1
+def check_tree_conf(tree_conf: TreeConf):
+    '''
+    :raise ValueError: the largest key leaves no room in the page for the value of its entry,
+                       not even for a reference to overflow pages
+    '''
+    if inline_value_limit(tree_conf) < _OVERFLOW_REFERENCE.size:
+        raise ValueError('key size {key_size} is too large for the page size {page_size}'.format(
+            key_size=tree_conf.key_size, page_size=tree_conf.page_size))
 
 
 class BaseBNode(metaclass=ABCMeta):
     PAGE_TYPE = None
+    __slots__ = ()
 
     @abstractmethod
     def load(self, data: bytes):
@@ -36,27 +162,589 @@ class BaseBNode(metaclass=ABCMeta):
         construct node from the raw data, corresponding to the its node type
         '''
         node_type = int.from_bytes(data[0:constants.NODE_TYPE_LENGTH_LIMIT], constants.ENDIAN)
-        if node_type == 0:
+        if node_type == BNode.PAGE_TYPE:
             return BNode(tree, tree_conf, page, data)
         elif node_type == 1:
-            return OverflowNode(tree, tree_conf, page, data)
+            raise TypeError('overflow pages can only be read through the value referring to them')
         elif node_type == 2:
             raise TypeError('deprecated data can only be used in page GC')
+        elif node_type == 3:
+            raise TypeError('freelist trunk can only be used in page GC')
         else:
             raise TypeError('unknown node type: {type}'.format(type=node_type))
 
 
 class BNode(BaseBNode):
-    def __init__(self, tree: BTree, tree_conf: TreeConf, page: int, data: bytes):
+    '''
+    node of the B+ tree. Entries are kept in parallel arrays sorted by key: the keys, their values
+    and both serialized. Leaves hold key-value pairs, internal nodes hold the separator keys with
+    None values and the page of each child in `children`, key i being the smallest key of children[i+1].
+    Leaves are doubly linked in key order through prev_page / next_page, 0 meaning none.
+
+    slotted layout: node type | contents count | children count | prev page | next page |
+                    children pages | slots | free space | entries | checksum
+    a slot is the offset of its entry in the page, entries are packed before the checksum:
+    key serializer type | shared prefix length | key suffix length | key suffix |
+    value serializer type | value length | value
+    a key only stores what follows the prefix it shares with the low key, the first key of the page.
+    A value larger than inline_value_limit, once compressed, is stored in a chain of overflow pages and
+    replaced by a reference to it, the flags of its serializer type byte tell both apart.
+
+    A loaded node keeps its raw page and decodes entries on demand: lookups binary-search the
+    keys in place through bisect_left / bisect_right / key_at / value_at, the arrays are only
+    materialized when the node is about to be modified.
+    '''
+    PAGE_TYPE = 4
+    HEADER_LENGTH = constants.NODE_TYPE_LENGTH_LIMIT + 2 * constants.PAGE_LENGTH_LIMIT + 2 * constants.PAGE_ADDRESS_LIMIT
+    SLOT_LENGTH = constants.PAGE_LENGTH_LIMIT
+    ENTRY_HEADER_LENGTH = 2 * SERIALIZER_TYPE_LENGTH_LIMIT + 2 * KEY_LENGTH_LIMIT + VALUE_LENGTH_LIMIT
+    VALUE_HEADER_LENGTH = SERIALIZER_TYPE_LENGTH_LIMIT + VALUE_LENGTH_LIMIT
+    __slots__ = ('tree', 'tree_conf', 'page', 'children', 'prev_page', 'next_page',
+                 '_keys', '_values', '_key_data', '_val_data', '_entries', '_data_length', '_prefix_length',
+                 '_view', '_count', '_slots_start', '_low_key')
+
+    def __init__(self, tree: BTree, tree_conf: TreeConf, page: int = None, data: bytes = None, keys: list = None, values: list = None,
+                 children: list = None, prev_page: int = 0, next_page: int = 0, key_data: list = None, value_data: list = None):
+        '''
+        :param keys: sorted keys of the entries
+        :param values: their values, None for internal nodes
+        :param key_data: the keys already serialized, if known
+        :param value_data: the values already serialized, if known
+        '''
         self.tree = tree
         self.tree_conf = tree_conf
-        self.page = self.tree.next_available_page
-        self.contents = []
+        self.page = page if page is not None else self.tree.next_available_page
+        self.children = children or []
+        self.prev_page = prev_page
+        self.next_page = next_page
+        # raw page while the arrays are not materialized
+        self._view = None
+        self._count = 0
+        self._slots_start = 0
+        self._low_key = None
+
+        if data:
+            self.load(data)
+        else:
+            keys = keys or []
+            self._set_entries(keys, values if values is not None else [None] * len(keys), key_data, value_data)
+
+    def _set_entries(self, keys: list, values: list, key_data: list = None, value_data: list = None, entries: list = None):
+        self._keys = keys
+        self._values = values
+        self._key_data = key_data if key_data is not None else [serialize_key(self.tree_conf, key) for key in keys]
+        self._val_data = value_data if value_data is not None else [serialize_value(self.tree_conf, value) for value in values]
+        # encoded entries of the slotted layout, None until encoded again after a change
+        self._entries = entries if entries is not None else [None] * len(keys)
+        self._data_length = sum(len(data) for _, data in self._key_data) + sum(len(data) for _, data in self._val_data)
+        self._refresh_prefix_length()
+        self._view = None
+
+    def _refresh_prefix_length(self):
+        # bytes saved by the prefix compression, the low key is stored in full
+        low_key = self._key_data[0] if self._key_data else None
+        self._prefix_length = sum(shared_prefix(low_key, key_data) for key_data in self._key_data[1:])
+
+    def _materialize(self):
+        view, low_key = self._view, self._low_key
+        keys, values, key_data, value_data, entries = [], [], [], [], []
+        for index in range(self._count):
+            start = self._slot(index)
+            entry_key, offset = self._read_key(view, start, low_key)
+            entry_value = self._read_value(view, offset)
+            key_data.append(entry_key)
+            value_data.append(entry_value)
+            keys.append(deserialize(entry_key))
+            values.append(PACKED_VALUE if entry_value[0] > SERIALIZER_TYPE_MASK else deserialize(entry_value))
+            entries.append(bytes(view[start:offset+self.VALUE_HEADER_LENGTH+len(entry_value[1])]))
+        self._set_entries(keys, values, key_data, value_data, entries)
+
+    @property
+    def keys(self) -> list:
+        '''
+        the sorted keys, materialized from the raw page on the first access
+        '''
+        if self._view is not None:
+            self._materialize()
+        return self._keys
+
+    @property
+    def values(self) -> list:
+        if self._view is not None:
+            self._materialize()
+        return self._values
+
+    @property
+    def count(self) -> int:
+        return self._count if self._view is not None else len(self._keys)
+
+    def _slot(self, index: int) -> int:
+        start = self._slots_start + index * self.SLOT_LENGTH
+        return int.from_bytes(self._view[start:start+self.SLOT_LENGTH], constants.ENDIAN)
+
+    def _load_value(self, value_data: tuple):
+        '''
+        deserialize an encoded value, reading its overflow pages and decompressing it if needed
+        '''
+        val_type, data = value_data
+        if val_type <= SERIALIZER_TYPE_MASK:
+            return deserialize(value_data)
+        if val_type & OVERFLOW_FLAG:
+            data = self.tree.handler.read_overflow(*_OVERFLOW_REFERENCE.unpack(data))
+        if val_type & COMPRESSION_MASK:
+            data = serializer.decompress((val_type & COMPRESSION_MASK) >> COMPRESSION_SHIFT, data)
+        return deserialize((val_type & SERIALIZER_TYPE_MASK, data))
+
+    def key_at(self, index: int):
+        view = self._view
+        if view is None:
+            return self._keys[index]
+        return deserialize(self._read_key(view, self._slot(index), self._low_key)[0])
+
+    def value_at(self, index: int):
+        view = self._view
+        if view is None:
+            value = self._values[index]
+            return self._load_value(self._val_data[index]) if value is PACKED_VALUE else value
+        return self._load_value(self._read_value(view, self._read_key(view, self._slot(index), self._low_key)[1]))
+
+    def item_at(self, index: int) -> tuple:
+        view = self._view
+        if view is None:
+            return self._keys[index], self.value_at(index)
+        entry_key, offset = self._read_key(view, self._slot(index), self._low_key)
+        return deserialize(entry_key), self._load_value(self._read_value(view, offset))
+
+    def bisect_left(self, key) -> int:
+        '''
+        index of the first key not less than key, only the probed keys are decoded,
+        keys of an order-preserving type are compared as bytes
+        '''
+        if self._view is None:
+            return bisect.bisect_left(self._keys, key)
+        view, low_key, search = self._view, self._low_key, serializer.ordered_key(key)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key = self._read_key(view, self._slot(middle), low_key)[0]
+            if search is not None and entry_key[0] == search[0]:
+                less = entry_key[1] < search[1]
+            else:
+                less = deserialize(entry_key) < key
+            if less:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def bisect_right(self, key) -> int:
+        '''
+        index of the first key greater than key, only the probed keys are decoded,
+        keys of an order-preserving type are compared as bytes
+        '''
+        if self._view is None:
+            return bisect.bisect_right(self._keys, key)
+        view, low_key, search = self._view, self._low_key, serializer.ordered_key(key)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key = self._read_key(view, self._slot(middle), low_key)[0]
+            if search is not None and entry_key[0] == search[0]:
+                greater = search[1] < entry_key[1]
+            else:
+                greater = key < deserialize(entry_key)
+            if greater:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def insert(self, index: int, key, value=None):
+        '''
+        insert an entry at index, keys must stay sorted
+        '''
+        entry_key = serialize_key(self.tree_conf, key)
+        entry_value = encode_value(self.tree, self.tree_conf, value)
+        keys = self.keys
+        keys.insert(index, key)
+        self._values.insert(index, resident_value(value, entry_value))
+        self._key_data.insert(index, entry_key)
+        self._val_data.insert(index, entry_value)
+        self._entries.insert(index, None)
+        self._data_length += len(entry_key[1]) + len(entry_value[1])
+        if index:
+            self._prefix_length += shared_prefix(self._key_data[0], entry_key)
+        else:
+            # a new low key, every entry is encoded against it
+            self._refresh_prefix_length()
+            self._entries = [None] * len(keys)
+
+    def set_value(self, index: int, value):
+        '''
+        replace the value at index, the overflow pages of the former value are freed
+        '''
+        entry_value = encode_value(self.tree, self.tree_conf, value)
+        values = self.values
+        self._free_overflow(self._val_data[index])
+        self._data_length += len(entry_value[1]) - len(self._val_data[index][1])
+        values[index] = resident_value(value, entry_value)
+        self._val_data[index] = entry_value
+        self._entries[index] = None
+
+    def remove(self, index: int):
+        '''
+        remove the entry at index, the overflow pages of its value are freed
+        '''
+        keys = self.keys
+        entry_key = self._key_data[index]
+        self._free_overflow(self._val_data[index])
+        self._data_length -= len(entry_key[1]) + len(self._val_data[index][1])
+        if index:
+            self._prefix_length -= shared_prefix(self._key_data[0], entry_key)
+        del keys[index], self._values[index], self._key_data[index], self._val_data[index], self._entries[index]
+        if not index:
+            self._refresh_prefix_length()
+            self._entries = [None] * len(keys)
+
+    def _value_data_at(self, index: int) -> tuple:
+        view = self._view
+        if view is None:
+            return self._val_data[index]
+        return self._read_value(view, self._read_key(view, self._slot(index), self._low_key)[1])
+
+    def overflow_pages(self) -> list:
+        '''
+        :return: the first page of every overflow chain referred to by the values
+        '''
+        pages = (overflow_page(self._value_data_at(index)) for index in range(self.count))
+        return [page for page in pages if page]
+
+    def relocate(self, moves: dict) -> bool:
+        '''
+        follow the pages moved by a vacuum: the page of the node, its children, its sibling links
+        and the overflow chains of its values
+        :param moves: former page -> new page
+        :return: whether the node has to be written again
+        '''
+        changed = False
+        for index in range(self.count):
+            page = overflow_page(self._value_data_at(index))
+            if page in moves:
+                if self._view is not None:
+                    self._materialize()
+                val_type, data = self._val_data[index]
+                self._val_data[index] = val_type, _OVERFLOW_REFERENCE.pack(moves[page], _OVERFLOW_REFERENCE.unpack(data)[1])
+                self._entries[index] = None
+                changed = True
+        pages = [self.page, self.prev_page, self.next_page, *self.children]
+        if any(page in moves for page in pages):
+            self.page, self.prev_page, self.next_page = (moves.get(page, page) for page in pages[:3])
+            self.children = [moves.get(page, page) for page in self.children]
+            changed = True
+        return changed
+
+    def _free_overflow(self, value_data: tuple):
+        page = overflow_page(value_data)
+        if page:
+            self.tree.handler.free_overflow(page)
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self.children
+
+    @property
+    def max_contents(self) -> int:
+        '''
+        how many entries the node can hold, the page size bounds it in bytes as well
+        '''
+        return self.tree_conf.order
+
+    @classmethod
+    def entry_length(cls, key_data: tuple, value_data: tuple = EMPTY_VALUE_DATA, low_key: tuple = None) -> int:
+        '''
+        bytes taken by a serialized entry in the slotted layout, its slot included
+        :param low_key: serialized low key of the page, None to measure the key in full
+        '''
+        return cls.SLOT_LENGTH + cls.ENTRY_HEADER_LENGTH + len(key_data[1]) + len(value_data[1]) - shared_prefix(low_key, key_data)
+
+    def memory_size(self) -> int:
+        '''
+        approximate bytes held in memory: the raw page while lazily decoded, else the entries,
+        whose data is kept both decoded and serialized
+        '''
+        if self._view is not None:
+            return len(self._view)
+        return 2 * self._data_length + len(self._keys) * _ENTRY_OVERHEAD
+
+    def size(self) -> int:
+        '''
+        bytes used in the page
+        '''
+        if self._view is not None:
+            self._materialize()
+        return (self.HEADER_LENGTH + len(self.children) * constants.PAGE_ADDRESS_LIMIT +
+                len(self._keys) * (self.SLOT_LENGTH + self.ENTRY_HEADER_LENGTH) + self._data_length - self._prefix_length)
+
+    def needs_split(self) -> bool:
+        return self.count > self.max_contents or self.size() > page_capacity(self.tree_conf)
+
+    def is_underfull(self) -> bool:
+        '''
+        less than half full both in entries and in bytes
+        '''
+        return self.count < self.max_contents // 2 and self.size() < page_capacity(self.tree_conf) // 2
+
+    def load(self, data: bytes):
+        end = constants.NODE_TYPE_LENGTH_LIMIT
+        node_type = int.from_bytes(data[0:end], constants.ENDIAN)
+        assert node_type == self.PAGE_TYPE
+        start, end = end, end + constants.PAGE_LENGTH_LIMIT
+        contents_count = int.from_bytes(data[start:end], constants.ENDIAN)
+        start, end = end, end + constants.PAGE_LENGTH_LIMIT
+        children_count = int.from_bytes(data[start:end], constants.ENDIAN)
+        start, end = end, end + constants.PAGE_ADDRESS_LIMIT
+        self.prev_page = int.from_bytes(data[start:end], constants.ENDIAN)
+        start, end = end, end + constants.PAGE_ADDRESS_LIMIT
+        self.next_page = int.from_bytes(data[start:end], constants.ENDIAN)
+
+        self.children = list(address_struct(children_count).unpack_from(data, end))
+        end += children_count * constants.PAGE_ADDRESS_LIMIT
+
+        # owned by the node, a memoryview of the mapping is released once the page is parsed
+        self._view = memoryview(bytes(data))
+        self._slots_start = end
+        self._count = contents_count
+        if contents_count:
+            self._low_key = self._read_key(self._view, self._slot(0), None)[0]
+
+    @staticmethod
+    def _read_key(data: bytes, offset: int, low_key: tuple) -> tuple:
+        '''
+        :return: serializer type and serialized key of the entry at offset, and the offset of its value
+        '''
+        key_type, prefix, suffix_length = _KEY_HEADER.unpack_from(data, offset)
+        start = offset + _KEY_HEADER.size
+        end = start + suffix_length
+        key_data = bytes(data[start:end])
+        if prefix:
+            key_data = low_key[1][:prefix] + key_data
+        return (key_type, key_data), end
+
+    @staticmethod
+    def _read_value(data: bytes, offset: int) -> tuple:
+        '''
+        :return: serializer type and serialized value of the entry whose value starts at offset
+        '''
+        val_type, val_length = _VALUE_HEADER.unpack_from(data, offset)
+        start = offset + _VALUE_HEADER.size
+        return val_type, bytes(data[start:start+val_length])
+
+    @staticmethod
+    def _dump_entry(key_data: tuple, value_data: tuple, low_key: tuple) -> bytes:
+        key_type, key_raw = key_data
+        val_type, val_raw = value_data
+        prefix = shared_prefix(low_key, key_data)
+        return b''.join((
+            _KEY_HEADER.pack(key_type, prefix, len(key_raw) - prefix),
+            key_raw[prefix:],
+            _VALUE_HEADER.pack(val_type, len(val_raw)),
+            val_raw,
+        ))
 
     def dump(self) -> bytes:
-        pass
+        # the page buffer is filled in place: header, children in one pack_into, slots, entries
+        data = bytearray(self.tree_conf.page_size)
+        data[0:self.HEADER_LENGTH] = b''.join((
+            self.PAGE_TYPE.to_bytes(constants.NODE_TYPE_LENGTH_LIMIT, constants.ENDIAN),
+            self.count.to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN),
+            len(self.children).to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN),
+            self.prev_page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN),
+            self.next_page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN),
+        ))
+        address_struct(len(self.children)).pack_into(data, self.HEADER_LENGTH, *self.children)
+        slots_start = self.HEADER_LENGTH + len(self.children) * constants.PAGE_ADDRESS_LIMIT
+        if self._view is not None and slots_start == self._slots_start:
+            # untouched entries, only the header was changed, like the sibling links
+            data[slots_start:] = self._view[slots_start:]
+            return util.seal_page(data)
+        if self._view is not None:
+            self._materialize()
+
+        entries = self._entries
+        low_key = None
+        for index, entry in enumerate(entries):
+            if entry is None:
+                entries[index] = self._dump_entry(self._key_data[index], self._val_data[index], low_key)
+            low_key = self._key_data[0]
+        entries_length = sum(len(entry) for entry in entries)
+
+        capacity = page_capacity(self.tree_conf)
+        length = slots_start + self.SLOT_LENGTH * len(entries) + entries_length
+        if length > capacity:
+            raise ValueError('node is larger than the page size: {length}'.format(length=length))
+        offset = capacity - entries_length
+        data[offset:capacity] = b''.join(entries)
+        slots = []
+        for entry in entries:
+            slots.append(offset.to_bytes(self.SLOT_LENGTH, constants.ENDIAN))
+            offset += len(entry)
+        slots = b''.join(slots)
+        data[slots_start:slots_start+len(slots)] = slots
+        return util.seal_page(data)
+
+    def _slice(self, start: int, end: int = None) -> dict:
+        if self._view is not None:
+            self._materialize()
+        return dict(keys=self._keys[start:end], values=self._values[start:end],
+                    key_data=self._key_data[start:end], value_data=self._val_data[start:end])
+
+    def split(self) -> tuple:
+        '''
+        move the upper half in bytes into a new sibling node, a new leaf is linked right after this one.
+        The caller relinks the prev_page of the leaf following the sibling.
+        :return: the sibling and the key to be pushed into the parent
+        '''
+        count = len(self.keys)
+        lengths = [self.entry_length(key_data, value_data) for key_data, value_data in zip(self._key_data, self._val_data)]
+        half = sum(lengths) // 2
+        center, used = 0, 0
+        while used + lengths[center] <= half:
+            used += lengths[center]
+            center += 1
+        # both halves keep an entry, and internal nodes a separator on each side of the median
+        center = min(max(center, 1), count - (1 if self.is_leaf else 2))
+
+        # the sibling is scanned right after this node, keep it close in the db file
+        page = self.tree.next_page_near(self.page + 1)
+        # the low key of this node stays, so do its encoded entries
+        if self.is_leaf:
+            sibling = type(self)(self.tree, self.tree_conf, page=page, prev_page=self.page, next_page=self.next_page, **self._slice(center))
+            self._set_entries(entries=self._entries[:center], **self._slice(0, center))
+            self.next_page = sibling.page
+            return sibling, sibling.key_at(0)
+
+        median = self._keys[center]
+        sibling = type(self)(self.tree, self.tree_conf, page=page, children=self.children[center+1:], **self._slice(center + 1))
+        self._set_entries(entries=self._entries[:center], **self._slice(0, center))
+        self.children = self.children[:center+1]
+        return sibling, median
+
+    def _merged(self, sibling: BNode, separator_key) -> dict:
+        entries = self._slice(0)
+        if not self.is_leaf:
+            entries['keys'].append(separator_key)
+            entries['values'].append(None)
+            entries['key_data'].append(serialize_key(self.tree_conf, separator_key))
+            entries['value_data'].append(EMPTY_VALUE_DATA)
+        for name, array in sibling._slice(0).items():
+            entries[name].extend(array)
+        return entries
+
+    def can_merge(self, sibling: BNode, separator_key) -> bool:
+        merged = type(self)(self.tree, self.tree_conf, page=self.page, children=self.children + sibling.children, **self._merged(sibling, separator_key))
+        return merged.count <= self.max_contents and merged.size() <= page_capacity(self.tree_conf)
+
+    def merge(self, sibling: BNode, separator_key):
+        '''
+        absorb the right sibling, the separator key is pulled down from the parent for internal nodes.
+        The caller relinks the prev_page of the leaf following the sibling.
+        '''
+        merged = self._merged(sibling, separator_key)
+        # the entries of the sibling were encoded against its own low key
+        self._set_entries(entries=self._entries + [None] * (len(merged['keys']) - len(self._entries)), **merged)
+        if not self.is_leaf:
+            self.children.extend(sibling.children)
+        else:
+            self.next_page = sibling.next_page
+
+    def __repr__(self) -> str:
+        return '<{}: page={} leaf={} contents={}>'.format(self.__class__.__name__, self.page, self.is_leaf, self.count)
 
 
 class OverflowNode(BaseBNode):
-    def __init__(self, tree: BTree, tree_conf: TreeConf, page: int, data: bytes):
-        pass
\ No newline at end of file
+    '''
+    one page of the chain holding a value too large for its leaf, possibly compressed
+
+    layout: node type | next overflow page | payload length | payload | padding | checksum
+    '''
+    PAGE_TYPE = 1
+    HEADER_LENGTH = constants.NODE_TYPE_LENGTH_LIMIT + constants.PAGE_ADDRESS_LIMIT + constants.PAGE_LENGTH_LIMIT
+    __slots__ = ('tree_conf', 'page', 'next_page', 'payload')
+
+    def __init__(self, tree_conf: TreeConf, page: int, data: bytes = None, next_page: int = 0, payload: bytes = b''):
+        self.tree_conf = tree_conf
+        self.page = page
+        self.next_page = next_page
+        self.payload = payload
+
+        if data:
+            self.load(data)
+
+    @classmethod
+    def capacity(cls, tree_conf: TreeConf) -> int:
+        return page_capacity(tree_conf) - cls.HEADER_LENGTH
+
+    def load(self, data: bytes):
+        end = constants.NODE_TYPE_LENGTH_LIMIT
+        assert int.from_bytes(data[0:end], constants.ENDIAN) == self.PAGE_TYPE
+        start, end = end, end + constants.PAGE_ADDRESS_LIMIT
+        self.next_page = int.from_bytes(data[start:end], constants.ENDIAN)
+        start, end = end, end + constants.PAGE_LENGTH_LIMIT
+        length = int.from_bytes(data[start:end], constants.ENDIAN)
+        self.payload = bytes(data[end:end+length])
+
+    def dump(self) -> bytes:
+        assert len(self.payload) <= self.capacity(self.tree_conf)
+        data = bytearray(self.tree_conf.page_size)
+        data[0:self.HEADER_LENGTH] = b''.join((
+            self.PAGE_TYPE.to_bytes(constants.NODE_TYPE_LENGTH_LIMIT, constants.ENDIAN),
+            self.next_page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN),
+            len(self.payload).to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN),
+        ))
+        data[self.HEADER_LENGTH:self.HEADER_LENGTH+len(self.payload)] = self.payload
+        return util.seal_page(data)
+
+
+class FreelistNode(BaseBNode):
+    '''
+    trunk of the persisted free-page list, a chain of these pages is referenced from the meta page
+
+    layout: node type | next trunk page | pages count | free pages | padding | checksum
+    '''
+    PAGE_TYPE = 3
+    HEADER_LENGTH = constants.NODE_TYPE_LENGTH_LIMIT + constants.PAGE_ADDRESS_LIMIT + constants.PAGE_LENGTH_LIMIT
+    __slots__ = ('tree_conf', 'page', 'next_page', 'pages')
+
+    def __init__(self, tree_conf: TreeConf, page: int, data: bytes = None, next_page: int = 0, pages: list = None):
+        self.tree_conf = tree_conf
+        self.page = page
+        self.next_page = next_page
+        self.pages = pages or []
+
+        if data:
+            self.load(data)
+
+    @classmethod
+    def capacity(cls, tree_conf: TreeConf) -> int:
+        return (page_capacity(tree_conf) - cls.HEADER_LENGTH) // constants.PAGE_ADDRESS_LIMIT
+
+    def load(self, data: bytes):
+        end = constants.NODE_TYPE_LENGTH_LIMIT
+        assert int.from_bytes(data[0:end], constants.ENDIAN) == self.PAGE_TYPE
+        start, end = end, end + constants.PAGE_ADDRESS_LIMIT
+        self.next_page = int.from_bytes(data[start:end], constants.ENDIAN)
+        start, end = end, end + constants.PAGE_LENGTH_LIMIT
+        count = int.from_bytes(data[start:end], constants.ENDIAN)
+
+        self.pages = list(address_struct(count).unpack_from(data, end))
+
+    def dump(self) -> bytes:
+        assert len(self.pages) <= self.capacity(self.tree_conf)
+        data = bytearray(self.tree_conf.page_size)
+        data[0:self.HEADER_LENGTH] = b''.join((
+            self.PAGE_TYPE.to_bytes(constants.NODE_TYPE_LENGTH_LIMIT, constants.ENDIAN),
+            self.next_page.to_bytes(constants.PAGE_ADDRESS_LIMIT, constants.ENDIAN),
+            len(self.pages).to_bytes(constants.PAGE_LENGTH_LIMIT, constants.ENDIAN),
+        ))
+        address_struct(len(self.pages)).pack_into(data, self.HEADER_LENGTH, *self.pages)
+        return util.seal_page(data)
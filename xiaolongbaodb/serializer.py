@@ -1,8 +1,22 @@
+import enum
 import json
+import lzma
 import struct
+import zlib
 from abc import ABCMeta, abstractstaticmethod
 from typing import Union
-from xiaolongbaodb.constants import INT_FORMAT
+from xiaolongbaodb.constants import DOUBLE_FORMAT, ENDIAN, ORDERED_INT_FORMAT, SERIALIZER_TYPE_LENGTH_LIMIT
+
+_ORDERED_INT = struct.Struct(ORDERED_INT_FORMAT)
+_DOUBLE = struct.Struct(DOUBLE_FORMAT)
+
+# the sign bit of the ordered encodings
+_SIGN = 1 << 63
+_MASK = (1 << 64) - 1
+
+# a variable-length element of a tuple ends with the terminator, its own zero bytes are escaped
+_TERMINATOR = b'\x00'
+_ESCAPE = b'\x00\xff'
 
 
 class NoSerializerError(Exception):
@@ -10,6 +24,14 @@ class NoSerializerError(Exception):
 
 
 class Serializer(metaclass=ABCMeta):
+    # recorded in the serializer type byte of each key/value, 0 means empty
+    SERIALIZER_TYPE = None
+    # length of every serialized object, None when variable
+    FIXED_LENGTH = None
+    # serialized objects of this type compare as bytes like the objects do,
+    # so a node binary search can skip deserializing the keys
+    ORDERED = False
+
     @abstractstaticmethod
     def serialize(obj: object) -> bytes:
         '''
@@ -28,46 +50,232 @@ class Serializer(metaclass=ABCMeta):
         return '{}()'.format(self.__class__.__name__)
 
 
-class IntSerializer(Serializer):
+class StrSerializer(Serializer):
+    '''
+    utf-8 bytes sort in code point order, like str
+    '''
+    SERIALIZER_TYPE = 3
+    ORDERED = True
+
+    @staticmethod
+    def serialize(obj: str) -> bytes:
+        return obj.encode('utf-8')
+
+    @staticmethod
+    def deserialize(data: bytes) -> str:
+        return bytes(data).decode('utf-8')
+
+
+class DictSerializer(Serializer):
+    SERIALIZER_TYPE = 4
+
+    @staticmethod
+    def serialize(obj: dict) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def deserialize(data: bytes) -> dict:
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+class ListSerializer(Serializer):
+    SERIALIZER_TYPE = 5
+
+    @staticmethod
+    def serialize(obj: list) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def deserialize(data: bytes) -> list:
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+class Int64Serializer(Serializer):
+    '''
+    64-bit big-endian with the sign bit flipped, negative ints sort before positive ones
+    '''
+    SERIALIZER_TYPE = 6
+    FIXED_LENGTH = _ORDERED_INT.size
+    ORDERED = True
+
     @staticmethod
     def serialize(obj: int) -> bytes:
-        return struct.pack(INT_FORMAT, obj)
+        if not -_SIGN <= obj < _SIGN:
+            raise ValueError('int out of the 64-bit range: {obj}'.format(obj=obj))
+        return _ORDERED_INT.pack(obj + _SIGN)
 
     @staticmethod
     def deserialize(data: bytes) -> int:
-        return struct.unpack(INT_FORMAT, data)[0]
+        return _ORDERED_INT.unpack(data)[0] - _SIGN
 
 
-class FloatSerializer(Serializer):
-    pass
+class DoubleSerializer(Serializer):
+    '''
+    IEEE 754 double, the sign bit is flipped for positive floats and every bit for negative ones
+    '''
+    SERIALIZER_TYPE = 7
+    FIXED_LENGTH = _ORDERED_INT.size
+    ORDERED = True
 
+    @staticmethod
+    def serialize(obj: float) -> bytes:
+        # -0.0 == 0.0, they must share one encoding
+        bits = _ORDERED_INT.unpack(_DOUBLE.pack(obj or 0.0))[0]
+        return _ORDERED_INT.pack(bits ^ _MASK if bits & _SIGN else bits | _SIGN)
 
-class StrSerializer(Serializer):
-    pass
+    @staticmethod
+    def deserialize(data: bytes) -> float:
+        bits = _ORDERED_INT.unpack(data)[0]
+        return _DOUBLE.unpack(_ORDERED_INT.pack(bits ^ _SIGN if bits & _SIGN else bits ^ _MASK))[0]
 
 
-class DictSerializer(Serializer):
-    pass
+class BytesSerializer(Serializer):
+    SERIALIZER_TYPE = 8
+    ORDERED = True
+
+    @staticmethod
+    def serialize(obj: bytes) -> bytes:
+        return obj
 
+    @staticmethod
+    def deserialize(data: bytes) -> bytes:
+        return bytes(data)
 
-class ListSerializer(Serializer):
-    pass
+
+class TupleSerializer(Serializer):
+    '''
+    elements one after another: serializer type | element,
+    variable-length elements are escaped and terminated so a shorter tuple sorts before the tuples it prefixes.
+    Only ordered elements are accepted. The encodings of an int and a float at the same position order them
+    by type, whereas Python compares them by value, see holds_number.
+    '''
+    SERIALIZER_TYPE = 9
+    ORDERED = True
+
+    @staticmethod
+    def serialize(obj: tuple) -> bytes:
+        data = []
+        for element in obj:
+            element_ser = serializer_switcher(type(element))
+            if not element_ser.ORDERED:
+                raise NoSerializerError('tuple element is not orderable: {type}'.format(type=type(element).__name__))
+            data.append(element_ser.SERIALIZER_TYPE.to_bytes(SERIALIZER_TYPE_LENGTH_LIMIT, ENDIAN))
+            element_data = element_ser.serialize(element)
+            if element_ser.FIXED_LENGTH is None:
+                element_data = element_data.replace(_TERMINATOR, _ESCAPE) + _TERMINATOR
+            data.append(element_data)
+        return b''.join(data)
+
+    @staticmethod
+    def holds_number(obj: tuple) -> bool:
+        '''
+        whether an int or a float is an element of the tuple, or of a nested one. Such a tuple
+        is not compared as bytes: a key holding a number at the same position may be of the other type
+        '''
+        return any(type(element) in (int, float) or (type(element) is tuple and TupleSerializer.holds_number(element))
+                   for element in obj)
+
+    @staticmethod
+    def deserialize(data: bytes) -> tuple:
+        data = bytes(data)
+        elements = []
+        start = 0
+        while start < len(data):
+            end = start + SERIALIZER_TYPE_LENGTH_LIMIT
+            element_ser = serializer_loader(int.from_bytes(data[start:end], ENDIAN))
+            start = end
+            if element_ser.FIXED_LENGTH is not None:
+                end = start + element_ser.FIXED_LENGTH
+                elements.append(element_ser.deserialize(data[start:end]))
+                start = end
+                continue
+            parts = []
+            while True:
+                end = data.index(_TERMINATOR, start)
+                if data[end+1:end+2] != b'\xff':
+                    break
+                parts.append(data[start:end+1])
+                start = end + 2
+            parts.append(data[start:end])
+            elements.append(element_ser.deserialize(b''.join(parts)))
+            start = end + 1
+        return tuple(elements)
 
 
 serializer_map = {
-    int: IntSerializer(),
-    float: FloatSerializer,
+    int: Int64Serializer(),
+    float: DoubleSerializer(),
     str: StrSerializer(),
+    bytes: BytesSerializer(),
+    tuple: TupleSerializer(),
     dict: DictSerializer(),
     list: ListSerializer(),
 }
 
+serializer_type_map = {ser.SERIALIZER_TYPE: ser for ser in serializer_map.values()}
 
-def serializer_switcher(t: Union[int, float, str, dict, list]) -> Serializer:
+
+def serializer_switcher(t: Union[int, float, str, bytes, tuple, dict, list]) -> Serializer:
     '''
     return corresponding serializer to arg type
     '''
     try:
         return serializer_map[t]
     except KeyError:
-        raise NoSerializerError('no corresponding serializer')
\ No newline at end of file
+        raise NoSerializerError('no corresponding serializer')
+
+
+def serializer_loader(serializer_type: int) -> Serializer:
+    '''
+    return corresponding serializer to the recorded serializer type byte
+    '''
+    try:
+        return serializer_type_map[serializer_type]
+    except KeyError:
+        raise NoSerializerError('unknown serializer type: {type}'.format(type=serializer_type))
+
+
+class Compression(enum.Enum):
+    NONE = 'none'
+    ZLIB = 'zlib'
+    LZMA = 'lzma'
+
+
+# code recorded in the serializer type byte of a compressed value, 0 means not compressed
+_COMPRESSION_CODES = {Compression.ZLIB: 1, Compression.LZMA: 2}
+_COMPRESSORS = {1: (zlib.compress, zlib.decompress), 2: (lzma.compress, lzma.decompress)}
+
+
+def compress(compression: Compression, data: bytes) -> tuple:
+    '''
+    :return: compression code and the compressed data, code 0 and the data itself
+             when compression does not make it shorter
+    '''
+    if compression is Compression.NONE:
+        return 0, data
+    code = _COMPRESSION_CODES[compression]
+    compressed = _COMPRESSORS[code][0](data)
+    if len(compressed) >= len(data):
+        return 0, data
+    return code, compressed
+
+
+def decompress(code: int, data: bytes) -> bytes:
+    try:
+        return _COMPRESSORS[code][1](data)
+    except KeyError:
+        raise NoSerializerError('unknown compression code: {code}'.format(code=code))
+
+
+def ordered_key(key) -> tuple:
+    '''
+    :return: serializer type and serialized key comparable as bytes with the keys of the same type,
+             None when the key type has no order-preserving encoding, or the key is a tuple holding numbers
+    '''
+    try:
+        key_ser = serializer_switcher(type(key))
+        if key_ser.ORDERED and not (type(key) is tuple and TupleSerializer.holds_number(key)):
+            return key_ser.SERIALIZER_TYPE, key_ser.serialize(key)
+    except (NoSerializerError, ValueError):
+        pass
+    return None
@@ -0,0 +1,294 @@
+import bisect
+import concurrent.futures
+import heapq
+import itertools
+import json
+import operator
+import os
+import zlib
+from xiaolongbaodb import serializer
+from xiaolongbaodb.btree import BTree
+from xiaolongbaodb.constants import SHARDS
+
+_MISSING = object()
+# ints are serialized in 64 bits
+_INT64_LIMIT = 1 << 63
+
+
+def _encode_key(key) -> bytes:
+    '''
+    serializer type byte and serialized key, the same on every platform and in every process
+    '''
+    key_ser = serializer.serializer_switcher(type(key))
+    return bytes((key_ser.SERIALIZER_TYPE,)) + key_ser.serialize(key)
+
+
+def _decode_key(data: bytes):
+    return serializer.serializer_loader(data[0]).deserialize(data[1:])
+
+
+def _canonical_key(key):
+    '''
+    the key hashed by the routing: keys equal in Python, like 1 and 1.0, are one key of a BTree
+    and must be routed alike, so an integral float is hashed as an int, also inside a tuple
+    '''
+    if type(key) is float and key.is_integer() and -_INT64_LIMIT <= key < _INT64_LIMIT:
+        return int(key)
+    if type(key) is tuple:
+        return tuple(_canonical_key(element) for element in key)
+    return key
+
+
+class ShardedBTree():
+    '''
+    keys partitioned across independent trees, the shards, stored in the files file_name.0, file_name.1...
+    Each shard has its own handler, lock, WAL and cache: writes to different shards do not wait for each
+    other, and each checkpoint only copies the WAL of its shard.
+
+    Keys are hash partitioned, or range partitioned by boundary keys. The partitioning is recorded in
+    file_name.shards when the store is created. Point operations are routed to the shard owning the key,
+    batch operations are split by shard and run concurrently, one transaction per shard, so a batch is
+    atomic within each shard only. Range scans merge the shards in key order.
+
+    Shards can be written from separate processes as long as each shard is opened by a single one:
+
+        with ShardedBTree('db', shards=8, open_shards=[0, 1]) as db:
+            db.insert_many(pair for pair in pairs if db.shard_of(pair[0]) in (0, 1))
+    '''
+    __slots__ = ('_file_name', '_count', '_boundaries', '_shards', '_executor', '_closed')
+
+    def __init__(self, file_name: str = 'xiaolongbao.db', shards: int = None, boundaries: list = None, open_shards=None,
+                 workers: int = None, **options):
+        '''
+        :param shards: number of shards of a new hash partitioned store, SHARDS by default
+        :param boundaries: ascending keys range partitioning a new store, shard i holds the keys with
+                           boundaries[i-1] <= key < boundaries[i], so there is one shard more than boundaries
+        :param open_shards: indexes of the shards to open, all by default. The keys of the others are refused
+        :param workers: threads running the operations of several shards, one per open shard by default
+        :param options: passed to the BTree of every shard
+        '''
+        self._file_name = file_name
+        self._count, self._boundaries = self._load_layout(shards, boundaries)
+        indexes = range(self._count) if open_shards is None else sorted(set(open_shards))
+        if any(not 0 <= index < self._count for index in indexes):
+            raise ValueError('the store has {count} shards'.format(count=self._count))
+        self._shards = dict()
+        try:
+            for index in indexes:
+                self._shards[index] = BTree(self.shard_file(index), **options)
+        except BaseException:
+            for tree in self._shards.values():
+                tree.close()
+            raise
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers or len(self._shards) or 1,
+                                                               thread_name_prefix='xiaolongbaodb-shard')
+        self._closed = False
+
+    def _load_layout(self, shards: int, boundaries: list) -> tuple:
+        '''
+        read the partitioning of the store, or record it when the store is new
+        :return: number of shards, boundary keys or None when hash partitioned
+        '''
+        if boundaries is not None:
+            boundaries = list(boundaries)
+            if any(not prev < key for prev, key in zip(boundaries, boundaries[1:])):
+                raise ValueError('boundaries must be strictly ascending')
+            if shards is not None and shards != len(boundaries) + 1:
+                raise ValueError('{count} boundaries make {shards} shards'.format(count=len(boundaries), shards=len(boundaries) + 1))
+        layout_file = self._file_name + '.shards'
+        if os.path.exists(layout_file):
+            with open(layout_file) as f:
+                layout = json.load(f)
+            stored = layout.get('boundaries')
+            if stored is not None:
+                stored = [_decode_key(bytes.fromhex(key)) for key in stored]
+            if (shards is not None and shards != layout['shards']) or (boundaries is not None and boundaries != stored):
+                raise ValueError('the store is partitioned otherwise, see {file}'.format(file=layout_file))
+            return layout['shards'], stored
+
+        count = len(boundaries) + 1 if boundaries is not None else shards or SHARDS
+        if count < 1:
+            raise ValueError('a store needs at least one shard')
+        layout = {'shards': count, 'boundaries': None if boundaries is None else [_encode_key(key).hex() for key in boundaries]}
+        # the layout appears at once, a store is never seen without it
+        with open(layout_file + '.tmp', 'w') as f:
+            json.dump(layout, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(layout_file + '.tmp', layout_file)
+        return count, boundaries
+
+    @property
+    def shard_count(self) -> int:
+        return self._count
+
+    def shard_file(self, index: int) -> str:
+        '''
+        file name of the BTree of a shard
+        '''
+        return '{name}.{index}'.format(name=self._file_name, index=index)
+
+    def shard_of(self, key) -> int:
+        '''
+        index of the shard owning key
+        '''
+        if self._boundaries is not None:
+            return bisect.bisect_right(self._boundaries, key)
+        return zlib.crc32(_encode_key(_canonical_key(key))) % self._count
+
+    def shard(self, index: int) -> BTree:
+        '''
+        the tree of an open shard
+        '''
+        try:
+            return self._shards[index]
+        except KeyError:
+            raise ValueError('shard {index} is not open'.format(index=index)) from None
+
+    def _tree_of(self, key) -> BTree:
+        return self.shard(self.shard_of(key))
+
+    def _group(self, items, key=None) -> dict:
+        '''
+        :return: shard index -> items routed to it, in their order
+        '''
+        groups = dict()
+        for item in items:
+            groups.setdefault(self.shard_of(item if key is None else key(item)), []).append(item)
+        return groups
+
+    def _run(self, func, groups: dict) -> dict:
+        '''
+        call func(tree, items) for each group, concurrently on the executor when there are several
+        :return: shard index -> result
+        '''
+        trees = {index: self.shard(index) for index in groups}
+        if len(groups) == 1:
+            index, items = next(iter(groups.items()))
+            return {index: func(trees[index], items)}
+        futures = {index: self._executor.submit(func, trees[index], items) for index, items in groups.items()}
+        return {index: future.result() for index, future in futures.items()}
+
+    def _all(self, func) -> dict:
+        return self._run(lambda tree, _: func(tree), dict.fromkeys(self._shards))
+
+    def get(self, key, default=None):
+        return self._tree_of(key).get(key, default)
+
+    def __getitem__(self, key):
+        return self._tree_of(key)[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._tree_of(key)
+
+    def __setitem__(self, key, value):
+        self._tree_of(key)[key] = value
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def insert(self, key, value, replace: bool = False):
+        self._tree_of(key).insert(key, value, replace)
+
+    def delete(self, key):
+        self._tree_of(key).delete(key)
+
+    def get_many(self, keys, default=None) -> list:
+        '''
+        :return: values in the order of the keys, default for missing keys
+        '''
+        keys = list(keys)
+        groups = self._group(set(keys))
+        found = dict()
+        for index, values in self._run(lambda tree, shard_keys: tree.get_many(shard_keys, _MISSING), groups).items():
+            found.update((key, value) for key, value in zip(groups[index], values) if value is not _MISSING)
+        return [found.get(key, default) for key in keys]
+
+    def insert_many(self, pairs, replace: bool = False) -> int:
+        '''
+        insert (key, value) pairs, in one write transaction per shard, see BTree.insert_many.
+        Without replace, every shard checks its keys before writing, a duplicated key fails its shard only.
+        :return: number of pairs inserted or replaced
+        '''
+        groups = self._group(pairs, key=operator.itemgetter(0))
+        return sum(self._run(lambda tree, shard_pairs: tree.insert_many(shard_pairs, replace), groups).values())
+
+    def delete_many(self, keys) -> int:
+        '''
+        remove several keys, in one write transaction per shard, missing keys are ignored
+        :return: number of keys removed
+        '''
+        return sum(self._run(lambda tree, shard_keys: tree.delete_many(shard_keys), self._group(set(keys))).values())
+
+    def _scanned_shards(self, start, end) -> range:
+        '''
+        shards which may hold keys with start <= key < end
+        '''
+        if self._boundaries is None:
+            return range(self._count)
+        first = 0 if start is None else bisect.bisect_right(self._boundaries, start)
+        last = self._count - 1 if end is None else bisect.bisect_left(self._boundaries, end)
+        return range(first, last + 1)
+
+    def items(self, start=None, end=None, reverse: bool = False):
+        '''
+        stream the (key, value) pairs with start <= key < end in key order, see BTree.items.
+        Range partitioned shards are scanned one after another, hash partitioned ones are merged with a heap.
+        Every shard of the range must be open.
+        '''
+        indexes = self._scanned_shards(start, end)
+        scans = [self.shard(index).items(start, end, reverse) for index in (reversed(indexes) if reverse else indexes)]
+        if self._boundaries is not None:
+            return itertools.chain.from_iterable(scans)
+        return heapq.merge(*scans, key=operator.itemgetter(0), reverse=reverse)
+
+    def keys(self, start=None, end=None, reverse: bool = False):
+        for key, _ in self.items(start, end, reverse):
+            yield key
+
+    def values(self, start=None, end=None, reverse: bool = False):
+        for _, value in self.items(start, end, reverse):
+            yield value
+
+    def __iter__(self):
+        return self.keys()
+
+    def checkpoint(self, passive: bool = True):
+        '''
+        checkpoint the open shards concurrently
+        '''
+        self._all(lambda tree: tree.checkpoint(passive))
+
+    def vacuum(self) -> int:
+        '''
+        :return: number of pages cut off the files of the open shards
+        '''
+        return sum(self._all(BTree.vacuum).values())
+
+    def verify(self, workers: int = None) -> dict:
+        '''
+        :return: shard index -> its corrupted pages, only for the corrupted shards
+        '''
+        corrupted = {index: self.shard(index).verify(workers) for index in self._shards}
+        return {index: pages for index, pages in corrupted.items() if pages}
+
+    def stats(self) -> dict:
+        '''
+        :return: shard index -> counters of the shard, see BTree.stats
+        '''
+        return {index: tree.stats() for index, tree in self._shards.items()}
+
+    def close(self):
+        if self._closed:
+            return
+        try:
+            self._all(BTree.close)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,60 +1,572 @@
+import heapq
 import io
 import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from xiaolongbaodb import constants
 
-class LRUCache(dict):
-    def __init__(self, *args, **kwargs):
+class CacheStats():
+    '''
+    counters sampled from a page cache, they are never reset by the cache itself
+    '''
+    __slots__ = ('hits', 'misses', 'evictions')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return '{}(hits={}, misses={}, evictions={})'.format(self.__class__.__name__, self.hits, self.misses, self.evictions)
+
+
+class LatencyHistogram():
+    '''
+    latencies in power-of-two buckets of microseconds, recording is O(1) and allocates nothing
+    '''
+    __slots__ = ('count', 'total', 'buckets')
+    BUCKETS = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * self.BUCKETS
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
         '''
-        :param capacity: How many items to store before cleaning up old items
+        :return: upper bound in seconds of the bucket holding the given fraction of the latencies
         '''
-        self.capacity = kwargs.pop('capacity', 1024)
-        self.lru = []
-        super().__init__(*args, **kwargs)
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return (1 << index) / 1e6
+        return 0.0
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'mean_us': self.mean * 1e6,
+                'p50_us': self.percentile(0.5) * 1e6, 'p99_us': self.percentile(0.99) * 1e6}
+
+    def __repr__(self) -> str:
+        return '{}(count={}, mean={:.1f}us)'.format(self.__class__.__name__, self.count, self.mean * 1e6)
+
+
+class IOStats():
+    '''
+    counters of the storage engine, sampled at runtime and never reset by the engine itself.
+    They are updated without locking, a concurrent update may rarely be lost.
+    '''
+    __slots__ = ('wal_reads', 'readahead_hits', 'file_reads', 'read_latency',
+                 'wal_frames', 'wal_bytes', 'append_latency', 'file_writes', 'write_latency', 'fsync_latency',
+                 'commits', 'rollbacks', 'checkpoint_latency', 'splits', 'merges')
+
+    def __init__(self):
+        # pages not found in the page cache, by where they were read
+        self.wal_reads = 0
+        self.readahead_hits = 0
+        self.file_reads = 0
+        self.read_latency = LatencyHistogram()
+        # frames appended to the WAL, pages written into the db file
+        self.wal_frames = 0
+        self.wal_bytes = 0
+        self.append_latency = LatencyHistogram()
+        self.file_writes = 0
+        self.write_latency = LatencyHistogram()
+        self.fsync_latency = LatencyHistogram()
+        self.commits = 0
+        self.rollbacks = 0
+        self.checkpoint_latency = LatencyHistogram()
+        # node splits and merges
+        self.splits = 0
+        self.merges = 0
+
+    @property
+    def fsyncs(self) -> int:
+        return self.fsync_latency.count
+
+    @property
+    def checkpoints(self) -> int:
+        return self.checkpoint_latency.count
+
+    def as_dict(self) -> dict:
+        return {name: value.as_dict() if isinstance(value, LatencyHistogram) else value
+                for name, value in ((name, getattr(self, name)) for name in self.__slots__)}
 
-    def refresh(self, key):
+    def __repr__(self) -> str:
+        return '{}(file_reads={}, wal_frames={}, fsyncs={}, commits={}, splits={}, merges={})'.format(
+            self.__class__.__name__, self.file_reads, self.wal_frames, self.fsyncs, self.commits, self.splits, self.merges)
+
+
+_MISSING = object()
+
+
+def _unit_weight(value) -> int:
+    return 1
+
+
+class PageCache(metaclass=ABCMeta):
+    '''
+    Base of the page caches, every operation is O(1). Subclasses only decide which
+    key is the victim when the cache is over its capacity.
+
+    The capacity is either counted in items (`capacity`), in bytes (`max_bytes`,
+    each value weighted by `weigher`), or both, whichever is reached first. A value is
+    weighed when it is set, it is weighed again only when it is set again.
+    '''
+    def __init__(self, capacity: int = 1024, max_bytes: int = None, weigher=None):
         '''
-        Push a key to the tail fo the LRU cache
+        :param capacity: How many items to store before cleaning up old items, None for no limit
+        :param max_bytes: How many bytes to store before cleaning up old items, None for no limit
+        :param weigher: callable returning the size in bytes of a value
         '''
-        if key in self.lru:
-            self.lru.remove(key)
-        self.lru.append(key)
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.weigher = weigher or _unit_weight
+        self.weight = 0
+        # key -> weight of its value when it was set
+        self._weights = dict()
+        self.stats = CacheStats()
 
-    def get(self, key, default=None):
-        item = super().get(key, default)
-        self.refresh(key)
+    @abstractmethod
+    def _lookup(self, key):
+        '''
+        return the value or _MISSING, and record the access for the policy
+        '''
+        pass
 
+    @abstractmethod
+    def _insert(self, key, value):
+        pass
+
+    @abstractmethod
+    def _remove(self, key):
+        '''
+        remove the key and return its value, raise KeyError if not present
+        '''
+        pass
+
+    @abstractmethod
+    def _victim(self):
+        '''
+        choose and remove an item according to the policy, return (key, value)
+        '''
+        pass
+
+    @abstractmethod
+    def _clear(self):
+        pass
+
+    def _over_capacity(self) -> bool:
+        if self.capacity is not None and len(self) > self.capacity:
+            return True
+        return self.max_bytes is not None and self.weight > self.max_bytes
+
+    def get(self, key, default=None):
+        item = self._lookup(key)
+        if item is _MISSING:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
         return item
 
     def __getitem__(self, key):
-        item = super().__getitem__(key)
-        self.refresh(key)
-
+        item = self.get(key, _MISSING)
+        if item is _MISSING:
+            raise KeyError(key)
         return item
 
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-
-        self.refersh(key)
+        if key in self:
+            self._remove(key)
+            self.weight -= self._weights[key]
+        self._insert(key, value)
+        weight = self._weights[key] = self.weigher(value)
+        self.weight += weight
 
-        if len(self) > self.capacity:
-            # if reach capacity, remove the oldest(first) item
-            self.pop(self.lru.pop(0))
+        while len(self) > 1 and self._over_capacity():
+            evicted, _ = self._victim()
+            self.weight -= self._weights.pop(evicted)
+            self.stats.evictions += 1
 
     def __delitem__(self, key) -> None:
-        super().__delitem__(key)
+        self._remove(key)
+        self.weight -= self._weights.pop(key)
 
-        self.lru.remove(key)
+    def pop(self, key, default=_MISSING):
+        if key not in self:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        value = self._remove(key)
+        self.weight -= self._weights.pop(key)
+        return value
 
     def clear(self):
-        super().clear()
-        
-        del self.lru[:]
+        self._clear()
+        self._weights.clear()
+        self.weight = 0
+
+    def __repr__(self) -> str:
+        return '{}(capacity={}, max_bytes={}, size={})'.format(self.__class__.__name__, self.capacity, self.max_bytes, len(self))
+
+
+class LRUCache(PageCache):
+    '''
+    least recently used, the ordered dict keeps the oldest item at the head
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._data = OrderedDict()
+
+    def _lookup(self, key):
+        item = self._data.get(key, _MISSING)
+        if item is not _MISSING:
+            self._data.move_to_end(key)
+        return item
+
+    def _insert(self, key, value):
+        self._data[key] = value
+
+    def _remove(self, key):
+        return self._data.pop(key)
+
+    def _victim(self):
+        return self._data.popitem(last=False)
+
+    def _clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ClockCache(PageCache):
+    '''
+    CLOCK (second chance), a hit only sets the reference bit so a long scan
+    cannot reorder the hot pages. The ordered dict is the ring, its head is the hand.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._data = OrderedDict()
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        entry[1] = True
+        return entry[0]
+
+    def _insert(self, key, value):
+        self._data[key] = [value, False]
+
+    def _remove(self, key):
+        return self._data.pop(key)[0]
+
+    def _victim(self):
+        while True:
+            key, entry = next(iter(self._data.items()))
+            if not entry[1]:
+                del self._data[key]
+                return key, entry[0]
+            # second chance, move the hand forward
+            entry[1] = False
+            self._data.move_to_end(key)
+
+    def _clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TwoQCache(PageCache):
+    '''
+    simplified 2Q: new pages enter a FIFO (a1in), only pages seen again after leaving
+    it (remembered by key in a1out) are promoted to the LRU main queue (am).
+    Pages touched once by a scan never pollute the main queue.
+    '''
+    def __init__(self, *args, in_ratio: float = 0.25, out_ratio: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._in_ratio = in_ratio
+        self._out_ratio = out_ratio
+        self._a1in = OrderedDict()
+        self._a1out = OrderedDict()
+        self._am = OrderedDict()
+
+    def _limit(self, ratio: float) -> int:
+        return max(1, int((self.capacity or len(self)) * ratio))
+
+    def _lookup(self, key):
+        item = self._am.get(key, _MISSING)
+        if item is not _MISSING:
+            self._am.move_to_end(key)
+            return item
+        return self._a1in.get(key, _MISSING)
+
+    def _insert(self, key, value):
+        if key in self._a1out:
+            del self._a1out[key]
+            self._am[key] = value
+        else:
+            self._a1in[key] = value
+
+    def _remove(self, key):
+        if key in self._am:
+            return self._am.pop(key)
+        return self._a1in.pop(key)
+
+    def _victim(self):
+        if self._a1in and (len(self._a1in) > self._limit(self._in_ratio) or not self._am):
+            key, value = self._a1in.popitem(last=False)
+            self._a1out[key] = None
+            if len(self._a1out) > self._limit(self._out_ratio):
+                self._a1out.popitem(last=False)
+            return key, value
+        return self._am.popitem(last=False)
+
+    def _clear(self):
+        self._a1in.clear()
+        self._a1out.clear()
+        self._am.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._am or key in self._a1in
+
+    def __len__(self) -> int:
+        return len(self._am) + len(self._a1in)
+
+
+cache_policy_map = {
+    'lru': LRUCache,
+    'clock': ClockCache,
+    '2q': TwoQCache,
+}
+
+
+def create_cache(policy='lru', **kwargs) -> PageCache:
+    '''
+    create a page cache by policy name, or by a PageCache subclass for custom policies
+    '''
+    if isinstance(policy, type) and issubclass(policy, PageCache):
+        return policy(**kwargs)
+    try:
+        return cache_policy_map[policy](**kwargs)
+    except KeyError:
+        raise ValueError('unknown cache policy: {policy}'.format(policy=policy))
+
+
+class ReadWriteLock():
+    '''
+    many readers or a single writer. Waiting writers are preferred so a stream of readers
+    cannot starve them. Both sides are re-entrant, and the writer may also take the read side,
+    but a reader cannot upgrade itself to a writer.
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writer = None
+        self._write_depth = 0
+        self._local = threading.local()
+
+    @property
+    def write_depth(self) -> int:
+        '''
+        nesting level of the write side held by the current thread
+        '''
+        return self._write_depth if self._writer == threading.get_ident() else 0
+
+    def acquire_read(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.depth = depth + 1
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+
+    def release_read(self):
+        self._local.depth -= 1
+        if self._local.depth or self._writer == threading.get_ident():
+            return
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._write_depth += 1
+            return
+        if getattr(self._local, 'depth', 0):
+            raise RuntimeError('cannot upgrade a read lock to a write lock')
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        self._write_depth -= 1
+        if self._write_depth:
+            return
+        with self._cond:
+            self._writer = None
+            self._cond.notify_all()
+
+
+class FreePageMap():
+    '''
+    free pages of the db file, one byte per page. The free page nearest to a hint is found by
+    bytearray.find / rfind, the smallest one from a low-water mark, without any O(n) list shift.
+    '''
+    __slots__ = ('_map', '_count', '_lowest')
+
+    def __init__(self, pages=()):
+        self._map = bytearray()
+        self._count = 0
+        # no page below is free
+        self._lowest = 0
+        for page in pages:
+            self.add(page)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, page: int) -> bool:
+        return page < len(self._map) and self._map[page] == 1
+
+    def __iter__(self):
+        '''
+        the free pages in ascending order
+        '''
+        page = self._map.find(1, self._lowest)
+        while page != -1:
+            yield page
+            page = self._map.find(1, page + 1)
+
+    def add(self, page: int):
+        if page >= len(self._map):
+            # grown geometrically, pages are freed one by one
+            self._map.extend(bytes(max(page + 1 - len(self._map), len(self._map))))
+        if not self._map[page]:
+            self._map[page] = 1
+            self._count += 1
+            self._lowest = min(self._lowest, page)
+
+    def discard(self, page: int):
+        if page in self:
+            self._map[page] = 0
+            self._count -= 1
+
+    def pop(self, near: int = None) -> int:
+        '''
+        take the free page nearest to near, or the smallest one
+        :raise KeyError: no page is free
+        '''
+        if not self._count:
+            raise KeyError('no free page')
+        if near is None:
+            page = self._map.find(1, self._lowest)
+            self._lowest = page + 1
+        else:
+            after = self._map.find(1, max(near, self._lowest))
+            before = self._map.rfind(1, self._lowest, max(near, self._lowest))
+            if before == -1 or (after != -1 and after - near <= near - before):
+                page = after
+            else:
+                page = before
+        self._map[page] = 0
+        self._count -= 1
+        return page
+
+    def truncate(self, last_page: int):
+        '''
+        forget the pages after last_page, they are cut off the db file
+        '''
+        self._count -= self._map.count(1, last_page + 1)
+        del self._map[last_page+1:]
+
+
+def _spill_run(items: list, batch_size: int = 1024):
+    '''
+    write a sorted run into a temporary file, return a generator reading it back
+    '''
+    run_file = tempfile.TemporaryFile()
+    for first in range(0, len(items), batch_size):
+        pickle.dump(items[first:first+batch_size], run_file, pickle.HIGHEST_PROTOCOL)
+    run_file.seek(0)
+
+    def read_back():
+        with run_file:
+            while True:
+                try:
+                    yield from pickle.load(run_file)
+                except EOFError:
+                    return
+    return read_back()
+
+
+def external_sort(iterable, key=None, buffer_size: int = 100000):
+    '''
+    sort an iterable which may not fit in the memory: sorted runs of buffer_size items are
+    spilled into temporary files, then merged lazily
+    '''
+    runs = []
+    buffer = []
+    for item in iterable:
+        buffer.append(item)
+        if len(buffer) >= buffer_size:
+            buffer.sort(key=key)
+            runs.append(_spill_run(buffer))
+            buffer = []
+    buffer.sort(key=key)
+    if not runs:
+        yield from buffer
+        return
+    runs.append(iter(buffer))
+    yield from heapq.merge(*runs, key=key)
 
 
 def open_database_file(filename, suffix='.xdb') -> io.FileIO:
     '''
     Open a file in binary mode, if not exist then create it
     '''
-    if os.path.exist(filename):
+    if os.path.exists(filename+suffix):
         '''
         buffering is an optional integer used to set the buffering policy. Pass 0 to switch buffering off (only allowed in binary mode), 1 to select line buffering (only usable in text mode), and an integer > 1 to indicate the size in bytes of a fixed-size chunk buffer. When no buffering argument is given, the default buffering policy works as follows:
 
@@ -63,39 +575,289 @@ def open_database_file(filename, suffix='.xdb') -> io.FileIO:
         f = open(filename+suffix, 'rb+', buffering=0)
     else:
         fd = os.open(filename+suffix, os.O_RDWR | os.O_CREAT)
-        f= os.fdopen(fd, 'rb+')
+        f = os.fdopen(fd, 'rb+', buffering=0)
     return f
 
 
-def write_to_file(file_id: io.FileIO, data: bytes, f_sync: bool = False):
-    length_to_write = len(data)
+def write_to_file(file_id: io.FileIO, data: bytes, offset: int, f_sync: bool = False, stats: IOStats = None):
+    '''
+    write data at the given offset with pwrite, the file position is neither used nor moved
+    so concurrent readers are not disturbed
+    :param stats: records the fsync
+    '''
+    fileno = file_id.fileno()
+    view = memoryview(data)
     written = 0
-    while written < length_to_write:
-        wirtten = file_id.write(data[written:])
+    while written < len(view):
+        written += os.pwrite(fileno, view[written:], offset + written)
+    if f_sync:
+        file_flush_and_sync(file_id, stats)
+
+
+# most systems refuse more buffers in a single preadv/pwritev
+IOV_MAX = 1024
+
+
+def writev_to_file(file_id: io.FileIO, buffers: list, offset: int, f_sync: bool = False, stats: IOStats = None):
+    '''
+    write several contiguous buffers (e.g. a run of pages) with a single pwritev
+    :param stats: records the fsync
+    '''
+    if not hasattr(os, 'pwritev'):
+        write_to_file(file_id, b''.join(buffers), offset, f_sync, stats)
+        return
+
+    fileno = file_id.fileno()
+    for first in range(0, len(buffers), IOV_MAX):
+        chunk = buffers[first:first+IOV_MAX]
+        length_to_write = sum(len(buf) for buf in chunk)
+        written = os.pwritev(fileno, chunk, offset)
+        if written < length_to_write:
+            # short write, finish the rest without vectoring
+            write_to_file(file_id, b''.join(chunk)[written:], offset + written)
+        offset += length_to_write
     if f_sync:
-        file_flush_and_sync(file_id)
+        file_flush_and_sync(file_id, stats)
 
 
-def file_flush_and_sync(f: io.FileIO):
+def file_flush_and_sync(f: io.FileIO, stats: IOStats = None):
     # If you’re starting with a buffered Python file object f, first do f.flush(), and then do os.fsync(f.fileno()), to ensure that all internal buffers associated with f are written to disk.
     f.flush()
+    if stats is None:
+        os.fsync(f.fileno())
+        return
+    start = time.perf_counter()
     os.fsync(f.fileno())
+    stats.fsync_latency.record(time.perf_counter() - start)
+
+
+def file_size(f: io.FileIO) -> int:
+    return os.fstat(f.fileno()).st_size
 
 
 class EndOfFileError(Exception):
     pass
 
 
+class ChecksumError(Exception):
+    pass
+
+
+def seal_page(data: bytearray) -> bytes:
+    '''
+    store the CRC32 of the page in its last CHECKSUM_LENGTH bytes
+    '''
+    end = len(data) - constants.CHECKSUM_LENGTH
+    data[end:] = zlib.crc32(memoryview(data)[:end]).to_bytes(constants.CHECKSUM_LENGTH, constants.ENDIAN)
+    return bytes(data)
+
+
+def page_is_intact(data: bytes) -> bool:
+    end = len(data) - constants.CHECKSUM_LENGTH
+    return zlib.crc32(memoryview(data)[:end]) == int.from_bytes(data[end:], constants.ENDIAN)
+
+
+def verify_pages(file_name: str, page_size: int, first_page: int, count: int) -> list:
+    '''
+    check the checksums of count pages from first_page read at once, run by the workers of
+    FileHandler.verify. Pages never written, all zeros, are skipped.
+    :return: the corrupted pages
+    '''
+    with open(file_name, 'rb', buffering=0) as file_fd:
+        data = os.pread(file_fd.fileno(), page_size * count, first_page * page_size)
+    view = memoryview(data)
+    empty = bytes(page_size)
+    corrupted = []
+    for index in range(len(data) // page_size):
+        page_data = view[index*page_size:(index+1)*page_size]
+        if not page_is_intact(page_data) and page_data != empty:
+            corrupted.append(first_page + index)
+    return corrupted
+
+
 def read_from_file(file_fd: io.FileIO, start: int, end: int) -> bytes:
+    '''
+    read [start, end) with pread, safe to be called from several threads on the same file
+    '''
     length = end - start
     assert length >= 0
-    file_fd.seek(start)
-    data = bytes()
-    while file_fd.tell() < end:
-        # The read() (when called with a positive argument), readinto() and write() methods on this class will only make one system call.
-        read_data = file_fd.read(end - file_fd.tell())
-        if read_data == b'':
-            raise EndOfFileError('read until the end of file_fd')
-        data += read_data
-    assert len(data) == length
-    return data
\ No newline at end of file
+    fileno = file_fd.fileno()
+    data = os.pread(fileno, length, start)
+    if len(data) < length:
+        # short read, keep reading into a buffer until complete or the end of file
+        buf = bytearray(data)
+        while len(buf) < length:
+            read_data = os.pread(fileno, length - len(buf), start + len(buf))
+            if read_data == b'':
+                raise EndOfFileError('read until the end of file_fd')
+            buf += read_data
+        data = bytes(buf)
+    return data
+
+
+def readv_from_file(file_fd: io.FileIO, start: int, length: int, count: int) -> list:
+    '''
+    read `count` contiguous blocks of `length` bytes from `start` with a single preadv
+    '''
+    if not hasattr(os, 'preadv'):
+        data = read_from_file(file_fd, start, start + length * count)
+        return [data[i*length:(i+1)*length] for i in range(count)]
+
+    buffers = [bytearray(length) for _ in range(count)]
+    for first in range(0, count, IOV_MAX):
+        chunk_start = start + first * length
+        chunk = buffers[first:first+IOV_MAX]
+        read = os.preadv(file_fd.fileno(), chunk, chunk_start)
+        if read < length * len(chunk):
+            # short read, fetch what is missing block by block
+            for i in range(first + read // length, first + len(chunk)):
+                block_start = start + i * length
+                buffers[i] = read_from_file(file_fd, block_start, block_start + length)
+    return buffers
+
+
+def advise_willneed(file_fd: io.FileIO, start: int, length: int):
+    '''
+    hint the kernel to read [start, start + length) ahead asynchronously, no-op where unsupported
+    '''
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(file_fd.fileno(), start, length, os.POSIX_FADV_WILLNEED)
+
+
+class ReadAhead():
+    '''
+    read runs of pages on a background thread before they are requested. preadv releases the GIL,
+    so the disk works while the caller parses the pages already read.
+
+    Runs are scheduled by the caller, either given by a scan knowing which pages come next,
+    or suggested by note_access once the requested pages turn out to be consecutive: the window
+    then doubles at every step up to max_pages, like the read-ahead of the kernel.
+    Pages are kept raw until taken, each one is handed out once.
+    '''
+    __slots__ = ('_file', '_page_size', '_max_pages', '_buffer', '_inflight', '_cond', '_queue', '_thread', '_epoch',
+                 '_last', '_streak', '_window', '_ahead')
+
+    def __init__(self, file_fd: io.FileIO, page_size: int, max_pages: int = constants.READAHEAD_PAGES):
+        self._file = file_fd
+        self._page_size = page_size
+        self._max_pages = max_pages
+        # page -> raw data read ahead
+        self._buffer = OrderedDict()
+        # page -> epoch of the run being read
+        self._inflight = dict()
+        self._cond = threading.Condition(threading.Lock())
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        # bumped whenever the file is written, reads started before are dropped
+        self._epoch = 0
+        self._last = None
+        self._streak = 0
+        self._window = min(constants.READAHEAD_MIN_PAGES, max_pages)
+        self._ahead = -1
+
+    @property
+    def max_pages(self) -> int:
+        return self._max_pages
+
+    def holds(self, page: int) -> bool:
+        '''
+        the page is read ahead or being read
+        '''
+        with self._cond:
+            return page in self._buffer or page in self._inflight
+
+    def note_access(self, page: int) -> range:
+        '''
+        record a page read by the caller
+        :return: the pages worth reading ahead, empty unless the access is sequential
+        '''
+        with self._cond:
+            if self._last is not None and page == self._last + 1:
+                self._streak += 1
+            else:
+                self._streak = 0
+                self._window = min(constants.READAHEAD_MIN_PAGES, self._max_pages)
+                self._ahead = page
+            self._last = page
+            if self._streak < constants.READAHEAD_TRIGGER or self._ahead - page > self._window // 2:
+                # not sequential yet, or still far enough ahead
+                return range(0)
+            first = max(self._ahead, page) + 1
+            self._ahead = page + self._window
+            self._window = min(self._window * 2, self._max_pages)
+            return range(first, self._ahead + 1)
+
+    def schedule(self, first_page: int, count: int):
+        '''
+        read count pages from first_page in the background
+        '''
+        with self._cond:
+            for page in range(first_page, first_page + count):
+                self._inflight[page] = self._epoch
+            task = (first_page, count, self._epoch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='xiaolongbaodb-readahead', daemon=True)
+                self._thread.start()
+        self._queue.put(task)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            first_page, count, epoch = task
+            buffers = None
+            try:
+                if epoch == self._epoch:
+                    buffers = readv_from_file(self._file, first_page * self._page_size, self._page_size, count)
+            except (EndOfFileError, OSError):
+                # cut by a truncation, the caller reads the pages itself
+                pass
+            finally:
+                with self._cond:
+                    keep = buffers is not None and epoch == self._epoch
+                    for offset in range(count):
+                        page = first_page + offset
+                        if self._inflight.get(page) == epoch:
+                            del self._inflight[page]
+                        if keep:
+                            self._buffer[page] = buffers[offset]
+                            self._buffer.move_to_end(page)
+                    while len(self._buffer) > self._max_pages * 2:
+                        self._buffer.popitem(last=False)
+                    self._cond.notify_all()
+
+    def take(self, page: int) -> bytes:
+        '''
+        hand out a page read ahead, waiting for it when it is being read
+        :return: the raw page, None when it was not read ahead
+        '''
+        with self._cond:
+            while page in self._inflight:
+                self._cond.wait()
+            return self._buffer.pop(page, None)
+
+    def invalidate(self, first_page: int = None, count: int = 0):
+        '''
+        forget the pages just written, every page when first_page is None.
+        Reads still running were started before the write, their pages are dropped as well
+        '''
+        with self._cond:
+            self._epoch += 1
+            self._inflight.clear()
+            if first_page is None:
+                self._buffer.clear()
+            else:
+                for page in range(first_page, first_page + count):
+                    self._buffer.pop(page, None)
+            self._cond.notify_all()
+
+    def close(self):
+        '''
+        stop the background thread, before the file is closed
+        '''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.invalidate()